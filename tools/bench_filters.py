@@ -0,0 +1,91 @@
+"""Time the /tlist and /texport query path for every filter shape.
+
+Builds a scratch database with `alembic upgrade head`, fills it with synthetic
+trades, then runs each compiled filter shape (first page + totals, and the
+full export query) through trading_bot's own templates.
+
+Usage: python tools/bench_filters.py [--rows 200000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from check_query_plans import BOT_DIR, build_db, filter_shapes
+
+USERS = 40
+STOCKS = [f"S{i:03d}" for i in range(150)] + ["BBCA"]
+
+
+def fill(path: str, rows: int):
+    """Synthetic trades over two years plus the matching daily_pnl rollup."""
+    rng = random.Random(42)
+    start = date(2024, 1, 1)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany("INSERT INTO users (id, username, display_name) VALUES (?, ?, ?)",
+                         [(1000 + i, f"user{i}", f"User{i}") for i in range(1, USERS + 1)])
+        conn.executemany(
+            "INSERT INTO logs (user_id, stock, amount, date) VALUES (?, ?, ?, ?)",
+            ((1000 + rng.randint(1, USERS), rng.choice(STOCKS), round(rng.gauss(0, 2_000_000), -3),
+              (start + timedelta(days=rng.randrange(730))).isoformat()) for _ in range(rows))
+        )
+        conn.execute(
+            "INSERT INTO daily_pnl (date, user_id, stock, total, count) "
+            "SELECT date, user_id, stock, SUM(amount), COUNT(*) FROM logs GROUP BY date, user_id, stock"
+        )
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def timed(fn, repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def p99(samples: list[float]) -> float:
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        build_db(db_path)
+        t0 = time.perf_counter()
+        fill(db_path, opts.rows)
+        print(f"🗄️ {opts.rows:,} trades generated in {time.perf_counter() - t0:.1f}s\n")
+        os.environ["TRADING_DB_PATH"] = db_path
+        sys.path.insert(0, str(BOT_DIR))
+        import trading_bot as tb
+
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, isolation_level=None,
+                               cached_statements=tb.DB_STATEMENT_CACHE)
+        print(f"{'shape':<34} {'page p50':>9} {'page p99':>9} {'export p50':>11} {'rows':>8}")
+        for label, filt in filter_shapes(tb, tb.TRADE_FILTERS, tb.TRADE_SORTS):
+            page = timed(lambda: tb._trade_page(conn, filt, None, None, tb.TLIST_PAGE_SIZE, True), opts.repeat)
+            query = tb.trade_query(filt["where"], filt["sort"])
+            params = (*filt["params"], -1)
+            export = timed(lambda: conn.execute(query, params).fetchall(), max(1, opts.repeat // 4))
+            count = len(conn.execute(query, params).fetchall())
+            print(f"{label:<34} {statistics.median(page):>7.2f}ms {p99(page):>7.2f}ms "
+                  f"{statistics.median(export):>9.2f}ms {count:>8,}")
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
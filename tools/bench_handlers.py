@@ -0,0 +1,190 @@
+"""Time the real command handlers against a generated trades.db.
+
+Generates a database with `alembic upgrade head` (logs, positions, users and the
+daily_pnl rollup, dates spread over the last two years), then awaits the
+handler coroutines themselves with fake Update/Context objects whose replies are
+captured instead of sent. Prints p50/p99 latency and peak traced memory per
+command. The result cache is off unless --cache is given, so every run hits SQLite.
+
+Pass --db to keep the generated database and reuse it on the next run, so the
+same data can be measured before and after a change.
+
+Usage: python tools/bench_handlers.py [--rows 100000] [--users 200] [--symbols 500]
+                                      [--repeat 20] [--db bench.db] [--cache] [--only tlist,pall]
+"""
+import argparse
+import asyncio
+import io
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+from check_query_plans import BOT_DIR, build_db
+
+USER_ID = 1001  # the fake sender; `--user me` and /me resolve to this account
+
+# label -> (handler name, args)
+COMMANDS = {
+    "tlist": ("trade_list", []),
+    "tlist --user me": ("trade_list", ["--user", "me"]),
+    "tlist --symbol --sort best": ("trade_list", ["--symbol", "S000", "--sort", "best"]),
+    "texport --user me": ("trade_export", ["--user", "me"]),
+    "texport --from (30d) --gzip": ("trade_export", ["--from", (date.today() - timedelta(days=30)).isoformat(), "--gzip"]),
+    "pall": ("pos_all", []),
+    "plist --user me": ("pos_list", ["--user", "me"]),
+    "rc monthly": ("recap_command", ["monthly"]),
+    "wd": ("weekly", []),
+    "lb": ("leaderboard", []),
+    "s S000": ("stock", ["S000"]),
+    "me": ("mystats", []),
+}
+
+
+def fill(path: str, rows: int, users: int, symbols: int, positions: int):
+    """Synthetic trades and positions plus the matching daily_pnl rollup."""
+    rng = random.Random(42)
+    stocks = [f"S{i:03d}" for i in range(symbols)]
+    start = date.today() - timedelta(days=729)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany("INSERT INTO users (id, username, display_name) VALUES (?, ?, ?)",
+                         [(1000 + i, f"user{i}", f"User{i}") for i in range(1, users + 1)])
+        conn.executemany(
+            "INSERT INTO logs (user_id, stock, amount, date) VALUES (?, ?, ?, ?)",
+            ((1000 + rng.randint(1, users), rng.choice(stocks), round(rng.gauss(0, 2_000_000), -3),
+              (start + timedelta(days=rng.randrange(730))).isoformat()) for _ in range(rows))
+        )
+        conn.execute(
+            "INSERT INTO daily_pnl (date, user_id, stock, total, count) "
+            "SELECT date, user_id, stock, SUM(amount), COUNT(*) FROM logs GROUP BY date, user_id, stock"
+        )
+        conn.executemany(
+            "INSERT INTO positions (user_id, stock, quantity, avg_price, date) VALUES (?, ?, ?, ?, ?)",
+            ((1000 + rng.randint(1, users), rng.choice(stocks), rng.randrange(1, 500), round(rng.uniform(50, 9000), 2),
+              (start + timedelta(days=rng.randrange(730))).isoformat()) for _ in range(positions))
+        )
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+class FakeMessage:
+    """Stands in for telegram.Message (and its bot): replies are recorded, never sent."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.chat_id = -1001
+        self.chat = SimpleNamespace(id=self.chat_id, type="supergroup")
+        self.message_id = 1
+        self.replies = []  # (kind, size in chars/bytes)
+
+    def get_bot(self):
+        return self
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(("text", len(text)))
+
+    async def reply_document(self, document, **kwargs):
+        if isinstance(document, io.BytesIO):
+            size = document.getbuffer().nbytes
+        else:
+            size = len(document) if isinstance(document, bytes) else len(document.read())
+        self.replies.append(("document", size))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self.reply_text(text)
+
+    async def send_document(self, chat_id, document, **kwargs):
+        await self.reply_document(document)
+
+
+def fake_call(command: str, args: list[str]):
+    message = FakeMessage(" ".join([f"/{command}", *args]))
+    update = SimpleNamespace(
+        message=message,
+        effective_user=SimpleNamespace(id=USER_ID, username="user1", first_name="User1"),
+        effective_chat=SimpleNamespace(id=message.chat_id, type="supergroup"),
+        callback_query=None,
+    )
+    context = SimpleNamespace(args=list(args), chat_data={}, user_data={}, bot=None)
+    return update, context
+
+
+async def run_once(tb, handler, args) -> FakeMessage:
+    update, context = fake_call(handler.__name__, args)
+    errors = sum(tb.metrics._errors.values())
+    await handler(update, context)
+    # safe_handler answers exceptions with a reply instead of raising.
+    if sum(tb.metrics._errors.values()) != errors:
+        raise RuntimeError(f"{handler.__name__} {args} failed; see the error printed above")
+    tb.command_cleaner._pending.clear()
+    return update.message
+
+
+async def bench(tb, repeat: int, only: set[str] | None):
+    print(f"{'command':<30} {'p50':>9} {'p99':>9} {'peak MB':>8}  replies")
+    for label, (name, args) in COMMANDS.items():
+        if only and label.split()[0] not in only:
+            continue
+        handler = getattr(tb, name)
+        message = await run_once(tb, handler, args)  # warm-up: statement cache, user row
+        samples = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            await run_once(tb, handler, args)
+            samples.append((time.perf_counter() - t0) * 1000)
+        tracemalloc.start()
+        await run_once(tb, handler, args)
+        peak = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+        samples.sort()
+        p50 = samples[len(samples) // 2]
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        replies = ", ".join(f"{kind} {size:,}" for kind, size in message.replies)
+        print(f"{label:<30} {p50:>7.1f}ms {p99:>7.1f}ms {peak:>8.1f}  {replies}")
+    tb.reader_pool.close()
+    tb.db_writer.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000, help="trades (logs rows), e.g. 10000 to 5000000")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--positions", type=int, help="positions rows (default rows / 10)")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--db", help="keep the generated database here and reuse it if it exists")
+    parser.add_argument("--cache", action="store_true", help="leave the result cache on (warm numbers)")
+    parser.add_argument("--only", help="comma-separated commands, e.g. tlist,pall,lb")
+    opts = parser.parse_args()
+    if opts.users < 1 or opts.symbols < 1:
+        parser.error("--users and --symbols must be at least 1")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = opts.db or os.path.join(tmp, "bench.db")
+        if not os.path.exists(db_path):
+            build_db(db_path)
+            t0 = time.perf_counter()
+            positions = opts.rows // 10 if opts.positions is None else opts.positions
+            fill(db_path, opts.rows, opts.users, opts.symbols, positions)
+            print(f"🗄️ {opts.rows:,} trades, {positions:,} positions generated in {time.perf_counter() - t0:.1f}s\n")
+        else:
+            print(f"🗄️ Reusing {db_path}\n")
+        os.environ["TRADING_DB_PATH"] = db_path
+        if not opts.cache:
+            os.environ["TRADING_RESULT_CACHE_SIZE"] = "0"
+        sys.path.insert(0, str(BOT_DIR))
+        import trading_bot as tb
+
+        only = {name.strip().lstrip("/") for name in opts.only.split(",")} if opts.only else None
+        asyncio.run(bench(tb, opts.repeat, only))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
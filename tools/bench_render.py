@@ -0,0 +1,115 @@
+"""Time report rendering and chunking on 50k-row replies.
+
+Compares the old `msg +=` string building with trading_bot.Report for a few
+report shapes, checks every chunk stays under Telegram's limit, then renders
+/pall end to end from a scratch database holding the same number of positions.
+
+Usage: python tools/bench_render.py [--rows 50000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from check_query_plans import BOT_DIR, build_db
+
+
+def sample_rows(rows: int, users: int):
+    rng = random.Random(7)
+    return [(i, f"User{rng.randrange(users)}", f"S{rng.randrange(300):03d}", rng.randrange(1, 50_000), rng.uniform(50, 9000))
+            for i in range(1, rows + 1)]
+
+
+def concat_render(rows) -> str:
+    """What the handlers did before Report: grow one string per line."""
+    summary = {}
+    for id_, user, stock, quantity, avg_price in rows:
+        summary.setdefault(user, []).append((id_, stock, quantity, avg_price))
+    msg = "📊 All Positions:\n\n"
+    for user, positions in summary.items():
+        msg += f"{user}:\n"
+        for id_, stock, quantity, avg_price in positions:
+            msg += f"  - [{id_}] {stock}: Qty={quantity}, Avg Price={avg_price}\n"
+        msg += "\n"
+    return msg
+
+
+def report_render(tb, rows):
+    summary = {}
+    for id_, user, stock, quantity, avg_price in rows:
+        summary.setdefault(user, []).append((id_, stock, quantity, avg_price))
+    report = tb.Report("📊 All Positions:")
+    for user, positions in summary.items():
+        lines = report.section(f"{user}:")
+        for id_, stock, quantity, avg_price in positions:
+            lines.append(f"  - [{id_}] {stock}: Qty={quantity}, Avg Price={avg_price}")
+    return report
+
+
+def measure(fn):
+    """(result, elapsed ms, peak MB); timed and memory-traced in separate runs."""
+    t0 = time.perf_counter()
+    result = fn()
+    elapsed = (time.perf_counter() - t0) * 1000
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+async def render_pos_all_from_db(tb, rows):
+    conn = sqlite3.connect(tb.DB_PATH)
+    with conn:
+        conn.executemany("INSERT INTO users (id, username, display_name) VALUES (?, NULL, ?)",
+                         [(1000 + i, f"User{i}") for i in range(200)])
+        conn.executemany(
+            "INSERT INTO positions (user_id, stock, quantity, avg_price, date) VALUES (?, ?, ?, ?, '2026-01-01')",
+            [(1000 + int(user[4:]), stock, qty, avg) for _, user, stock, qty, avg in rows]
+        )
+    conn.close()
+    t0 = time.perf_counter()
+    report = await tb.render_pos_all()
+    chunks = report.chunks()
+    elapsed = (time.perf_counter() - t0) * 1000
+    tb.reader_pool.close()
+    tb.db_writer.close()
+    return report, chunks, elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50_000)
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "render.db")
+        build_db(db_path)
+        os.environ["TRADING_DB_PATH"] = db_path
+        sys.path.insert(0, str(BOT_DIR))
+        import trading_bot as tb
+
+        print(f"{'shape':<28} {'msg +=':>10} {'peak MB':>8} {'Report':>10} {'peak MB':>8} {'chunks':>7}")
+        for label, users in (("200 users", 200), ("5 users (long sections)", 5), ("1 user (one section)", 1)):
+            rows = sample_rows(opts.rows, users)
+            text, concat_ms, concat_peak = measure(lambda: concat_render(rows))
+            (report, chunks), report_ms, peak = measure(lambda: (lambda r: (r, r.chunks()))(report_render(tb, rows)))
+            assert all(len(chunk) <= tb.MESSAGE_CHUNK_CHARS for chunk in chunks)
+            assert "\n".join(chunks).replace("\n", "") == report.text().replace("\n", "")
+            assert report.text() == text.rstrip("\n")
+            print(f"{label:<28} {concat_ms:>8.1f}ms {concat_peak:>8.1f} {report_ms:>8.1f}ms {peak:>8.1f} {len(chunks):>7}")
+
+        report, chunks, elapsed = asyncio.run(render_pos_all_from_db(tb, sample_rows(opts.rows, 200)))
+        mode = "document" if len(report.text()) > tb.REPORT_DOCUMENT_CHARS else "messages"
+        print(f"\n/pall from SQLite: {elapsed:.1f}ms for {opts.rows:,} positions → "
+              f"{len(report.text()):,} chars, {len(chunks)} chunks, sent as {mode}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""Replay recorded Telegram updates against trading_bot's webhook listener.
+
+Starts WebhookServer on a local port (no Telegram connection needed), decodes every
+push into a telegram.Update like the bot does, and posts the updates over
+--connections keep-alive connections. Checks that each update arrived exactly once
+and intact, that a wrong secret and an unknown path are refused, that /metrics and
+/healthz are only served by the separate metrics listener, then prints the throughput.
+
+Updates come from --updates (a JSON array, or one Update object per line, e.g.
+saved from getUpdates) or are generated as /tlist commands from a few chats.
+
+Usage: python tools/bench_webhook.py [--updates FILE] [--count 5000] [--connections 40]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+
+from check_query_plans import BOT_DIR
+
+SECRET = "bench-secret"
+PATH = "/telegram"
+
+
+def load_updates(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def sample_updates(count: int) -> list[dict]:
+    return [{
+        "update_id": 10_000 + i,
+        "message": {
+            "message_id": i + 1,
+            "date": 1_760_000_000 + i,
+            "chat": {"id": -1001000 - i % 5, "type": "supergroup", "title": "Trading"},
+            "from": {"id": 1000 + i % 50, "is_bot": False, "first_name": f"User{i % 50}"},
+            "text": "/tlist --sort best",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    } for i in range(count)]
+
+
+async def replay(tb, updates: list[dict], connections: int):
+    received = []
+
+    async def handle(data):
+        received.append(tb.Update.de_json(data, None))
+
+    server = tb.WebhookServer(PATH, SECRET, handle)
+    port = await server.start("127.0.0.1", 0)
+    base = f"http://127.0.0.1:{port}"
+    metrics_server = tb.MetricsServer()
+    metrics_server.webhook = server
+    metrics_port = await metrics_server.start("127.0.0.1", 0)
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    try:
+        async with httpx.AsyncClient(base_url=base, limits=limits) as client:
+            headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+            pending = iter(updates)
+
+            async def worker():
+                for update in pending:
+                    resp = await client.post(PATH, content=json.dumps(update), headers=headers)
+                    assert resp.status_code == 200, resp.status_code
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(connections)))
+            elapsed = time.perf_counter() - t0
+
+            bad = await client.post(PATH, content=json.dumps(updates[0]),
+                                    headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+            assert bad.status_code == 403, bad.status_code
+            assert (await client.post("/other", content=b"{}", headers=headers)).status_code == 404
+            for path in (tb.MetricsServer.HEALTH_PATH, tb.MetricsServer.METRICS_PATH):
+                assert (await client.get(path)).status_code == 404, path
+            health = await client.get(f"http://127.0.0.1:{metrics_port}{tb.MetricsServer.HEALTH_PATH}")
+            assert health.status_code == 200 and health.json()["updates"] == len(updates), health.text
+    finally:
+        await metrics_server.close()
+        await server.close()
+
+    assert sorted(u.update_id for u in received) == sorted(u["update_id"] for u in updates)
+    by_id = {u.update_id: u for u in received}
+    for update in updates:
+        assert by_id[update["update_id"]].to_dict() == tb.Update.de_json(update, None).to_dict()
+    return elapsed, server.rejected
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", help="recorded updates (JSON array or JSON lines)")
+    parser.add_argument("--count", type=int, default=5000, help="synthetic updates when --updates is not given")
+    parser.add_argument("--connections", type=int, default=40, help="Telegram's default max_connections")
+    opts = parser.parse_args()
+
+    updates = load_updates(opts.updates) if opts.updates else sample_updates(opts.count)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["TRADING_DB_PATH"] = os.path.join(tmp, "webhook.db")
+        sys.path.insert(0, str(BOT_DIR))
+        import trading_bot as tb
+
+        elapsed, rejected = asyncio.run(replay(tb, updates, opts.connections))
+    print(f"{len(updates):,} updates over {opts.connections} connections in {elapsed * 1000:.0f}ms "
+          f"→ {len(updates) / elapsed:,.0f} updates/s (rejected as expected: {rejected})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
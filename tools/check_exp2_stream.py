@@ -0,0 +1,72 @@
+"""Fail if the Wiguna bot's streaming /exp2 parser disagrees with json.loads.
+
+Feeds sample responses (top-level arrays and {"data": [...]} objects with
+floats, exponents, negatives, strings and nested records) to
+wiguna_bot.iter_json_records in every chunk size from 1 byte to the whole
+body, so each element gets split at every possible point.
+
+Usage: python tools/check_exp2_stream.py [-v]   (-v prints every sample, not only failures)
+"""
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+BOT_DIR = Path(__file__).resolve().parent.parent / "wiguna_bot"
+
+SAMPLES = [
+    '[1.25, 3.5]',
+    '[1, 22, 333, -4.0e-2, 5E+3, 6.5e10, 0, -0.5]',
+    '{"data": [1.25, 2e5, 3]}',
+    '{"status": "ok", "count": 2.5, "data": [{"kode": "BBCA", "harga": 9875.5, "persen": -1.25e-1},'
+    ' {"kode": "TLKM", "harga": 3e3, "tags": ["a", "b]"], "x": {"y": [1.5]}}], "next": null}',
+    '[ "a,b", "c]\\"d", true, false, null, 12.75e-3 ]',
+    '{"meta": {"list": [9]}, "data": [\n  7.5,\n  8e1\n]}',
+    '[]',
+]
+
+
+async def stream(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def records(wb, data: bytes, size: int) -> list:
+    return [record async for record in wb.iter_json_records(stream(data, size))]
+
+
+def expected(text: str) -> list:
+    value = json.loads(text)
+    if isinstance(value, list):
+        return value
+    return next(v for v in value.values() if isinstance(v, list))
+
+
+def main(verbose: bool) -> int:
+    sys.path.insert(0, str(BOT_DIR))
+    import wiguna_bot as wb
+
+    failed = checked = 0
+    for text in SAMPLES:
+        data = text.encode()
+        want = expected(text)
+        problems = []
+        for size in range(1, len(data) + 1):
+            try:
+                got = asyncio.run(records(wb, data, size))
+            except ValueError as e:
+                got = f"ValueError: {e}"
+            if got != want:
+                problems.append(f"{size}-byte chunks: {got!r}")
+            checked += 1
+        if problems or verbose:
+            print(f"{'❌' if problems else '✅'} {' '.join(text.split())[:60]}")
+        for problem in problems[:5]:
+            print(f"    {problem}")
+        failed += bool(problems)
+    print(f"\n{len(SAMPLES)} samples in {checked} chunkings checked, {failed} parsed wrongly")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main("-v" in sys.argv[1:]))
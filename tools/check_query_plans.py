@@ -0,0 +1,116 @@
+"""Fail if any trading_bot report query falls back to a full table scan.
+
+Builds a throwaway database with `alembic upgrade head`, then runs
+EXPLAIN QUERY PLAN on every query the handlers issue.
+
+Usage: python tools/check_query_plans.py [-v]   (-v prints every plan, not only failures)
+"""
+import itertools
+import os
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+from alembic import command
+from alembic.config import Config
+
+BOT_DIR = Path(__file__).resolve().parent.parent / "trading_bot"
+
+
+def build_db(path: str):
+    cfg = Config(str(BOT_DIR / "alembic.ini"))
+    cfg.set_main_option("sqlalchemy.url", f"sqlite:///{path}")
+    command.upgrade(cfg, "head")
+
+
+# One sample value per flag; --user also runs with two matching ids (the IN template).
+SAMPLE_FLAGS = {"--symbol": "BBCA", "--from": "2025-01-01", "--to": "2025-12-31", "--min": "-1000", "--max": "1000"}
+INDEXED = ("user_id", "stock", "date")
+
+
+def filter_shapes(tb, filters, sorts):
+    """Every compiled filter the flag combinations of a listing command can produce."""
+    names = [flag for flag, _ in filters]
+    for n in range(len(names) + 1):
+        for combo in itertools.combinations(names, n):
+            for user_ids in ([1001], [1001, 1002]) if "--user" in combo else (None,):
+                flags = {flag: SAMPLE_FLAGS.get(flag, "x") for flag in combo}
+                for sort in sorts or (None,):
+                    if sort:
+                        flags["--sort"] = sort
+                    filt = tb.compile_filter(flags, filters, sorts, user_ids)
+                    label = "+".join(f.lstrip("-") + ("x2" if f == "--user" and len(user_ids) > 1 else "")
+                                     for f in combo) or "all"
+                    yield label + (f",{sort}" if sort else ""), filt
+
+
+def trade_list_shapes(tb):
+    """Every statement /tlist (first/next/prev page + totals) and /texport can produce."""
+    for label, filt in filter_shapes(tb, tb.TRADE_FILTERS, tb.TRADE_SORTS):
+        # Without a user/stock/date filter the listing reads everything by definition.
+        unindexed = not any(clause.split()[0] in INDEXED for clause in filt["where"])
+        key = ("2025-06-01", 100) if tb.TRADE_SORTS[filt["sort"]][0] == "date" else (0.0, 100)
+        yield f"tlist/texport[{label}]", tb.trade_query(filt["where"], filt["sort"]), (*filt["params"], 50), unindexed
+        for seek in ("next", "prev"):
+            yield (f"tlist-{seek}[{label}]", tb.trade_query(filt["where"], filt["sort"], seek),
+                   (*filt["params"], *key, 50), unindexed)
+        for limited in (False, True):
+            params = (*filt["params"], 50) if limited else filt["params"]
+            yield (f"tlist-totals{'-limit' if limited else ''}[{label}]",
+                   tb.trade_totals_query(filt["where"], filt["sort"], limited), params, unindexed)
+
+
+def queries(tb):
+    """(name, sql, params, full_scan_allowed)"""
+    yield from trade_list_shapes(tb)
+    yield "daily_recap", tb.SQL_DAILY_RECAP, ("2025-01-02",), False
+    yield "recap", tb.SQL_RECAP, ("2025-01-01",), False
+    yield "leaderboard", tb.SQL_LEADERBOARD, ("2025-01-01",), False
+    yield "stock", tb.SQL_STOCK, ("BBCA",), False
+    yield "mystats", tb.SQL_MYSTATS, (1001, "2025-01-01"), False
+    yield "pos_all", tb.SQL_POS_ALL, (), True
+    for label, filt in filter_shapes(tb, tb.POSITION_FILTERS, None):
+        yield f"plist/pexport[{label}]", tb.position_query(filt["where"]), (*filt["params"], 50), not filt["where"]
+    yield "user_by_username", tb.SQL_USER_BY_USERNAME, ("emje",), False
+    yield "user_by_name", tb.SQL_USER_BY_NAME, ("Emje",), False
+
+
+def plan_problems(plan: list[str], full_scan_allowed: bool) -> list[str]:
+    problems = []
+    for detail in plan:
+        words = detail.split()
+        if len(words) >= 2 and words[0] == "SCAN" and words[1] in ("logs", "positions", "daily_pnl", "users"):
+            if "INDEX" not in detail:
+                problems.append(f"table scan: {detail}")
+            elif not full_scan_allowed:
+                problems.append(f"full index scan: {detail}")
+    return problems
+
+
+def main(verbose: bool = False) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "plans.db")
+        build_db(db_path)
+        os.environ["TRADING_DB_PATH"] = db_path
+        sys.path.insert(0, str(BOT_DIR))
+        import trading_bot as tb
+
+        conn = sqlite3.connect(db_path)
+        failed = checked = 0
+        for name, query, params, full_scan_allowed in queries(tb):
+            plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+            problems = plan_problems(plan, full_scan_allowed)
+            checked += 1
+            if problems or verbose:
+                print(f"{'❌' if problems else '✅'} {name}: {' | '.join(plan)}")
+            for problem in problems:
+                print(f"    {problem}")
+            failed += bool(problems)
+        conn.close()
+    print(f"\n{checked} queries checked, {failed} with scan regressions")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main("-v" in sys.argv[1:]))
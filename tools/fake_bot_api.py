@@ -0,0 +1,235 @@
+"""Local stand-in for the Telegram Bot API (and the Wiguna API) for offline load tests.
+
+Point a bot at it with TRADING_TELEGRAM_API_URL / WIGUNA_TELEGRAM_API_URL (see
+tools/replay_load.py). Updates handed to push() are served by getUpdates;
+sendMessage, sendDocument, editMessageText, deleteMessage(s) and the other
+calls the bots make are answered with plausible results and logged with a
+timestamp, so a replay can measure queueing delay and reply latency. Files
+registered with add_file() are answered by getFile and downloadable from
+/file/bot<token>/<file_path>, so document updates such as /import replay too.
+
+Usage: python tools/fake_bot_api.py [--port 8081]   (serve until Ctrl+C)
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import sys
+import time
+import zlib
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+# Calls that answer a user (the first one after an update counts as its reply).
+REPLY_METHODS = {"sendMessage", "sendDocument", "editMessageText", "answerCallbackQuery"}
+# Wiguna API paths: canned JSON bodies (GETs carry an ETag and honour If-None-Match).
+WIGUNA_ROUTES = {
+    "/auth/token": {"token": "fake-token"},
+    "/recommendation/stockpick": {"message": "ok", "list": [
+        {"kode": kode, "entry": entry, "harga": harga, "persentase": round((harga - entry) * 100 / entry, 2),
+         "status": "open" if harga == entry else "tp" if harga > entry else "sl", "keterangan": f"Sinyal uji {i}" if i % 2 else None}
+        for i, kode in enumerate(["PSDN"] + [f"S{i:03d}" for i in range(1, 12)])
+        for entry, harga in [(1000 + 25 * i, 1000 + 25 * i + 15 * (i % 7 - 3))]]},
+    "/saham/exp2": {"data": [{"kode": f"S{i:03d}", "harga": 1000 + 25 * i, "volume": 1000 * (i + 1), "persen": round(i / 7, 2)}
+                             for i in range(40)]},
+}
+
+
+def parse_params(headers: dict, body: bytes) -> dict:
+    """Bot API parameters from a JSON, urlencoded or multipart request body."""
+    content_type = headers.get("content-type", "")
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename() is None:
+                params[name] = part.get_content().strip() if part.get_content_maintype() == "text" else ""
+            else:
+                params[name] = len(part.get_payload(decode=True) or b"")  # uploaded file: keep its size
+        return params
+    return dict(parse_qsl(body.decode("utf-8")))
+
+
+def wiguna_body(path: str, params: dict) -> dict:
+    """Canned Wiguna answer for path; stockpick honours its ?code= filter like the real API."""
+    body = WIGUNA_ROUTES[path]
+    code = params.get("code")
+    if code and "list" in body:
+        body = {**body, "list": [row for row in body["list"] if row["kode"] == code]}
+    return body
+
+
+def as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class FakeBotApi:
+    def __init__(self):
+        self.updates = []    # (update_id, update) waiting for getUpdates
+        self.delivered = {}  # update_id -> time handed to the bot
+        self.calls = []      # (time, method, chat_id, params) for every call except getUpdates
+        self.polling = asyncio.Event()  # set on the first getUpdates: the bot is up
+        self.wiguna_delay = 0.0  # seconds before each Wiguna API answer, to mimic its latency
+        self.files = {}      # file_id -> bytes answered by getFile and the file download route
+        self._arrived = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1_000_000)
+        self._server = None
+        self._connections = {}  # writer -> handler task
+
+    def push(self, update: dict) -> int:
+        """Queue an update (renumbered so offsets keep working); returns its update_id."""
+        update_id = next(self._update_ids)
+        self.updates.append((update_id, {**update, "update_id": update_id}))
+        self._arrived.set()
+        return update_id
+
+    def add_file(self, file_id: str, data: bytes):
+        """Serve data for file_id, e.g. the document of a captured /import update."""
+        self.files[file_id] = data
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in self._connections:
+                writer.close()
+            self._arrived.set()  # end pending long polls so their handlers can exit
+            await asyncio.gather(*self._connections.values(), return_exceptions=True)
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                _, target, _ = request_line.decode("latin-1").split()
+                length = int(headers.get("content-length") or 0)
+                body = await reader.readexactly(length) if length else b""
+                url = urlsplit(target)
+                params = parse_params(headers, body)
+                params.update(parse_qsl(url.query))
+                extra = ""
+                content_type = "application/json"
+                if url.path in WIGUNA_ROUTES:
+                    await asyncio.sleep(self.wiguna_delay)
+                    data = json.dumps(wiguna_body(url.path, params)).encode()
+                    etag = f'"{zlib.crc32(data):08x}"'
+                    status, extra = (304, "") if headers.get("if-none-match") == etag else (200, f"ETag: {etag}\r\n")
+                    data = data if status == 200 else b""
+                elif url.path.startswith("/file/bot"):
+                    status, data = self._download(url.path)
+                    content_type = "application/octet-stream"
+                else:
+                    status, payload = await self._route(url.path, params)
+                    data = json.dumps(payload).encode()
+                reason = {200: "OK", 304: "Not Modified", 400: "Bad Request"}.get(status, "Not Found")
+                writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n{extra}"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def _route(self, path: str, params: dict) -> tuple[int, dict]:
+        parts = path.strip("/").split("/")
+        if len(parts) != 2 or not parts[0].startswith("bot"):
+            return 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+        method = parts[1]
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": await self._get_updates(params)}
+        now = time.monotonic()
+        chat_id = as_int(params.get("chat_id"))
+        self.calls.append((now, method, chat_id, params))
+        if method == "getFile":
+            file_id = params.get("file_id")
+            if file_id not in self.files:
+                return 400, {"ok": False, "error_code": 400, "description": "Bad Request: invalid file_id"}
+            return 200, {"ok": True, "result": {"file_id": file_id, "file_unique_id": file_id,
+                                                 "file_size": len(self.files[file_id]),
+                                                 "file_path": f"documents/{file_id}"}}
+        return 200, {"ok": True, "result": self._result(method, chat_id, params)}
+
+    def _download(self, path: str) -> tuple[int, bytes]:
+        """/file/bot<token>/documents/<file_id> -> the bytes registered with add_file()."""
+        parts = path.strip("/").split("/")
+        data = self.files.get(parts[-1]) if len(parts) == 4 and parts[2] == "documents" else None
+        return (200, data) if data is not None else (404, b"")
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        self.polling.set()
+        offset = int(params.get("offset") or 0)
+        self.updates = [(uid, update) for uid, update in self.updates if uid >= offset]
+        if not self.updates:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                return []
+        batch = self.updates[:int(params.get("limit") or 100)]
+        now = time.monotonic()
+        for uid, _ in batch:
+            self.delivered.setdefault(uid, now)
+        return [update for _, update in batch]
+
+    def _result(self, method: str, chat_id, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "sendDocument", "editMessageText", "sendPhoto", "copyMessage"):
+            message = {"message_id": as_int(params.get("message_id")) or next(self._message_ids),
+                       "date": int(time.time()), "from": BOT_USER,
+                       "chat": {"id": chat_id, "type": "private" if isinstance(chat_id, int) and chat_id > 0 else "supergroup"}}
+            if "text" in params:
+                message["text"] = params["text"]
+            if method == "sendDocument":
+                message["document"] = {"file_id": "fake", "file_unique_id": "fake",
+                                       "file_name": params.get("filename") or "file"}
+            return message
+        return True  # deleteMessage(s), answerCallbackQuery, setWebhook, deleteWebhook, ...
+
+
+async def serve(port: int):
+    api = FakeBotApi()
+    bound = await api.start("127.0.0.1", port)
+    print(f"🧪 Fake Bot API on http://127.0.0.1:{bound} (set *_TELEGRAM_API_URL to this; Wiguna paths answered too)")
+    await asyncio.Event().wait()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8081)
+    opts = parser.parse_args()
+    try:
+        asyncio.run(serve(opts.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""Replay captured updates against a bot talking to a local fake Bot API.
+
+Capture real traffic first by running a bot with TRADING_CAPTURE_UPDATES (or
+WIGUNA_CAPTURE_UPDATES) set to a .jsonl path. This tool then starts
+tools/fake_bot_api.py in-process, launches the bot as a subprocess pointed at it
+(scratch database, no network), feeds the captured updates through getUpdates
+with their original spacing divided by --speed, and reports:
+
+- throughput: updates fed, updates answered and Bot API calls per second
+- queueing delay: update fed -> handed to the bot by getUpdates
+- reply latency: handed to the bot -> its first reply in that chat
+  (sendMessage, sendDocument, editMessageText or answerCallbackQuery)
+
+Replies are matched to the oldest unanswered update of the same chat, which holds
+because the bots keep per-chat order. Sends are still paced by the bot's own
+send scheduler, as in production.
+
+Captured documents (e.g. a CSV sent with caption /import) only carry a
+file_id; pass --file FILE_ID=PATH to have getFile and the download serve PATH
+for it. Without it the bot's getFile fails with "invalid file_id".
+
+Usage: python tools/replay_load.py CAPTURE.jsonl [--bot trading|wiguna] [--speed 10]
+                                   [--repeat 1] [--db trades.db] [--settle 30] [--wiguna-delay 0.5]
+                                   [--file FILE_ID=PATH ...]
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import signal
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from fake_bot_api import REPLY_METHODS, FakeBotApi
+
+ROOT = Path(__file__).resolve().parent.parent
+BOTS = {"trading": ROOT / "trading_bot" / "trading_bot.py", "wiguna": ROOT / "wiguna_bot" / "wiguna_bot.py"}
+
+
+def load_capture(path: str) -> list[tuple[float, dict]]:
+    """(seconds since the first update, update) from an update_recorder JSONL file."""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                records.append((record["t"], record["update"]))
+    if not records:
+        raise SystemExit(f"{path}: no updates captured")
+    start = records[0][0]
+    return [(t - start, update) for t, update in records]
+
+
+def update_chat(update: dict):
+    """Chat a reply to this update goes to, or the callback query id for button presses."""
+    if "callback_query" in update:
+        return ("callback", update["callback_query"]["id"])
+    for key in ("message", "edited_message", "channel_post"):
+        if key in update:
+            return ("chat", update[key]["chat"]["id"])
+    return None
+
+
+def bot_env(bot: str, api_url: str, tmp: str, db: str | None) -> dict:
+    env = dict(os.environ)
+    if bot == "trading":
+        db_path = os.path.join(tmp, "trades.db")
+        if db:
+            shutil.copy(db, db_path)
+        else:
+            from check_query_plans import build_db
+            build_db(db_path)
+        env.update(TRADING_BOT_TOKEN="123456:FAKE", TRADING_TELEGRAM_API_URL=api_url, TRADING_DB_PATH=db_path,
+                   TRADING_METRICS_PORT="0", TRADING_GROUP_ID="-1001")
+        env.pop("TRADING_WEBHOOK_URL", None)
+        env.pop("TRADING_CAPTURE_UPDATES", None)
+    else:
+        env.update(WIGUNA_BOT_TOKEN="123456:FAKE", WIGUNA_TELEGRAM_API_URL=api_url,
+                   WIGUNA_API_URL=f"{api_url}/recommendation/stockpick",
+                   WIGUNA_AUTH_URL=f"{api_url}/auth/token", WIGUNA_EXP2_URL=f"{api_url}/saham/exp2",
+                   WIGUNA_EMAIL="load@test", WIGUNA_PASSWORD="load", WIGUNA_METRICS_PORT="0")
+        env.pop("WIGUNA_WEBHOOK_URL", None)
+        env.pop("WIGUNA_CAPTURE_UPDATES", None)
+    return env
+
+
+def file_arg(value: str) -> tuple[str, str]:
+    file_id, sep, path = value.partition("=")
+    if not sep or not file_id or not path:
+        raise argparse.ArgumentTypeError("expected FILE_ID=PATH")
+    return file_id, path
+
+
+def percentiles(samples: list[float]) -> str:
+    if not samples:
+        return "n/a"
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(len(samples) * q))] * 1000
+    return (f"p50 {statistics.median(samples) * 1000:.0f}ms  p95 {pick(0.95):.0f}ms  "
+            f"p99 {pick(0.99):.0f}ms  max {samples[-1] * 1000:.0f}ms")
+
+
+def match_replies(api: FakeBotApi, chats: dict) -> dict:
+    """update_id -> time of its first reply."""
+    waiting = {}  # chat key -> [update_id, ...] delivered and not yet answered
+    for update_id in sorted(api.delivered, key=api.delivered.get):
+        if chats.get(update_id) is not None:
+            waiting.setdefault(chats[update_id], []).append(update_id)
+    answered = {}
+    for t, method, chat_id, params in api.calls:
+        if method not in REPLY_METHODS:
+            continue
+        key = ("callback", params.get("callback_query_id")) if method == "answerCallbackQuery" else ("chat", chat_id)
+        queue = waiting.get(key)
+        if queue and api.delivered[queue[0]] <= t:
+            answered[queue.pop(0)] = t
+    return answered
+
+
+async def replay(opts, records):
+    api = FakeBotApi()
+    api.wiguna_delay = opts.wiguna_delay
+    for file_id, path in opts.file:
+        api.add_file(file_id, Path(path).read_bytes())
+    port = await api.start()
+    api_url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as tmp:
+        proc = await asyncio.create_subprocess_exec(sys.executable, str(BOTS[opts.bot]),
+                                                    env=bot_env(opts.bot, api_url, tmp, opts.db),
+                                                    stdout=asyncio.subprocess.DEVNULL if not opts.verbose else None)
+        try:
+            await asyncio.wait_for(api.polling.wait(), 60)
+            fed, chats = {}, {}
+            span = records[-1][0]
+            t0 = time.monotonic()
+            for round_ in range(opts.repeat):
+                base = round_ * (span / opts.speed + 0.001) if opts.speed else 0
+                for offset, update in records:
+                    if opts.speed:
+                        delay = t0 + base + offset / opts.speed - time.monotonic()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    update_id = api.push(update)
+                    fed[update_id] = time.monotonic()
+                    chats[update_id] = update_chat(update)
+            feed_done = time.monotonic()
+
+            # Wait for the bot to answer everything it is going to answer.
+            deadline = time.monotonic() + opts.settle
+            answered = {}
+            while time.monotonic() < deadline:
+                answered = match_replies(api, chats)
+                if len(answered) >= sum(1 for key in chats.values() if key is not None):
+                    break
+                await asyncio.sleep(0.2)
+            end = max([feed_done, *answered.values()])
+        finally:
+            if proc.returncode is None:
+                proc.send_signal(signal.SIGINT)
+                try:
+                    await asyncio.wait_for(proc.wait(), 20)
+                except asyncio.TimeoutError:
+                    proc.kill()
+            await api.close()
+
+    elapsed = end - t0
+    queueing = [api.delivered[uid] - fed[uid] for uid in fed if uid in api.delivered]
+    latency = [t - api.delivered[uid] for uid, t in answered.items()]
+    end_to_end = [t - fed[uid] for uid, t in answered.items()]
+    expected = sum(1 for key in chats.values() if key is not None)
+    calls = [call for call in api.calls if call[0] >= t0]
+    print(f"🧪 {len(fed):,} updates to {opts.bot}_bot at {opts.speed or 'max'}× speed in {elapsed:.1f}s")
+    print(f"Throughput:   fed {len(fed) / (feed_done - t0 or 1e-9):,.1f}/s, answered {len(answered) / elapsed:,.1f}/s, "
+          f"Bot API calls {len(calls) / elapsed:,.1f}/s")
+    print(f"Answered:     {len(answered):,}/{expected:,}" + (" (rest timed out, see --settle)" if len(answered) < expected else ""))
+    print(f"Queueing:     {percentiles(queueing)}")
+    print(f"Reply:        {percentiles(latency)}")
+    print(f"End to end:   {percentiles(end_to_end)}")
+    by_method = {}
+    for _, method, _, _ in calls:
+        by_method[method] = by_method.get(method, 0) + 1
+    print("Calls:        " + ", ".join(f"{method} {count:,}" for method, count in sorted(by_method.items())))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("capture", help="JSONL written by *_CAPTURE_UPDATES")
+    parser.add_argument("--bot", choices=sorted(BOTS), default="trading")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression; 0 feeds everything at once")
+    parser.add_argument("--repeat", type=int, default=1, help="play the capture this many times back to back")
+    parser.add_argument("--db", help="trading: copy this trades.db instead of starting from an empty one")
+    parser.add_argument("--wiguna-delay", type=float, default=0.0, help="wiguna: seconds the fake Wiguna API takes to answer")
+    parser.add_argument("--file", action="append", default=[], type=file_arg, metavar="FILE_ID=PATH",
+                        help="serve PATH for a captured document's file_id (repeatable)")
+    parser.add_argument("--settle", type=float, default=30.0, help="seconds to wait for replies after the last update")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the bot's output")
+    opts = parser.parse_args()
+
+    asyncio.run(replay(opts, load_capture(opts.capture)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
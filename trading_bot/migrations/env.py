@@ -2,6 +2,7 @@ from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
+from sqlalchemy import text
 
 from alembic import context
 
@@ -25,6 +26,33 @@ target_metadata = None
 # my_important_option = config.get_main_option("my_important_option")
 # ... etc.
 
+# logs and positions predate Alembic: the first revision (45d73470761a) alters positions
+# and expects both to exist. Creating them here with IF NOT EXISTS lets `alembic upgrade
+# head` build a new, empty trades.db and leaves every existing database untouched.
+LEGACY_TABLES = (
+    "CREATE TABLE IF NOT EXISTS logs ("
+    " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+    " user TEXT,"
+    " stock TEXT,"
+    " amount REAL,"
+    " date TEXT)",
+    "CREATE TABLE IF NOT EXISTS positions ("
+    " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+    " user TEXT,"
+    " stock TEXT,"
+    " quantity REAL,"
+    " avg_price REAL,"
+    " date TEXT)",
+)
+
+
+def create_legacy_tables(connection) -> None:
+    """Create the pre-Alembic tables in a database that has never been migrated."""
+    if connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'alembic_version'")).first():
+        return
+    for statement in LEGACY_TABLES:
+        connection.execute(text(statement))
+
 
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
@@ -69,6 +97,7 @@ def run_migrations_online() -> None:
         )
 
         with context.begin_transaction():
+            create_legacy_tables(connection)
             context.run_migrations()
 
 
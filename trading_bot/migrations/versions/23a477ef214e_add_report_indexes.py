@@ -0,0 +1,39 @@
+"""add report indexes to logs and positions
+
+Revision ID: 23a477ef214e
+Revises: 45d73470761a
+Create Date: 2026-10-17 09:15:02.904117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '23a477ef214e'
+down_revision: Union[str, Sequence[str], None] = '45d73470761a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Covering indexes, one per query shape. `id` is listed explicitly so that
+    # ORDER BY date DESC, id DESC is read straight off the index.
+    # /rc, /lb, daily recap, /tlist and /texport without --user/--symbol
+    op.create_index('ix_logs_date', 'logs', ['date', 'id', 'user', 'stock', 'amount'])
+    # /me, /tlist --user
+    op.create_index('ix_logs_user_date', 'logs', ['user', 'date', 'id', 'stock', 'amount'])
+    # /s, /tlist --symbol
+    op.create_index('ix_logs_stock_date', 'logs', ['stock', 'date', 'id', 'user', 'amount'])
+    # /plist, /pall, /pexport
+    op.create_index('ix_positions_user', 'positions', ['user', 'id', 'stock', 'quantity', 'avg_price'])
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_positions_user', table_name='positions')
+    op.drop_index('ix_logs_stock_date', table_name='logs')
+    op.drop_index('ix_logs_user_date', table_name='logs')
+    op.drop_index('ix_logs_date', table_name='logs')
@@ -0,0 +1,28 @@
+"""add daily_pnl stock index
+
+Revision ID: 587ee3237865
+Revises: 8a0a89bf2457
+Create Date: 2026-10-17 12:03:51.660418
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '587ee3237865'
+down_revision: Union[str, Sequence[str], None] = '8a0a89bf2457'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # /tlist --symbol page totals
+    op.create_index('ix_daily_pnl_stock_date', 'daily_pnl', ['stock', 'date', 'user', 'total', 'count'])
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_daily_pnl_stock_date', table_name='daily_pnl')
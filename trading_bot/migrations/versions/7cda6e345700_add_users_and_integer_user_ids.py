@@ -0,0 +1,107 @@
+"""add users table and integer user_id columns
+
+Revision ID: 7cda6e345700
+Revises: 587ee3237865
+Create Date: 2026-10-17 13:27:45.301876
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7cda6e345700'
+down_revision: Union[str, Sequence[str], None] = '587ee3237865'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Indexes that reference the user column and have to be rebuilt around it.
+OLD_INDEXES = [
+    ('ix_logs_date', 'logs', ['date', 'id', 'user', 'stock', 'amount']),
+    ('ix_logs_user_date', 'logs', ['user', 'date', 'id', 'stock', 'amount']),
+    ('ix_logs_stock_date', 'logs', ['stock', 'date', 'id', 'user', 'amount']),
+    ('ix_positions_user', 'positions', ['user', 'id', 'stock', 'quantity', 'avg_price']),
+    ('ix_daily_pnl_user_date', 'daily_pnl', ['user', 'date', 'stock', 'total', 'count']),
+    ('ix_daily_pnl_stock_date', 'daily_pnl', ['stock', 'date', 'user', 'total', 'count']),
+]
+NEW_INDEXES = [
+    (name, table, ['user_id' if col == 'user' else col for col in cols]) for name, table, cols in OLD_INDEXES
+]
+
+
+def _rebuild_daily_pnl(conn, user_col: str, user_type: str, select_sql: str):
+    conn.execute(sa.text(
+        "CREATE TABLE daily_pnl_new ("
+        " date TEXT NOT NULL,"
+        f" {user_col} {user_type} NOT NULL,"
+        " stock TEXT NOT NULL,"
+        " total REAL NOT NULL DEFAULT 0,"
+        " count INTEGER NOT NULL DEFAULT 0,"
+        f" PRIMARY KEY (date, {user_col}, stock)"
+        ") WITHOUT ROWID"
+    ))
+    conn.execute(sa.text(f"INSERT INTO daily_pnl_new (date, {user_col}, stock, total, count) {select_sql}"))
+    conn.execute(sa.text("DROP TABLE daily_pnl"))
+    conn.execute(sa.text("ALTER TABLE daily_pnl_new RENAME TO daily_pnl"))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    conn = op.get_bind()
+    # id is the Telegram user_id. Rows logged before this table existed only carry a
+    # first_name, so each distinct name gets a negative placeholder id; the bot hands
+    # those rows over to the first Telegram user seen with that name.
+    conn.execute(sa.text(
+        "CREATE TABLE users ("
+        " id INTEGER PRIMARY KEY,"
+        " username TEXT,"
+        " display_name TEXT NOT NULL,"
+        " updated_at TEXT)"
+    ))
+    op.create_index('ix_users_username', 'users', ['username'], unique=True,
+                    sqlite_where=sa.text('username IS NOT NULL'))
+    conn.execute(sa.text("CREATE INDEX ix_users_display_name ON users (display_name COLLATE NOCASE)"))
+
+    names = conn.execute(sa.text(
+        "SELECT user FROM logs WHERE user IS NOT NULL "
+        "UNION SELECT user FROM positions WHERE user IS NOT NULL "
+        "ORDER BY 1"
+    )).fetchall()
+    for i, (name,) in enumerate(names, start=1):
+        conn.execute(sa.text("INSERT INTO users (id, display_name, updated_at) VALUES (:id, :name, datetime('now','localtime'))"),
+                     {"id": -i, "name": name})
+
+    for name, table, _ in OLD_INDEXES:
+        op.drop_index(name, table_name=table)
+    for table in ('logs', 'positions'):
+        conn.execute(sa.text(f"ALTER TABLE {table} ADD COLUMN user_id INTEGER REFERENCES users(id)"))
+        conn.execute(sa.text(f"UPDATE {table} SET user_id = (SELECT id FROM users WHERE display_name = {table}.user)"))
+        conn.execute(sa.text(f"ALTER TABLE {table} DROP COLUMN user"))
+    _rebuild_daily_pnl(
+        conn, 'user_id', 'INTEGER',
+        "SELECT d.date, u.id, d.stock, d.total, d.count FROM daily_pnl d JOIN users u ON u.display_name = d.user"
+    )
+    for name, table, cols in NEW_INDEXES:
+        op.create_index(name, table, cols)
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    conn = op.get_bind()
+    for name, table, _ in NEW_INDEXES:
+        op.drop_index(name, table_name=table)
+    for table in ('logs', 'positions'):
+        conn.execute(sa.text(f"ALTER TABLE {table} ADD COLUMN user TEXT"))
+        conn.execute(sa.text(f"UPDATE {table} SET user = (SELECT display_name FROM users WHERE id = {table}.user_id)"))
+        conn.execute(sa.text(f"ALTER TABLE {table} DROP COLUMN user_id"))
+    _rebuild_daily_pnl(
+        conn, 'user', 'TEXT',
+        "SELECT d.date, u.display_name, d.stock, SUM(d.total), SUM(d.count) FROM daily_pnl d "
+        "JOIN users u ON u.id = d.user_id GROUP BY d.date, u.display_name, d.stock"
+    )
+    for name, table, cols in OLD_INDEXES:
+        op.create_index(name, table, cols)
+    op.drop_index('ix_users_display_name', table_name='users')
+    op.drop_index('ix_users_username', table_name='users')
+    op.drop_table('users')
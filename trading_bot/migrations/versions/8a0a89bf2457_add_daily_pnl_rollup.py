@@ -0,0 +1,50 @@
+"""add daily_pnl rollup
+
+Revision ID: 8a0a89bf2457
+Revises: 23a477ef214e
+Create Date: 2026-10-17 10:41:27.113502
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a0a89bf2457'
+down_revision: Union[str, Sequence[str], None] = '23a477ef214e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # One row per (date, user, stock); the bot keeps it in step with logs in the
+    # same transaction as every trade insert/edit/delete.
+    conn = op.get_bind()
+    conn.execute(sa.text(
+        "CREATE TABLE daily_pnl ("
+        " date TEXT NOT NULL,"
+        " user TEXT NOT NULL,"
+        " stock TEXT NOT NULL,"
+        " total REAL NOT NULL DEFAULT 0,"
+        " count INTEGER NOT NULL DEFAULT 0,"
+        " PRIMARY KEY (date, user, stock)"
+        ") WITHOUT ROWID"
+    ))
+    # /me
+    op.create_index('ix_daily_pnl_user_date', 'daily_pnl', ['user', 'date', 'stock', 'total', 'count'])
+
+    # Backfill from existing trades
+    conn.execute(sa.text(
+        "INSERT INTO daily_pnl (date, user, stock, total, count) "
+        "SELECT date, user, stock, SUM(amount), COUNT(*) FROM logs "
+        "WHERE date IS NOT NULL AND user IS NOT NULL AND stock IS NOT NULL "
+        "GROUP BY date, user, stock"
+    ))
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_daily_pnl_user_date', table_name='daily_pnl')
+    op.drop_table('daily_pnl')
@@ -0,0 +1,31 @@
+"""add amount and position stock indexes
+
+Revision ID: b3f19c0d52e8
+Revises: 7cda6e345700
+Create Date: 2026-10-17 17:02:14.318207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3f19c0d52e8'
+down_revision: Union[str, Sequence[str], None] = '7cda6e345700'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # /tlist /texport --min/--max and --sort best|worst
+    op.create_index('ix_logs_amount', 'logs', ['amount', 'id', 'date', 'user_id', 'stock'])
+    # /plist /pexport --symbol
+    op.create_index('ix_positions_stock', 'positions', ['stock', 'user_id', 'id', 'quantity', 'avg_price'])
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_positions_stock', table_name='positions')
+    op.drop_index('ix_logs_amount', table_name='logs')
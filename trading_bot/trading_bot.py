@@ -1,20 +1,43 @@
 import os
 import sqlite3
 import difflib
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import functools
+import itertools
+import math
+import secrets
+import signal
+import queue
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import urlsplit
 import csv
+import gzip
+import io
+import json
 import tempfile
 VALID_COMMANDS = [
     "tadd", "tedit", "tdel", "tlist", "admintadd",
     "padd", "pedit", "pdel", "plist", "pall", "adminpadd",
-    "rc", "wd", "mo", "lb", "s", "me", "help"
+    "rc", "wd", "mo", "lb", "s", "me", "cachestats", "stats", "help"
 ]
 
 import pytz
-from telegram import Update
+from telegram import Chat, InlineKeyboardButton, InlineKeyboardMarkup, ReplyParameters, Update
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import (
-    Application, CommandHandler, ContextTypes, MessageHandler, filters
+    BaseRateLimiter, BaseUpdateProcessor,
+    Application, CallbackQueryHandler, CommandHandler, ContextTypes, MessageHandler, TypeHandler, filters
 )
+from telegram.request import HTTPXRequest
 
 # ================= CONFIG =================
 BOT_TOKEN = os.getenv("TRADING_BOT_TOKEN")  # <- replace with BotFather token
@@ -23,32 +46,1113 @@ ADMIN_USERNAMES = ["eemmje", "Razzled123x"]         # <- replace with your Teleg
 
 JAKARTA_TZ = pytz.timezone("Asia/Jakarta")
 
+DB_PATH = os.getenv("TRADING_DB_PATH", "trades.db")
+DB_BATCH_MAX = int(os.getenv("TRADING_DB_BATCH_MAX", "128"))  # max write jobs per group commit
+DB_READERS = int(os.getenv("TRADING_DB_READERS", "4"))  # read-only connections / reader threads
+DB_STATEMENT_CACHE = 256  # prepared statements kept per reader connection (one per filter shape)
+TLIST_PAGE_SIZE = min(int(os.getenv("TRADING_TLIST_PAGE_SIZE", "50")), 60)  # a page must fit in one message
+TLIST_SESSIONS_PER_CHAT = 20  # older /tlist keyboards stop paging after this many newer lists
+EXPORT_CHUNK_ROWS = 1000
+TRADE_CSV_HEADER = ["ID", "Date", "User", "Stock", "Amount"]
+POSITION_CSV_HEADER = ["ID", "User", "Stock", "Quantity", "Avg_Price"]
+IMPORT_REJECTS_SHOWN = 10
+MAX_BULK_IDS = 1000  # IDs accepted by one /tdel, /tedit, /pdel or /pedit
+SQL_IN_CHUNK = 500  # ids per IN (...) list; SQLite before 3.32 binds at most 999 parameters
+EXPORT_SPOOL_BYTES = int(os.getenv("TRADING_EXPORT_SPOOL_BYTES", str(8 * 1024 * 1024)))  # spill to disk past this
+MESSAGE_CHUNK_CHARS = 4000  # Telegram caps messages at 4096 chars; leave room for entities
+REPORT_DOCUMENT_CHARS = int(os.getenv("TRADING_REPORT_DOCUMENT_CHARS", "16000"))  # longer reports go out as a .txt file
+SEND_GLOBAL_RATE = float(os.getenv("TRADING_SEND_RATE", "30"))  # Bot API: ~30 messages/s across all chats
+SEND_CHAT_RATE = 1.0        # ~1 message/s into one private chat
+SEND_GROUP_RATE = 20 / 60   # 20 messages/min into one group
+SEND_CHAT_BURST = 3         # per-chat bucket size, so a short multi-part reply goes out at once
+SEND_MAX_RETRIES = 3        # RetryAfter retries before the error reaches the handler
+SEND_INTERACTIVE = 0        # rate_limit_args priorities: direct replies to a command ...
+SEND_BULK = 1               # ... go ahead of scheduled recaps, report continuations and exports
+RESULT_CACHE_SIZE = int(os.getenv("TRADING_RESULT_CACHE_SIZE", "256"))  # rendered /lb /rc /s /me /pall replies
+CONCURRENT_UPDATES = int(os.getenv("TRADING_CONCURRENT_UPDATES", "16"))  # updates handled at once (per chat/user still in order)
+COMMAND_DELETE_INTERVAL = 1.0  # seconds between batched deletions of users' command messages
+WEBHOOK_URL = os.getenv("TRADING_WEBHOOK_URL")  # set to receive updates by webhook instead of long polling
+WEBHOOK_LISTEN = os.getenv("TRADING_WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("TRADING_WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("TRADING_WEBHOOK_SECRET") or secrets.token_urlsafe(32)  # checked on every push
+TELEGRAM_API_URL = os.getenv("TRADING_TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")  # Bot API server (a local stand-in for load tests)
+CAPTURE_PATH = os.getenv("TRADING_CAPTURE_UPDATES")  # append incoming updates here as JSON lines
+METRICS_LISTEN = os.getenv("TRADING_METRICS_LISTEN", "127.0.0.1")  # Prometheus /metrics listener
+METRICS_PORT = int(os.getenv("TRADING_METRICS_PORT", "9464"))  # 0 disables it
+BOT_CONNECTION_POOL = 64  # concurrent Bot API requests (sends from concurrent handlers)
+
 # ================ DATABASE ================
-conn = sqlite3.connect("trades.db", check_same_thread=False)
-c = conn.cursor()
+class DbWriter:
+    """Single writer thread owning the only read-write connection.
+
+    Handlers submit callables that receive a cursor and get an awaitable back.
+    Whatever is queued while a commit is in flight is applied in the next
+    transaction (group commit); every job runs in its own SAVEPOINT so one
+    failing job only rolls back itself.
+    """
+
+    def __init__(self, path: str, batch_max: int = 128):
+        self.path = path
+        self.batch_max = max(1, batch_max)
+        self.commits = 0
+        self.jobs = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._error: Exception | None = None
+
+    @property
+    def started(self) -> bool:
+        return self._ready.is_set()
+
+    def start(self):
+        """Start the writer thread if needed and wait until its connection is open. Blocks:
+        call it from a thread (asyncio.to_thread), not from the event loop."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+        self._ready.wait()
+        if self._error:
+            raise self._error
+
+    def submit(self, fn, *args) -> asyncio.Future:
+        """Queue fn(cursor, *args); the future resolves to (its result, rows it changed)."""
+        if not self.started:
+            raise RuntimeError("DbWriter.start() has not been called")
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._queue.put((fn, args, loop, fut))
+        return fut
+
+    def close(self):
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+            self._ready.clear()
+
+    def _run(self):
+        try:
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # FULL fsyncs the WAL on every commit, so a committed trade survives a power cut;
+            # group commit keeps that to one fsync per batch.
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute("PRAGMA busy_timeout=5000")
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        try:
+            stop = False
+            while not stop:
+                item = self._queue.get()
+                if item is None:
+                    break
+                batch = [item]
+                while len(batch) < self.batch_max:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                self._apply(conn, batch)
+        finally:
+            conn.close()
+
+    def _apply(self, conn: sqlite3.Connection, batch: list):
+        cur = conn.cursor()
+        results = []
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            for fn, args, loop, fut in batch:
+                cur.execute("SAVEPOINT job")
+                changes = conn.total_changes
+                try:
+                    res = fn(cur, *args)
+                    cur.execute("RELEASE job")
+                    results.append((loop, fut, (res, conn.total_changes - changes), None))
+                except Exception as e:
+                    cur.execute("ROLLBACK TO job")
+                    cur.execute("RELEASE job")
+                    results.append((loop, fut, None, e))
+            cur.execute("COMMIT")
+            self.commits += 1
+            self.jobs += len(batch)
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            results = [(loop, fut, None, e) for _, _, loop, fut in batch]
+        for loop, fut, res, exc in results:
+            try:
+                loop.call_soon_threadsafe(_resolve_future, fut, res, exc)
+            except RuntimeError:
+                pass  # loop already closed during shutdown
+
+
+def _resolve_future(fut: asyncio.Future, result, exc):
+    if fut.cancelled():
+        return
+    if exc is not None:
+        fut.set_exception(exc)
+    else:
+        fut.set_result(result)
+
+
+db_writer = DbWriter(DB_PATH, DB_BATCH_MAX)
+
+async def db_write(fn, *args):
+    """Run fn(cursor, *args) on the writer thread and wait for its commit."""
+    if not db_writer.started:
+        await asyncio.to_thread(db_writer.start)  # normally done by start_services already
+    with metrics.timed("sqlite"):
+        result, changed = await db_writer.submit(fn, *args)
+    if changed:
+        # Every trade/position/user write goes through here; only one that committed a
+        # change makes cached reports stale (a rejected edit or a same-name upsert does not).
+        result_cache.bump()
+    return result
+
+class ReaderPool:
+    """Read-only connections for report queries, separate from the writer.
+
+    Each connection lives on one of `size` reader threads and runs a call
+    inside a single read transaction, so it sees one consistent WAL snapshot
+    while the writer keeps committing.
+    """
+
+    def __init__(self, path: str, size: int, writer: DbWriter):
+        self.path = path
+        self.size = max(1, size)
+        self.writer = writer
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="db-reader")
+            return self._executor
+
+    def _connect(self) -> sqlite3.Connection:
+        # The writer switches the file to WAL; readers must not open it first.
+        self.writer.start()
+        uri = Path(self.path).resolve().as_uri() + "?mode=ro"
+        rconn = sqlite3.connect(uri, uri=True, isolation_level=None, check_same_thread=False,
+                                cached_statements=DB_STATEMENT_CACHE)
+        rconn.execute("PRAGMA busy_timeout=5000")
+        return rconn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if not create:
+            return self._idle.get()
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def release(self, rconn: sqlite3.Connection):
+        if rconn.in_transaction:
+            rconn.execute("ROLLBACK")
+        self._idle.put(rconn)
+
+    def run(self, fn, *args):
+        rconn = self.acquire()
+        try:
+            rconn.execute("BEGIN")
+            return fn(rconn, *args)
+        finally:
+            self.release(rconn)
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+
+reader_pool = ReaderPool(DB_PATH, DB_READERS, db_writer)
+
+async def db_read(fn, *args):
+    """Run fn(connection, *args) on a reader thread with a pooled read-only connection."""
+    loop = asyncio.get_running_loop()
+    with metrics.timed("sqlite"):
+        return await loop.run_in_executor(reader_pool.executor, reader_pool.run, fn, *args)
+
+def _fetchall(rconn: sqlite3.Connection, query: str, params: tuple) -> list:
+    return rconn.execute(query, params).fetchall()
+
+async def db_fetchall(query: str, params: tuple = ()) -> list:
+    return await db_read(_fetchall, query, tuple(params))
+
+def _export_csv(rconn: sqlite3.Connection, query: str, params: tuple, header: list[str],
+                compress: bool, user_col: int) -> tuple[tempfile.SpooledTemporaryFile, int]:
+    """Stream a query into a CSV (optionally gzipped) held in memory until it grows
+    past EXPORT_SPOOL_BYTES. Column `user_col` holds a user_id and is written as the display name.
+    Returns the rewound buffer and the row count; the caller closes it.
+    """
+    buf = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES, mode="w+b")
+    try:
+        raw = gzip.GzipFile(fileobj=buf, mode="wb", mtime=0) if compress else buf
+        text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        writer = csv.writer(text)
+        writer.writerow(header)
+        cur = rconn.execute(query, params)
+        count = 0
+        while True:
+            rows = cur.fetchmany(EXPORT_CHUNK_ROWS)
+            if not rows:
+                break
+            names = _user_names(rconn, (row[user_col] for row in rows))
+            writer.writerows(row[:user_col] + (names.get(row[user_col], "?"),) + row[user_col + 1:] for row in rows)
+            count += len(rows)
+        text.flush()
+        text.detach()
+        if compress:
+            raw.close()  # writes the gzip trailer; leaves buf open
+        buf.seek(0)
+        return buf, count
+    except Exception:
+        buf.close()
+        raise
+
+async def send_export(update: Update, query: str, params: tuple, header: list[str],
+                      filename: str, caption: str, compress: bool, user_col: int) -> int:
+    """Run an export on a reader thread and upload it; returns the number of rows."""
+    buf, count = await db_read(_export_csv, query, tuple(params), header, compress, user_col)
+    with buf:
+        if count:
+            if compress:
+                filename += ".gz"
+            _, send_document = reply_senders(update.message)
+            # PTB reads the upload into memory either way, and rejects the spool itself while it
+            # is still in memory (its name is None).
+            await send_document(buf.read(), filename=filename, caption=f"{caption} ({count} rows)",
+                                rate_limit_args=SEND_BULK)
+    return count
+
+# ================ SEND SCHEDULER ================
+def retry_after_seconds(exc: RetryAfter) -> float:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # PTB 22 warns that retry_after becomes a timedelta
+        value = exc.retry_after
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class SendScheduler(BaseRateLimiter[int]):
+    """Paces every message the bot sends (PTB routes all Bot API calls through here).
+
+    A request waits for a token from the global bucket and from its chat's bucket; waiting
+    requests are granted in (priority, arrival) order, so a command reply overtakes a queued
+    bulk report and messages into one chat keep their order. A RetryAfter pauses only that
+    chat for the requested time and the request is retried, up to SEND_MAX_RETRIES times.
+    rate_limit_args is the priority (SEND_INTERACTIVE by default, or SEND_BULK).
+    """
+
+    MESSAGE_ENDPOINTS = ("send", "edit", "copy", "forward")
+
+    def __init__(self, global_rate: float, chat_rate: float, group_rate: float, burst: float, max_retries: int):
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.sent = 0
+        self.retries = 0
+        self._buckets = {}
+        self._paused = {}   # chat_id -> monotonic time it may send again after a RetryAfter
+        self._waiting = []  # (priority, seq, chat_id, future)
+        self._seq = itertools.count()
+        self._wake = None
+        self._task = None
+
+    async def initialize(self):
+        if self._task is not None:
+            return  # ExtBot.initialize runs for both the Application and its Updater
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for *_, fut in self._waiting:
+            fut.cancel()
+        self._waiting.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None or not endpoint.startswith(self.MESSAGE_ENDPOINTS):
+            return await callback(*args, **kwargs)
+        priority = SEND_INTERACTIVE if rate_limit_args is None else rate_limit_args
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, priority)
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                if attempt == self.max_retries:
+                    raise
+                delay = retry_after_seconds(exc) + 0.1
+                self.retries += 1
+                self._paused[chat_id] = time.monotonic() + delay
+                print(f"⏳ Flood control in chat {chat_id}: retrying {endpoint} in {delay:.1f}s")
+                continue
+            self.sent += 1
+            return result
+
+    async def _acquire(self, chat_id, priority: int):
+        if self._task is None:
+            return  # not initialized (e.g. a bare Bot in a script): send unthrottled
+        fut = asyncio.get_running_loop().create_future()
+        self._waiting.append((priority, next(self._seq), chat_id, fut))
+        self._wake.set()
+        await fut
+
+    def _bucket(self, chat_id) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            try:
+                group = int(chat_id) < 0
+            except (TypeError, ValueError):
+                group = True  # @channelusername
+            bucket = self._buckets[chat_id] = TokenBucket(self.group_rate if group else self.chat_rate, self.burst)
+        return bucket
+
+    def _grant_ready(self) -> float | None:
+        """Release every waiter that may send now; returns seconds until the next one could."""
+        now = time.monotonic()
+        wait = None
+        blocked = set()
+        remaining = []
+        for item in sorted(self._waiting, key=lambda item: item[:2]):
+            _, _, chat_id, fut = item
+            if fut.done():
+                continue
+            if chat_id not in blocked:
+                delay = max(self.global_bucket.delay(now), self._bucket(chat_id).delay(now),
+                            self._paused.get(chat_id, 0) - now)
+                if delay <= 0:
+                    self.global_bucket.take()
+                    self._bucket(chat_id).take()
+                    fut.set_result(None)
+                    continue
+                # Later requests for this chat must not overtake this one.
+                blocked.add(chat_id)
+                wait = delay if wait is None else min(wait, delay)
+            remaining.append(item)
+        self._waiting = remaining
+        for chat_id, until in list(self._paused.items()):
+            if until <= now:
+                del self._paused[chat_id]
+        if len(self._buckets) > 1000 and not remaining:
+            self._buckets.clear()
+        return wait
+
+    async def _dispatch(self):
+        while True:
+            self._wake.clear()
+            wait = self._grant_ready()
+            try:
+                await asyncio.wait_for(self._wake.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+# ================ UPDATE ORDERING ================
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Runs up to `max_concurrent_updates` updates at once, but updates sharing a chat or a
+    user run one after another in arrival order.
+
+    Each update waits for the previous update of its chat and of its user to finish, so a
+    /tedit never overtakes the /tadd it refers to while other chats keep going. An update
+    only takes a concurrency slot once it is allowed to run.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max(1, max_concurrent_updates))
+        self._tails = {}  # ("chat" | "user", id) -> future of the last update queued for it
+
+    @staticmethod
+    def ordering_keys(update) -> tuple:
+        if not isinstance(update, Update):
+            return ()
+        keys = []
+        if update.effective_chat is not None:
+            keys.append(("chat", update.effective_chat.id))
+        if update.effective_user is not None:
+            keys.append(("user", update.effective_user.id))
+        return tuple(keys)
+
+    async def process_update(self, update, coroutine):
+        keys = self.ordering_keys(update)
+        previous = {self._tails[key] for key in keys if key in self._tails}
+        done = asyncio.get_running_loop().create_future()
+        for key in keys:
+            self._tails[key] = done
+        try:
+            if previous:
+                await asyncio.wait(previous)
+            await super().process_update(update, coroutine)
+        finally:
+            done.set_result(None)
+            for key in keys:
+                if self._tails.get(key) is done:
+                    del self._tails[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+# ================ METRICS ================
+# Handler whose backend calls are being timed; set by safe_handler for the running task.
+current_command = contextvars.ContextVar("current_command", default="background")
+
+class Metrics:
+    """Per-handler latency histograms, error counts and time spent in each backend.
+
+    Backend time is booked against the handler running in the current task, so a slow
+    command can be split into database, Telegram API and other calls. render() produces
+    the Prometheus text format served on /metrics; summary() feeds the admin /stats command.
+    """
+
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.started = time.monotonic()
+        self._latency = {}  # command -> [per-bucket counts (last one is +Inf), sum of seconds]
+        self._errors = {}   # command -> count
+        self._backend = {}  # (command, backend) -> [seconds, calls]
+
+    def observe(self, command: str, seconds: float, error: bool = False):
+        hist = self._latency.get(command)
+        if hist is None:
+            hist = self._latency[command] = [[0] * (len(self.BUCKETS) + 1), 0.0]
+        hist[0][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        hist[1] += seconds
+        if error:
+            self._errors[command] = self._errors.get(command, 0) + 1
+
+    def add_backend(self, backend: str, seconds: float):
+        entry = self._backend.setdefault((current_command.get(), backend), [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+    @contextlib.contextmanager
+    def timed(self, backend: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_backend(backend, time.perf_counter() - start)
+
+    def quantile(self, command: str, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (inf past the last bucket)."""
+        counts = self._latency[command][0]
+        rank = q * sum(counts)
+        seen = 0
+        for bound, count in zip(self.BUCKETS, counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def _bound(self, bound: float) -> str:
+        return f"≤{bound:g}s" if bound != math.inf else f">{self.BUCKETS[-1]:g}s"
+
+    def render(self) -> str:
+        p = self.prefix
+        lines = [f"# HELP {p}_command_duration_seconds Handler latency.",
+                 f"# TYPE {p}_command_duration_seconds histogram"]
+        for command, (counts, total) in sorted(self._latency.items()):
+            seen = 0
+            for bound, count in zip((*self.BUCKETS, "+Inf"), counts):
+                seen += count
+                lines.append(f'{p}_command_duration_seconds_bucket{{command="{command}",le="{bound}"}} {seen}')
+            lines.append(f'{p}_command_duration_seconds_sum{{command="{command}"}} {total:.6f}')
+            lines.append(f'{p}_command_duration_seconds_count{{command="{command}"}} {seen}')
+        lines += [f"# HELP {p}_command_errors_total Handler calls that raised.",
+                  f"# TYPE {p}_command_errors_total counter"]
+        lines += [f'{p}_command_errors_total{{command="{command}"}} {count}'
+                  for command, count in sorted(self._errors.items())]
+        lines += [f"# HELP {p}_backend_seconds_total Time spent waiting on a backend, by handler.",
+                  f"# TYPE {p}_backend_seconds_total counter"]
+        lines += [f'{p}_backend_seconds_total{{command="{command}",backend="{backend}"}} {seconds:.6f}'
+                  for (command, backend), (seconds, _) in sorted(self._backend.items())]
+        lines += [f"# HELP {p}_backend_calls_total Backend calls, by handler.",
+                  f"# TYPE {p}_backend_calls_total counter"]
+        lines += [f'{p}_backend_calls_total{{command="{command}",backend="{backend}"}} {calls}'
+                  for (command, backend), (_, calls) in sorted(self._backend.items())]
+        lines.append(f"# TYPE {p}_uptime_seconds gauge")
+        lines.append(f"{p}_uptime_seconds {time.monotonic() - self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> list[str]:
+        """One line per handler: calls, p50/p95 bucket, errors and average backend time per call."""
+        lines = []
+        for command, (counts, total) in sorted(self._latency.items(), key=lambda item: -item[1][1]):
+            calls = sum(counts)
+            p50, p95 = (self._bound(self.quantile(command, q)) for q in (0.5, 0.95))
+            backends = " ".join(f"{backend} {seconds / calls * 1000:.0f}ms"
+                                for (cmd, backend), (seconds, _) in sorted(self._backend.items()) if cmd == command)
+            lines.append(f"{command}: {calls}× avg {total / calls * 1000:.0f}ms, p50 {p50}, p95 {p95}, "
+                         f"errors {self._errors.get(command, 0)}" + (f" | {backends}" if backends else ""))
+        return lines
+
+
+metrics = Metrics("trading_bot")
+
+class TimedRequest(HTTPXRequest):
+    """HTTPXRequest that books every Bot API round-trip as `telegram` backend time."""
+
+    async def do_request(self, *args, **kwargs):
+        with metrics.timed("telegram"):
+            return await super().do_request(*args, **kwargs)
+
+# ================ WEBHOOK ================
+class RequestError(Exception):
+    """A request HttpListener answers with `status` before closing the connection."""
+
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
+
+
+class HttpListener:
+    """Small HTTP/1.1 server; subclasses answer requests in _route(). Connections are kept
+    alive, as Telegram reuses them between webhook pushes.
+
+    Clients cannot hold a connection open by sending slowly: an idle connection is closed after
+    IDLE_TIMEOUT, a started request must arrive within READ_TIMEOUT (else 408), and over-long
+    lines, too many headers or an oversized body are refused with 400/431/413.
+    """
+
+    MAX_BODY = 1024 * 1024
+    MAX_LINE = 8 * 1024  # request line or one header line
+    MAX_HEADERS = 64
+    IDLE_TIMEOUT = 60  # seconds a kept-alive connection may wait for its next request
+    READ_TIMEOUT = 10  # seconds for the headers and body once the request line is in
+    REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+               405: "Method Not Allowed", 408: "Request Timeout", 413: "Payload Too Large",
+               431: "Request Header Fields Too Large"}
+
+    def __init__(self):
+        self._server = None
+        self._connections = {}  # writer -> handler task; closed and awaited on shutdown
+
+    async def start(self, host: str, port: int) -> int:
+        """Start listening; returns the bound port (useful with port 0)."""
+        self._server = await asyncio.start_server(self._serve, host, port, limit=self.MAX_LINE)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in self._connections:
+                writer.close()
+            # Python < 3.12 wait_closed() does not wait for the handlers; let them see EOF and exit
+            await asyncio.gather(*self._connections.values(), return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                request_line = b""
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), self.IDLE_TIMEOUT)
+                    if not request_line:
+                        break
+                    method, path, version, headers, body = await asyncio.wait_for(
+                        self._read_request(reader, request_line), self.READ_TIMEOUT)
+                except RequestError as e:
+                    await self._respond(writer, e.status, keep_alive=False)
+                    break
+                except ValueError:  # request line longer than MAX_LINE
+                    await self._respond(writer, 400, keep_alive=False)
+                    break
+                except asyncio.TimeoutError:
+                    if request_line:  # else just an idle keep-alive connection
+                        await self._respond(writer, 408, keep_alive=False)
+                    break
+                status, payload = await self._route(method, path, headers, body)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader, request_line: bytes) -> tuple[str, str, str, dict, bytes]:
+        """(method, path, version, headers, body) of the request that starts with `request_line`."""
+        try:
+            method, target, version = request_line.decode("latin-1").split()
+        except ValueError:
+            raise RequestError(400) from None
+        headers = {}
+        for _ in range(self.MAX_HEADERS + 1):
+            try:
+                line = await reader.readline()
+            except ValueError:  # longer than MAX_LINE
+                raise RequestError(431) from None
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise RequestError(431)
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise RequestError(400) from None
+        if length < 0:
+            raise RequestError(400)
+        if length > self.MAX_BODY:
+            raise RequestError(413)
+        body = await reader.readexactly(length) if length else b""
+        return method, target.split("?", 1)[0], version, headers, body
+
+    async def _route(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, dict | str | None]:
+        """(status, JSON payload or plain text) for one request."""
+        raise NotImplementedError
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, payload: dict | str | None = None,
+                       keep_alive: bool = True):
+        if isinstance(payload, str):
+            body, content_type = payload.encode(), "text/plain; version=0.0.4"  # Prometheus exposition
+        else:
+            body, content_type = json.dumps(payload).encode() if payload is not None else b"", "application/json"
+        head = (f"HTTP/1.1 {status} {self.REASONS[status]}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+class WebhookServer(HttpListener):
+    """Receives Telegram webhook pushes: POST `path` with the right
+    X-Telegram-Bot-Api-Secret-Token header hands the decoded JSON to `handle(data)`.
+    Every other path is 404, so nothing else is exposed on the public port.
+    """
+
+    def __init__(self, path: str, secret: str, handle):
+        super().__init__()
+        self.path = path
+        self.secret = secret.encode("latin-1")
+        self.handle = handle
+        self.received = 0
+        self.rejected = 0
+
+    async def _route(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, dict | str | None]:
+        if path != self.path:
+            return 404, None
+        if method != "POST":
+            return 405, None
+        token = headers.get("x-telegram-bot-api-secret-token", "").encode("latin-1")
+        if not secrets.compare_digest(token, self.secret):
+            self.rejected += 1
+            return 403, None
+        try:
+            await self.handle(json.loads(body))
+        except Exception as e:
+            print(f"⚠️ Rejected webhook update: {e}")
+            self.rejected += 1
+            return 400, None
+        self.received += 1
+        return 200, None
+
+
+class MetricsServer(HttpListener):
+    """GET /metrics serves `metrics` for Prometheus; GET /healthz reports liveness, plus the
+    webhook's update counters while `webhook` is set. Meant for a local or internal address.
+    """
+
+    HEALTH_PATH = "/healthz"
+    METRICS_PATH = "/metrics"
+
+    def __init__(self):
+        super().__init__()
+        self.started = time.monotonic()
+        self.webhook = None  # WebhookServer, set by run_webhook
+
+    async def _route(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, dict | str | None]:
+        if path not in (self.METRICS_PATH, self.HEALTH_PATH):
+            return 404, None
+        if method != "GET":
+            return 405, None
+        if path == self.METRICS_PATH:
+            return 200, metrics.render()
+        health = {"status": "ok", "uptime": round(time.monotonic() - self.started)}
+        if self.webhook is not None:
+            health.update(updates=self.webhook.received, rejected=self.webhook.rejected)
+        return 200, health
+
+metrics_server = MetricsServer()
+
+# ================ RESULT CACHE ================
+class ResultCache:
+    """LRU of rendered report replies keyed by (command, normalized args).
+
+    Entries remember the write generation they were computed in; every db_write that changes
+    a row bumps the generation, so an entry is only served while nothing has changed since.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def bump(self):
+        self.generation += 1
+
+    def get(self, key: tuple):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != self.generation:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: tuple, generation: int, value):
+        """Store a value computed while `generation` was current (dropped if a write happened since)."""
+        if generation != self.generation or self.size <= 0:
+            return
+        self._entries[key] = (generation, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+result_cache = ResultCache(RESULT_CACHE_SIZE)
+
+async def cached_report(key: tuple, render, *args):
+    """Serve a report from result_cache, rendering it with `await render(*args)` on a miss."""
+    report = result_cache.get(key)
+    if report is None:
+        generation = result_cache.generation
+        report = await render(*args)
+        result_cache.put(key, generation, report)
+    return report
+
+# Fixed report queries; tools/check_query_plans.py asserts each one is index-backed.
+# Rows carry user_id; display names are looked up from `users` only for rendering.
+# Recaps, leaderboard and /me read the daily_pnl rollup (one row per user/stock/day).
+SQL_DAILY_RECAP = "SELECT user_id, stock, total, count FROM daily_pnl WHERE date=?"
+# `+user_id` stops the planner from walking all of ix_daily_pnl_user_date just to skip the GROUP BY sort.
+SQL_RECAP = "SELECT user_id, SUM(total) FROM daily_pnl WHERE date>=? GROUP BY +user_id"
+SQL_LEADERBOARD = "SELECT user_id, SUM(total) FROM daily_pnl WHERE date>=? GROUP BY +user_id ORDER BY SUM(total) DESC"
+SQL_STOCK = "SELECT user_id, amount FROM logs WHERE stock=?"
+SQL_MYSTATS = "SELECT stock, SUM(total) FROM daily_pnl WHERE user_id=? AND date>=? GROUP BY stock"
+SQL_POS_ALL = "SELECT id, user_id, stock, quantity, avg_price FROM positions ORDER BY user_id"
+SQL_USER_BY_USERNAME = "SELECT id FROM users WHERE username = ?"
+SQL_USER_BY_NAME = "SELECT id FROM users WHERE display_name = ? COLLATE NOCASE"
+
+def id_chunks(ids: list) -> list[list]:
+    """`ids` split into lists of at most SQL_IN_CHUNK, for IN (...) queries."""
+    return [ids[start:start + SQL_IN_CHUNK] for start in range(0, len(ids), SQL_IN_CHUNK)]
+
+def _user_names(rconn: sqlite3.Connection, user_ids) -> dict:
+    """user_id -> display_name for the given ids (one IN query per SQL_IN_CHUNK ids)."""
+    ids = [i for i in set(user_ids) if i is not None]
+    names = {}
+    for chunk in id_chunks(ids):
+        names.update(rconn.execute(
+            f"SELECT id, display_name FROM users WHERE id IN ({','.join('?' * len(chunk))})", chunk
+        ).fetchall())
+    return names
+
+def _fetch_named(rconn: sqlite3.Connection, query: str, params: tuple, user_col: int) -> tuple[list, dict]:
+    """Run a query and look up display names for the user_ids in column `user_col`."""
+    rows = rconn.execute(query, params).fetchall()
+    return rows, _user_names(rconn, (row[user_col] for row in rows))
+
+async def db_fetch_named(query: str, params: tuple = (), user_col: int = 0) -> tuple[list, dict]:
+    return await db_read(_fetch_named, query, tuple(params), user_col)
+
+def _find_user_ids(rconn: sqlite3.Connection, name: str) -> list[int]:
+    """Match `@username` exactly or a display name case-insensitively."""
+    if name.startswith("@"):
+        rows = rconn.execute(SQL_USER_BY_USERNAME, (name[1:].lower(),)).fetchall()
+    else:
+        rows = rconn.execute(SQL_USER_BY_NAME, (name,)).fetchall()
+    return [row[0] for row in rows]
+
+# ================ POSITION BOOK ================
+class PositionBook:
+    """In-memory copy of `positions` with running per-stock and per-user/stock totals
+    (quantity and cost basis, so the weighted average is cost / quantity).
+
+    Loaded once, then patched by the position handlers right after their write commits,
+    so /pall and /plist cost time in proportion to what they print. Patches are idempotent
+    (applying one twice is harmless); a patch that arrives while the table is being read
+    makes the load read it again.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self.rows = {}          # id -> (user_id, stock, quantity, avg_price)
+        self.by_user = {}       # user_id -> {id: None}, ids ascending
+        self.by_stock = {}      # stock -> {id: None}
+        self.stock_totals = {}  # stock -> [quantity, cost, lots]
+        self.user_totals = {}   # (user_id, stock) -> [quantity, cost, lots]
+        self._lock = asyncio.Lock()
+        self._stale = False
+
+    async def ensure_loaded(self):
+        if self.loaded:
+            return
+        async with self._lock:
+            while not self.loaded:
+                self._stale = False
+                rows = await db_fetchall(SQL_POS_ALL)
+                if not self._stale:
+                    self._reset()
+                    for id_, user_id, stock, quantity, avg_price in sorted(rows):
+                        self._add(id_, user_id, stock, quantity, avg_price)
+                    self.loaded = True
+
+    def invalidate(self):
+        """Forget everything; the next reader reloads (used after bulk imports)."""
+        self.loaded = False
+        self._stale = True
+        self._reset()
+
+    def _reset(self):
+        self.rows.clear()
+        self.by_user.clear()
+        self.by_stock.clear()
+        self.stock_totals.clear()
+        self.user_totals.clear()
+
+    @staticmethod
+    def _total(totals: dict, key, quantity: float, cost: float, lots: int):
+        entry = totals.setdefault(key, [0.0, 0.0, 0])
+        entry[0] += quantity
+        entry[1] += cost
+        entry[2] += lots
+        if entry[2] <= 0:
+            del totals[key]  # last lot gone: drop it rather than keep float residue
+
+    def _add(self, id_: int, user_id: int, stock: str, quantity: float, avg_price: float):
+        self.rows[id_] = (user_id, stock, quantity, avg_price)
+        self.by_user.setdefault(user_id, {})[id_] = None
+        self.by_stock.setdefault(stock, {})[id_] = None
+        self._total(self.stock_totals, stock, quantity, quantity * avg_price, 1)
+        self._total(self.user_totals, (user_id, stock), quantity, quantity * avg_price, 1)
+
+    def _remove(self, id_: int):
+        user_id, stock, quantity, avg_price = self.rows.pop(id_)
+        for index, key in ((self.by_user, user_id), (self.by_stock, stock)):
+            del index[key][id_]
+            if not index[key]:
+                del index[key]
+        self._total(self.stock_totals, stock, -quantity, -quantity * avg_price, -1)
+        self._total(self.user_totals, (user_id, stock), -quantity, -quantity * avg_price, -1)
+
+    def add(self, id_: int, user_id: int, stock: str, quantity: float, avg_price: float):
+        if not self.loaded:
+            self._stale = True
+            return
+        if id_ in self.rows:
+            self._remove(id_)
+        self._add(id_, user_id, stock, quantity, avg_price)
+
+    def update(self, ids: list[int], quantity: float, avg_price: float):
+        if not self.loaded:
+            self._stale = True
+            return
+        for id_ in ids:
+            if id_ in self.rows:
+                user_id, stock, _, _ = self.rows[id_]
+                self._remove(id_)
+                self._add(id_, user_id, stock, quantity, avg_price)
+
+    def remove(self, ids: list[int]):
+        if not self.loaded:
+            self._stale = True
+            return
+        for id_ in ids:
+            if id_ in self.rows:
+                self._remove(id_)
+
+    def move_user(self, old_id: int, new_id: int):
+        """Positions handed from a placeholder user to a real account (see _merge_user)."""
+        if not self.loaded:
+            self._stale = True
+            return
+        moved = [(id_, *self.rows[id_][1:]) for id_ in self.by_user.get(old_id, ())]
+        for id_, *_ in moved:
+            self._remove(id_)
+        for id_, stock, quantity, avg_price in moved:
+            self._add(id_, new_id, stock, quantity, avg_price)
+        if moved:
+            self.by_user[new_id] = dict.fromkeys(sorted(self.by_user[new_id]))
+
+    def select(self, user_ids=None, symbol: str | None = None, limit: int | None = None) -> list[tuple]:
+        """(id, user_id, stock, quantity, avg_price) rows in (user_id, id) order, like position_query."""
+        if user_ids is not None:
+            ids = (id_ for user_id in sorted(set(user_ids)) for id_ in self.by_user.get(user_id, ()))
+            if symbol:
+                ids = (id_ for id_ in ids if self.rows[id_][1] == symbol)
+        elif symbol:
+            ids = sorted(self.by_stock.get(symbol, ()), key=lambda id_: (self.rows[id_][0], id_))
+        else:
+            ids = (id_ for user_id in sorted(self.by_user) for id_ in self.by_user[user_id])
+        return [(id_, *self.rows[id_]) for id_ in itertools.islice(ids, limit)]
+
+
+position_book = PositionBook()
 
 # ============== HELPER FUNCS ==============
 def safe_handler(func):
+    @functools.wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        token = current_command.set(func.__name__)
+        start = time.perf_counter()
+        error = False
         try:
+            await remember_user(update)
             await func(update, context)
+        except RetryAfter as e:
+            # Replying with the error would only hit the same flood limit again.
+            error = True
+            print(f"⚠️ Flood control gave up in {func.__name__}: {e}")
         except Exception as e:
+            error = True
             print(f"⚠️ Error in {func.__name__}: {e}")
             if update.message:
                 await update.message.reply_text(f"⚠️ Terjadi error: {e}")
+        finally:
+            metrics.observe(func.__name__, time.perf_counter() - start, error)
+            current_command.reset(token)
     return wrapper
 
-async def maybe_delete_command(update: Update):
-    """Try to delete the user's command message to reduce chat clutter.
-    Requires the bot to have 'Delete messages' admin permission in groups.
-    Silently ignores failures (e.g., lack of permission or 48h limit).
+class CommandCleaner:
+    """Deletes users' command messages in the background to reduce chat clutter.
+
+    Handlers only queue the message; a background task removes everything queued for a chat
+    with one deleteMessages call (up to 100 ids) every COMMAND_DELETE_INTERVAL seconds, so no
+    command waits on the round-trip. Requires the bot to have 'Delete messages' admin
+    permission in groups; failures (no permission, 48h limit) are counted, not raised, and
+    anything unexpected is also logged, so one bad batch never stops the background task.
     """
-    try:
-        if update and getattr(update, "message", None):
-            await update.message.delete()
-    except Exception as e:
-        # Don't break command flow if deletion fails
-        print(f"⚠️ Could not delete command message: {e}")
+
+    BATCH = 100  # Bot API limit for deleteMessages
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.deleted = 0
+        self.failed = 0
+        self._pending = {}  # chat_id -> [message_id, ...]
+        self._task = None
+
+    def add(self, chat_id: int, message_id: int):
+        self._pending.setdefault(chat_id, []).append(message_id)
+
+    async def start(self, app: Application):
+        self._task = asyncio.create_task(self._run(app.bot))
+
+    async def stop(self, app: Application):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush(app.bot)
+
+    async def flush(self, bot):
+        pending, self._pending = self._pending, {}
+        for chat_id, message_ids in pending.items():
+            for start in range(0, len(message_ids), self.BATCH):
+                batch = message_ids[start:start + self.BATCH]
+                try:
+                    await bot.delete_messages(chat_id, batch)
+                    self.deleted += len(batch)
+                except TelegramError:
+                    self.failed += len(batch)
+                except Exception as e:
+                    self.failed += len(batch)
+                    print(f"⚠️ Deleting commands in chat {chat_id} failed: {e!r}")
+
+    async def _run(self, bot):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush(bot)
+
+
+command_cleaner = CommandCleaner(COMMAND_DELETE_INTERVAL)
+
+def maybe_delete_command(update: Update):
+    """Queue the user's command message for deletion (see CommandCleaner)."""
+    message = getattr(update, "message", None) if update else None
+    if message:
+        command_cleaner.add(message.chat_id, message.message_id)
 
 def format_amount(amount: float) -> str:
     emoji = "📈" if amount > 0 else "📉" if amount < 0 else "➖"
@@ -57,13 +1161,16 @@ def format_amount(amount: float) -> str:
 def today_str():
     return datetime.now(JAKARTA_TZ).strftime("%Y-%m-%d")
 
+FILTER_FLAGS = ("--user", "--symbol", "--from", "--to", "--min", "--max", "--limit", "--sort")
+
 def parse_flags(args: list[str]) -> dict:
     """Minimal flag parser for commands like /trade list and /pos list"""
-    flags = {"--user": None, "--symbol": None, "--from": None, "--to": None, "args": []}
+    flags = {flag: None for flag in FILTER_FLAGS}
+    flags["args"] = []
     i = 0
     while i < len(args):
         tok = args[i]
-        if tok in ("--user", "--symbol", "--from", "--to"):
+        if tok in FILTER_FLAGS:
             if i + 1 < len(args):
                 flags[tok] = args[i + 1]
                 i += 2
@@ -75,6 +1182,44 @@ def parse_flags(args: list[str]) -> dict:
             i += 1
     return flags
 
+def parse_id_specs(tokens: list[str]) -> tuple[list[int], set[int]]:
+    """Parse IDs like `12`, `10-20` and `3,4,5` for the bulk edit/delete commands.
+    Returns (ids in the given order without duplicates, IDs that were named explicitly).
+    Gaps inside a range are allowed; explicitly named IDs must exist.
+    """
+    ids = {}
+    explicit = set()
+    for tok in tokens:
+        for part in tok.split(","):
+            if not part:
+                continue
+            lo, sep, hi = part.partition("-")
+            if not lo.isdigit() or (sep and not hi.isdigit()):
+                raise ValueError(f"'{part}' is not an ID or FROM-TO range")
+            if sep:
+                start, stop = sorted((int(lo), int(hi)))
+                # checked before expanding, so /tdel 1-999999999 costs nothing
+                if stop - start + 1 > MAX_BULK_IDS:
+                    raise ValueError(f"At most {MAX_BULK_IDS} IDs per command")
+                for i in range(start, stop + 1):
+                    ids[i] = None
+            else:
+                ids[int(part)] = None
+                explicit.add(int(part))
+            if len(ids) > MAX_BULK_IDS:
+                raise ValueError(f"At most {MAX_BULK_IDS} IDs per command")
+    return list(ids), explicit
+
+def format_id_ranges(ids) -> str:
+    """[1, 2, 3, 7] -> '1-3, 7'"""
+    parts = []
+    for i in sorted(ids):
+        if parts and parts[-1][1] == i - 1:
+            parts[-1][1] = i
+        else:
+            parts.append([i, i])
+    return ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in parts)
+
 def user_is_admin(update: Update) -> bool:
     username = (update.effective_user.username or "").lower()
     return username in [u.lower() for u in ADMIN_USERNAMES]
@@ -84,18 +1229,425 @@ def effective_owner(update: Update) -> str:
     uname = update.effective_user.username
     return ("@" + uname) if uname else update.effective_user.first_name
 
-def stored_owner_key(update: Update) -> tuple[str, str]:
-    """Return tuple (display_name, ownership_key) where ownership_key is used for DB compare"""
-    uname = update.effective_user.username
-    if uname:
-        return (update.effective_user.first_name, uname.lower())
-    return (update.effective_user.first_name, update.effective_user.first_name)
+# ================ REPLIES ================
+class Report:
+    """Reply text collected as sections of lines (sections are separated by a blank line).
+
+    Handlers append lines instead of growing one string, and long reports are split on
+    section boundaries where that keeps messages well filled, else between lines, never mid-line.
+    """
+
+    def __init__(self, *lines: str):
+        self.sections = [list(lines)] if lines else []
+
+    def section(self, *lines: str) -> list[str]:
+        """Start a new section; returns its line list so callers can append to it."""
+        lines = list(lines)
+        self.sections.append(lines)
+        return lines
+
+    def text(self) -> str:
+        return "\n\n".join("\n".join(lines) for lines in self.sections if lines)
+
+    def chunks(self, limit: int = MESSAGE_CHUNK_CHARS) -> list[str]:
+        """The text as messages of at most `limit` chars, split between lines. A section that
+        does not fit in the current message starts the next one, unless it is longer than a
+        message or the current one is not yet half full: then it continues line by line.
+        Only a single line longer than `limit` is cut."""
+        chunks = []
+        current = []
+        size = 0
+
+        def add(line: str):
+            nonlocal size
+            size += len(line) + (1 if current else 0)
+            current.append(line)
+
+        def flush():
+            nonlocal size
+            if current:
+                chunks.append("\n".join(current))
+                current.clear()
+                size = 0
+
+        for lines in self.sections:
+            if not lines:
+                continue
+            length = sum(map(len, lines)) + len(lines) - 1
+            if current and size + 2 + length > limit and length <= limit and size >= limit // 2:
+                flush()
+            for line in ([""] if current else []) + lines:
+                while len(line) > limit:
+                    room = limit - size - (1 if current else 0)
+                    if room > 0:
+                        add(line[:room])
+                        line = line[room:]
+                    flush()
+                if current and size + 1 + len(line) > limit:
+                    flush()
+                if current or line:  # no blank line at the top of a message
+                    add(line)
+        flush()
+        return chunks
+
+async def send_report(report: Report, filename: str, send_text, send_document, bulk: bool = False):
+    """Send a report as one or more messages, or as a .txt document once it is too long
+    to read in chat. send_text(text) / send_document(file, filename=, caption=) are
+    e.g. message.reply_text / message.reply_document. Only the first message of a
+    command reply is interactive; the rest queue behind other chats' replies.
+    """
+    text = report.text()
+    if len(text) > REPORT_DOCUMENT_CHARS:
+        first_line = report.sections[0][0] if report.sections and report.sections[0] else filename
+        await send_document(io.BytesIO(text.encode("utf-8")), filename=filename,
+                            caption=f"{first_line} (full report attached)", rate_limit_args=SEND_BULK)
+        return
+    for i, chunk in enumerate(report.chunks()):
+        await send_text(chunk, rate_limit_args=SEND_BULK if bulk or i else SEND_INTERACTIVE)
+
+def reply_senders(message):
+    """(send_text, send_document) that answer `message` like message.reply_text /
+    reply_document (quoting it outside private chats) but go through the bot, since the
+    Message shortcuts don't accept rate_limit_args for the SendScheduler."""
+    bot = message.get_bot()
+    quote = (ReplyParameters(message.message_id, allow_sending_without_reply=True)
+             if message.chat.type != Chat.PRIVATE else None)
+    return (functools.partial(bot.send_message, message.chat_id, reply_parameters=quote),
+            functools.partial(bot.send_document, message.chat_id, reply_parameters=quote))
+
+async def reply_report(update: Update, report: Report, filename: str):
+    await send_report(report, filename, *reply_senders(update.message))
+
+# ================ USERS ================
+# Telegram user_id -> (username, display_name) already written to `users` by this process.
+_known_users: dict[int, tuple] = {}
+
+async def remember_user(update: Update):
+    """Make sure the sender has an up-to-date `users` row (one write per new name/username)."""
+    user = getattr(update, "effective_user", None)
+    if user is None:
+        return
+    identity = ((user.username or "").lower() or None, user.first_name)
+    if _known_users.get(user.id) == identity:
+        return
+    now_str = datetime.now(JAKARTA_TZ).strftime("%Y-%m-%d %H:%M:%S")
+    merged = await db_write(_upsert_user, user.id, identity[0], identity[1], now_str)
+    if merged is not None:
+        position_book.move_user(merged, user.id)
+    _known_users[user.id] = identity
+
+# ============== FILTER COMPILER ==============
+# /tlist, /texport, /plist and /pexport compile their flags into a fixed set of SQL templates:
+# clauses always come out in the order below and every value is a parameter, so each filter
+# shape is a single prepared statement that the reader connections keep cached.
+TRADE_FILTERS = (
+    ("--user", "user_id"), ("--symbol", "stock = ?"), ("--from", "date >= ?"), ("--to", "date <= ?"),
+    ("--min", "amount >= ?"), ("--max", "amount <= ?"),
+)
+POSITION_FILTERS = (("--user", "user_id"), ("--symbol", "stock = ?"))
+# --sort NAME -> (column, direction); ties are broken by id in the same direction.
+TRADE_SORTS = {"new": ("date", "DESC"), "old": ("date", "ASC"), "best": ("amount", "DESC"), "worst": ("amount", "ASC")}
+TRADE_COLUMNS = "id, date, user_id, stock, amount"
+POSITION_COLUMNS = "id, user_id, stock, quantity, avg_price"
+
+def user_id_clause(count: int) -> str:
+    """`user_id = ?`, or an IN list padded to a power of two to keep the number of templates small."""
+    if count == 1:
+        return "user_id = ?"
+    return f"user_id IN ({','.join('?' * (1 << (count - 1).bit_length()))})"
+
+def compile_filter(flags: dict, filters: tuple, sorts: dict | None, user_ids: list[int] | None = None) -> dict:
+    """parse_flags output -> {"where": (...), "params": (...), "sort": NAME, "limit": N or None}.
+    `user_ids` are the ids --user resolved to. Raises ValueError for bad or unsupported flags.
+    """
+    supported = {flag for flag, _ in filters} | {"--limit"} | ({"--sort"} if sorts else set())
+    for flag in FILTER_FLAGS:
+        if flags.get(flag) is not None and flag not in supported:
+            raise ValueError(f"{flag} is not supported here")
+    where, params = [], []
+    for flag, clause in filters:
+        value = flags.get(flag)
+        if value is None:
+            continue
+        if flag == "--user":
+            clause = user_id_clause(len(user_ids))
+            params.extend(user_ids + user_ids[-1:] * (clause.count("?") - len(user_ids)))
+        elif flag == "--symbol":
+            params.append(value.upper())
+        elif flag in ("--from", "--to"):
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise ValueError(f"{flag} must be YYYY-MM-DD") from None
+            params.append(value)
+        else:
+            try:
+                params.append(float(value.replace(",", "")))
+            except ValueError:
+                raise ValueError(f"{flag} must be a number") from None
+        where.append(clause)
+
+    limit = flags.get("--limit")
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            raise ValueError("--limit must be a positive whole number")
+        limit = int(limit)
+    sort = (flags.get("--sort") or "new").lower() if sorts else None
+    if sorts and sort not in sorts:
+        raise ValueError(f"--sort must be one of: {', '.join(sorts)}")
+    symbol = flags.get("--symbol")
+    return {"where": tuple(where), "params": tuple(params), "sort": sort, "limit": limit,
+            "user_ids": tuple(user_ids) if flags.get("--user") else None, "symbol": symbol.upper() if symbol else None}
+
+async def resolve_filter(update: Update, flags: dict, filters: tuple, sorts: dict | None = None) -> dict:
+    """compile_filter after looking up --user me|NAME|@username."""
+    user_ids = None
+    value = flags.get("--user")
+    if value:
+        user_ids = [update.effective_user.id] if value.lower() == "me" else await db_read(_find_user_ids, value)
+        if not user_ids:
+            raise ValueError(f"No user matches {value}")
+    return compile_filter(flags, filters, sorts, user_ids)
+
+@functools.lru_cache(maxsize=None)
+def trade_query(where: tuple, sort: str, seek: str | None = None) -> str:
+    """Canonical trade listing. seek="next"/"prev" adds a keyset bound on (sort column, id);
+    "prev" reads backwards, so the caller reverses those rows. Ends in LIMIT ? (-1 = no limit).
+    """
+    column, direction = TRADE_SORTS[sort]
+    clauses = list(where)
+    if seek == "prev":
+        direction = "ASC" if direction == "DESC" else "DESC"
+    if seek:
+        clauses.append(f"({column}, id) {'<' if direction == 'DESC' else '>'} (?, ?)")
+    query = f"SELECT {TRADE_COLUMNS} FROM logs"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    if column == "amount" and any(clause.split()[0] in ("user_id", "stock", "date") for clause in where):
+        # Sort the filtered rows instead of walking all of ix_logs_amount hoping to hit them.
+        column = "+amount"
+    return query + f" ORDER BY {column} {direction}, id {direction} LIMIT ?"
+
+@functools.lru_cache(maxsize=None)
+def trade_totals_query(where: tuple, sort: str, limited: bool) -> str:
+    """COUNT/SUM over everything a filter matches (or over its first --limit rows)."""
+    if limited:
+        return f"SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM ({trade_query(where, sort).replace(TRADE_COLUMNS, 'amount', 1)})"
+    # user/stock/date filters can be answered from the rollup: one row per user-stock-day.
+    if all(clause.split()[0] in ("user_id", "stock", "date") for clause in where):
+        query = "SELECT COALESCE(SUM(count), 0), COALESCE(SUM(total), 0) FROM daily_pnl"
+    else:
+        query = "SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM logs"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    return query
+
+@functools.lru_cache(maxsize=None)
+def position_query(where: tuple) -> str:
+    query = f"SELECT {POSITION_COLUMNS} FROM positions"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    return query + " ORDER BY user_id LIMIT ?"
+
+def trade_sort_key(sort: str, row: tuple) -> tuple:
+    """Keyset position of a trade row for the given --sort."""
+    column, _ = TRADE_SORTS[sort]
+    return (row[1] if column == "date" else row[4], row[0])
+
+# ================ WRITE JOBS ================
+# Run on the writer thread inside the group-commit transaction.
+def _upsert_user(cur, user_id: int, username: str | None, display_name: str, now_str: str):
+    """Insert/refresh a Telegram user. The first time an id is seen, rows stored under a
+    legacy placeholder (negative id, same @username or same first_name) are handed over to it.
+    """
+    legacy = None
+    if cur.execute("SELECT 1 FROM users WHERE id=?", (user_id,)).fetchone() is None:
+        legacy = cur.execute(
+            "SELECT id FROM users WHERE id<0 AND (username=? OR display_name=?) "
+            "ORDER BY username IS NULL, id DESC LIMIT 1",
+            (username, display_name)
+        ).fetchone()
+    if username:
+        # Usernames move between accounts; the newest owner keeps it.
+        cur.execute("UPDATE users SET username=NULL WHERE username=? AND id<>?", (username, user_id))
+    # Leaves the row alone (no change, so no cache invalidation) when nothing was renamed.
+    cur.execute(
+        "INSERT INTO users (id, username, display_name, updated_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (id) DO UPDATE SET username=excluded.username, "
+        "display_name=excluded.display_name, updated_at=excluded.updated_at "
+        "WHERE username IS NOT excluded.username OR display_name IS NOT excluded.display_name",
+        (user_id, username, display_name, now_str)
+    )
+    if legacy:
+        _merge_user(cur, legacy[0], user_id)
+        return legacy[0]
+    return None
+
+def _merge_user(cur, old_id: int, new_id: int):
+    cur.execute("UPDATE logs SET user_id=? WHERE user_id=?", (new_id, old_id))
+    cur.execute("UPDATE positions SET user_id=? WHERE user_id=?", (new_id, old_id))
+    cur.execute(
+        "INSERT INTO daily_pnl (date, user_id, stock, total, count) "
+        "SELECT date, ?, stock, total, count FROM daily_pnl WHERE user_id=? "
+        "ON CONFLICT (date, user_id, stock) DO UPDATE SET "
+        "total = total + excluded.total, count = count + excluded.count",
+        (new_id, old_id)
+    )
+    cur.execute("DELETE FROM daily_pnl WHERE user_id=?", (old_id,))
+    cur.execute("DELETE FROM users WHERE id=?", (old_id,))
+
+def _resolve_user(cur, name: str) -> int:
+    """Map an admin-supplied USER (`@username` or display name) to a user id, creating a
+    placeholder (negative id) for people the bot has not seen yet.
+    """
+    if name.startswith("@"):
+        username, display_name = name[1:].lower(), name[1:]
+        row = cur.execute(SQL_USER_BY_USERNAME, (username,)).fetchone()
+    else:
+        username, display_name = None, name
+        row = cur.execute(SQL_USER_BY_NAME + " ORDER BY id > 0 DESC LIMIT 1", (name,)).fetchone()
+    if row:
+        return row[0]
+    placeholder = min(cur.execute("SELECT MIN(id) FROM users").fetchone()[0] or 0, 0) - 1
+    now_str = datetime.now(JAKARTA_TZ).strftime("%Y-%m-%d %H:%M:%S")
+    cur.execute("INSERT INTO users (id, username, display_name, updated_at) VALUES (?, ?, ?, ?)",
+                (placeholder, username, display_name, now_str))
+    return placeholder
+
+def _rollup(cur, user_id: int, stock: str, date: str, d_total: float, d_count: int):
+    """Apply a trade delta to daily_pnl; rows whose last trade is gone are removed."""
+    cur.execute(
+        "INSERT INTO daily_pnl (date, user_id, stock, total, count) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (date, user_id, stock) DO UPDATE SET "
+        "total = total + excluded.total, count = count + excluded.count",
+        (date, user_id, stock, d_total, d_count)
+    )
+    if d_count < 0:
+        cur.execute("DELETE FROM daily_pnl WHERE date=? AND user_id=? AND stock=? AND count<=0",
+                    (date, user_id, stock))
+
+def _insert_trade(cur, user_id: int, stock: str, amount: float, date: str) -> int:
+    cur.execute("INSERT INTO logs (user_id, stock, amount, date) VALUES (?, ?, ?, ?)",
+                (user_id, stock, amount, date))
+    _rollup(cur, user_id, stock, date, amount, 1)
+    return cur.lastrowid
+
+def _insert_trade_for(cur, name: str, stock: str, amount: float, date: str) -> int:
+    return _insert_trade(cur, _resolve_user(cur, name), stock, amount, date)
+
+def _owned_rows(cur, table: str, columns: str, ids: list[int], explicit: set[int],
+                owner_id: int, is_admin: bool) -> tuple[list, list[int], list[int]]:
+    """Load `id, user_id, <columns>` for all IDs (one IN query per SQL_IN_CHUNK IDs).
+    Returns (rows, missing explicit IDs, IDs owned by someone else).
+    """
+    rows = []
+    for chunk in id_chunks(ids):
+        rows += cur.execute(f"SELECT id, user_id{', ' + columns if columns else ''} FROM {table} "
+                            f"WHERE id IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+    found = {row[0] for row in rows}
+    missing = sorted(explicit - found)
+    forbidden = [] if is_admin else [row[0] for row in rows if row[1] != owner_id]
+    return rows, missing, forbidden
+
+def _update_trades(cur, ids: list[int], explicit: set[int], new_amount: float,
+                   owner_id: int, is_admin: bool) -> tuple[list, list[int], list[int]]:
+    """All-or-nothing: returns (updated ids, missing, forbidden); nothing changes unless both are empty."""
+    rows, missing, forbidden = _owned_rows(cur, "logs", "stock, amount, date", ids, explicit, owner_id, is_admin)
+    if missing or forbidden or not rows:
+        return [], missing, forbidden
+    updated = [row[0] for row in rows]
+    for chunk in id_chunks(updated):
+        cur.execute(f"UPDATE logs SET amount=? WHERE id IN ({','.join('?' * len(chunk))})", (new_amount, *chunk))
+    deltas = {}
+    for _, user_id, stock, amount, date in rows:
+        deltas[(user_id, stock, date)] = deltas.get((user_id, stock, date), 0.0) + new_amount - (amount or 0)
+    for (user_id, stock, date), delta in deltas.items():
+        _rollup(cur, user_id, stock, date, delta, 0)
+    return updated, [], []
+
+def _delete_trades(cur, ids: list[int], explicit: set[int],
+                   owner_id: int, is_admin: bool) -> tuple[list, list[int], list[int]]:
+    rows, missing, forbidden = _owned_rows(cur, "logs", "stock, amount, date", ids, explicit, owner_id, is_admin)
+    if missing or forbidden or not rows:
+        return [], missing, forbidden
+    deleted = [row[0] for row in rows]
+    for chunk in id_chunks(deleted):
+        cur.execute(f"DELETE FROM logs WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+    deltas = {}
+    for _, user_id, stock, amount, date in rows:
+        total, count = deltas.get((user_id, stock, date), (0.0, 0))
+        deltas[(user_id, stock, date)] = (total - (amount or 0), count - 1)
+    for (user_id, stock, date), (total, count) in deltas.items():
+        _rollup(cur, user_id, stock, date, total, count)
+    return deleted, [], []
+
+def _insert_position(cur, user_id: int, stock: str, quantity: float, avg_price: float, date: str, now_str: str) -> int:
+    cur.execute(
+        "INSERT INTO positions (user_id, stock, quantity, avg_price, date, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (user_id, stock, quantity, avg_price, date, now_str, now_str)
+    )
+    return cur.lastrowid
+
+def _insert_position_for(cur, name: str, stock: str, quantity: float, avg_price: float, date: str,
+                         now_str: str) -> tuple[int, int]:
+    """Returns (position id, user id)."""
+    user_id = _resolve_user(cur, name)
+    return _insert_position(cur, user_id, stock, quantity, avg_price, date, now_str), user_id
+
+def _import_trades(cur, rows: list[tuple]) -> int:
+    """rows: (user name, stock, amount, date)"""
+    user_ids = {name: _resolve_user(cur, name) for name in {row[0] for row in rows}}
+    rows = [(user_ids[name], stock, amount, date) for name, stock, amount, date in rows]
+    cur.executemany("INSERT INTO logs (user_id, stock, amount, date) VALUES (?, ?, ?, ?)", rows)
+    per_day = {}
+    for user_id, stock, amount, date in rows:
+        total, count = per_day.get((date, user_id, stock), (0.0, 0))
+        per_day[(date, user_id, stock)] = (total + amount, count + 1)
+    cur.executemany(
+        "INSERT INTO daily_pnl (date, user_id, stock, total, count) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (date, user_id, stock) DO UPDATE SET "
+        "total = total + excluded.total, count = count + excluded.count",
+        [(date, user_id, stock, total, count) for (date, user_id, stock), (total, count) in per_day.items()]
+    )
+    return len(rows)
+
+def _import_positions(cur, rows: list[tuple], date: str, now_str: str) -> int:
+    """rows: (user name, stock, quantity, avg_price)"""
+    user_ids = {name: _resolve_user(cur, name) for name in {row[0] for row in rows}}
+    cur.executemany(
+        "INSERT INTO positions (user_id, stock, quantity, avg_price, date, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(user_ids[name], stock, quantity, avg_price, date, now_str, now_str) for name, stock, quantity, avg_price in rows]
+    )
+    return len(rows)
+
+def _update_positions(cur, ids: list[int], explicit: set[int], new_qty: float, new_avg: float, now_str: str,
+                      owner_id: int, is_admin: bool) -> tuple[list, list[int], list[int]]:
+    rows, missing, forbidden = _owned_rows(cur, "positions", "", ids, explicit, owner_id, is_admin)
+    if missing or forbidden or not rows:
+        return [], missing, forbidden
+    updated = [row[0] for row in rows]
+    for chunk in id_chunks(updated):
+        cur.execute(
+            f"UPDATE positions SET quantity=?, avg_price=?, updated_at=? WHERE id IN ({','.join('?' * len(chunk))})",
+            (new_qty, new_avg, now_str, *chunk)
+        )
+    return updated, [], []
+
+def _delete_positions(cur, ids: list[int], explicit: set[int],
+                      owner_id: int, is_admin: bool) -> tuple[list, list[int], list[int]]:
+    rows, missing, forbidden = _owned_rows(cur, "positions", "", ids, explicit, owner_id, is_admin)
+    if missing or forbidden or not rows:
+        return [], missing, forbidden
+    deleted = [row[0] for row in rows]
+    for chunk in id_chunks(deleted):
+        cur.execute(f"DELETE FROM positions WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+    return deleted, [], []
 
 # ================ COMMANDS (TRADES) ================
 @safe_handler
 async def trade_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Add a trade P/L entry: /trade add SYMBOL AMOUNT"""
-    await maybe_delete_command(update)
+    maybe_delete_command(update)
     if len(context.args) < 2:
         await update.message.reply_text("Usage: /trade add SYMBOL AMOUNT")
         return
@@ -105,187 +1657,184 @@ async def trade_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         await update.message.reply_text("Amount must be a number")
         return
-    display_name, owner_key = stored_owner_key(update)
     date = today_str()
-    c.execute("INSERT INTO logs (user, stock, amount, date) VALUES (?, ?, ?, ?)",
-              (display_name, stock, amount, date))
-    conn.commit()
-    await update.message.reply_text(f"✅ Logged {stock} {format_amount(amount)} for {display_name}")
+    await db_write(_insert_trade, update.effective_user.id, stock, amount, date)
+    await update.message.reply_text(f"✅ Logged {stock} {format_amount(amount)} for {update.effective_user.first_name}")
+
+def bulk_result_text(noun: str, verb: str, changed: list, missing: list[int], forbidden: list[int],
+                     ids: list[int]) -> str | None:
+    """Error reply for a rejected bulk edit/delete, or None when it went through."""
+    if changed:
+        return None
+    lines = []
+    if missing:
+        lines.append(f"❌ {noun.capitalize()} not found: {format_id_ranges(missing)}")
+    if forbidden:
+        lines.append(f"⛔ You can only {verb} your own {noun}s: {format_id_ranges(forbidden)}")
+    if not lines:
+        lines.append(f"❌ No {noun}s found for {format_id_ranges(ids)}")
+    elif len(ids) > 1:
+        lines.append("Nothing was changed.")
+    return "\n".join(lines)
 
 @safe_handler
 async def trade_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Edit a trade by ID: /trade edit ID NEW_AMOUNT"""
-    await maybe_delete_command(update)
+    """Edit trades by ID: /trade edit ID[,ID|FROM-TO ...] NEW_AMOUNT (all or nothing)"""
+    maybe_delete_command(update)
     if len(context.args) < 2:
-        await update.message.reply_text("Usage: /trade edit ID NEW_AMOUNT")
+        await update.message.reply_text("Usage: /trade edit ID [ID|FROM-TO ...] NEW_AMOUNT")
         return
-    trade_id = context.args[0]
     try:
-        new_amount = float(context.args[1].replace(",", ""))
+        ids, explicit = parse_id_specs(context.args[:-1])
+    except ValueError as e:
+        await update.message.reply_text(f"Invalid IDs: {e}")
+        return
+    try:
+        new_amount = float(context.args[-1].replace(",", ""))
     except ValueError:
         await update.message.reply_text("Amount must be a number")
         return
-    display_name, owner_key = stored_owner_key(update)
-    username = update.effective_user.username or ""
-    c.execute("SELECT id, user FROM logs WHERE id=?", (trade_id,))
-    row = c.fetchone()
-    if not row:
-        await update.message.reply_text("❌ Trade not found")
+    updated, missing, forbidden = await db_write(_update_trades, ids, explicit, new_amount,
+                                                 update.effective_user.id, user_is_admin(update))
+    error = bulk_result_text("trade", "edit", updated, missing, forbidden, ids)
+    if error:
+        await update.message.reply_text(error)
         return
-    owner_display = row[1]
-    # Allow if admin or same display name (backward compatible)
-    if owner_display != display_name and not user_is_admin(update):
-        await update.message.reply_text("⛔ You can only edit your own trades")
-        return
-    c.execute("UPDATE logs SET amount=? WHERE id=?", (new_amount, trade_id))
-    conn.commit()
-    await update.message.reply_text(f"✏️ Updated trade {trade_id} → {format_amount(new_amount)}")
+    await update.message.reply_text(
+        f"✏️ Updated trade{'s' if len(updated) > 1 else ''} {format_id_ranges(updated)} → {format_amount(new_amount)}")
 
 @safe_handler
 async def trade_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Delete a trade by ID: /trade delete ID"""
-    await maybe_delete_command(update)
+    """Delete trades by ID: /trade delete ID[,ID|FROM-TO ...] (all or nothing)"""
+    maybe_delete_command(update)
     if len(context.args) < 1:
-        await update.message.reply_text("Usage: /trade delete ID")
+        await update.message.reply_text("Usage: /trade delete ID [ID|FROM-TO ...]")
         return
-    trade_id = context.args[0]
-    display_name, owner_key = stored_owner_key(update)
-    c.execute("SELECT id, user FROM logs WHERE id=?", (trade_id,))
-    row = c.fetchone()
-    if not row:
-        await update.message.reply_text("❌ Trade not found")
+    try:
+        ids, explicit = parse_id_specs(context.args)
+    except ValueError as e:
+        await update.message.reply_text(f"Invalid IDs: {e}")
         return
-    owner_display = row[1]
-    if owner_display != display_name and not user_is_admin(update):
-        await update.message.reply_text("⛔ You can only delete your own trades")
+    deleted, missing, forbidden = await db_write(_delete_trades, ids, explicit,
+                                                 update.effective_user.id, user_is_admin(update))
+    error = bulk_result_text("trade", "delete", deleted, missing, forbidden, ids)
+    if error:
+        await update.message.reply_text(error)
         return
-    c.execute("DELETE FROM logs WHERE id=?", (trade_id,))
-    conn.commit()
-    await update.message.reply_text(f"🗑️ Deleted trade {trade_id}")
+    await update.message.reply_text(f"🗑️ Deleted trade{'s' if len(deleted) > 1 else ''} {format_id_ranges(deleted)}")
+
+def _trade_page(rconn: sqlite3.Connection, filt: dict, seek: str | None, key: tuple | None,
+                limit: int, with_totals: bool) -> tuple[list, tuple | None]:
+    """One keyset page of trades plus, optionally, COUNT/SUM over the whole filter."""
+    rows = rconn.execute(trade_query(filt["where"], filt["sort"], seek),
+                         (*filt["params"], *(key or ()), limit)).fetchall()
+    if seek == "prev":
+        rows.reverse()
+    totals = None
+    if with_totals:
+        limited = filt["limit"] is not None
+        params = (*filt["params"], filt["limit"]) if limited else filt["params"]
+        totals = rconn.execute(trade_totals_query(filt["where"], filt["sort"], limited), params).fetchone()
+    return rows, totals
+
+def _named_trade_page(rconn: sqlite3.Connection, *args) -> tuple[list, tuple | None, dict]:
+    rows, totals = _trade_page(rconn, *args)
+    return rows, totals, _user_names(rconn, (row[2] for row in rows))
+
+def render_trade_page(token: str, session: dict, rows: list, names: dict) -> tuple[str, InlineKeyboardMarkup | None]:
+    pages = max(1, math.ceil(session["count"] / TLIST_PAGE_SIZE))
+    total = session["total"]
+    report = Report(f"📊 Trades — page {session['page']}/{pages} ({session['count']} trades)")
+    lines = report.section()
+    for tid, date, user_id, stock, amount in rows:
+        lines.append(f"[{tid}] {date} {names.get(user_id, '?')} {stock}: {format_amount(amount)}")
+    report.section(f"💰 Group Total: {total:+,.0f} {'✅' if total>=0 else '❌'}")
+    buttons = []
+    if session["page"] > 1:
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"tl:{token}:prev"))
+    if session["page"] < pages:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"tl:{token}:next"))
+    return report.text(), (InlineKeyboardMarkup([buttons]) if buttons else None)
 
 @safe_handler
 async def trade_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """List trades with filters:
-    /trade list [--user @username|me] [--symbol SYMBOL] [--from YYYY-MM-DD] [--to YYYY-MM-DD]
+    """List trades with filters, one page at a time:
+    /trade list [--user me|NAME|@username] [--symbol SYMBOL] [--from YYYY-MM-DD] [--to YYYY-MM-DD]
+                [--min AMOUNT] [--max AMOUNT] [--limit N] [--sort new|old|best|worst]
     """
-    await maybe_delete_command(update)
-    f = parse_flags(context.args)
-    user_filter = f["--user"]
-    symbol_filter = f["--symbol"]
-    from_filter = f["--from"]
-    to_filter = f["--to"]
-
-    params = []
-    where = []
-    if user_filter:
-        if user_filter.lower() == "me":
-            display_name, _ = stored_owner_key(update)
-            where.append("user = ?")
-            params.append(display_name)
-        elif user_filter.startswith("@"):
-            # We only stored display names historically; best effort: match first_name equal to me if @me, else cannot map reliably.
-            await update.message.reply_text("⚠️ Filtering by @username not fully supported yet; use --user me or omit.")
-        else:
-            where.append("user = ?")
-            params.append(user_filter)
-    if symbol_filter:
-        where.append("stock = ?")
-        params.append(symbol_filter.upper())
-    if from_filter:
-        where.append("date >= ?")
-        params.append(from_filter)
-    if to_filter:
-        where.append("date <= ?")
-        params.append(to_filter)
-
-    query = "SELECT user, stock, amount, date, id FROM logs"
-    if where:
-        query += " WHERE " + " AND ".join(where)
-    query += " ORDER BY date DESC, id DESC"
-    c.execute(query, tuple(params))
-    trades = c.fetchall()
+    maybe_delete_command(update)
+    try:
+        filt = await resolve_filter(update, parse_flags(context.args), TRADE_FILTERS, TRADE_SORTS)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
 
-    if not trades:
+    rows, (count, total), names = await db_read(_named_trade_page, filt, None, None,
+                                                min(TLIST_PAGE_SIZE, filt["limit"] or TLIST_PAGE_SIZE), True)
+    if not rows:
         await update.message.reply_text("📊 No trades found for given filters.")
         return
 
-    # Group by user for compactness
-    summary = {}
-    total = 0.0
-    for user, stock, amount, date, tid in trades:
-        summary.setdefault(user, []).append((date, tid, stock, amount))
-        total += amount
+    # Paging state lives server-side; callback_data only carries a short token.
+    sessions = context.chat_data.setdefault("tlist", {})
+    token = secrets.token_hex(4)
+    session = {"filter": filt, "page": 1, "count": count, "total": total,
+               "first": trade_sort_key(filt["sort"], rows[0]), "last": trade_sort_key(filt["sort"], rows[-1])}
+    sessions[token] = session
+    while len(sessions) > TLIST_SESSIONS_PER_CHAT:
+        sessions.pop(next(iter(sessions)))
+    text, markup = render_trade_page(token, session, rows, names)
+    await update.message.reply_text(text, reply_markup=markup)
 
-    msg = "📊 Trades\n\n"
-    for user, items in summary.items():
-        msg += f"{user}:\n"
-        for date, tid, stock, amount in items[:50]:
-            msg += f"  [{tid}] {date} {stock}: {format_amount(amount)}\n"
-        if len(items) > 50:
-            msg += f"  ... and {len(items)-50} more\n"
-        msg += "\n"
-    msg += f"💰 Group Total: {total:+,.0f} {'✅' if total>=0 else '❌'}"
-    # Split long messages into 4000-char chunks to avoid Telegram limits
-    MAX_LEN = 4000
-    for i in range(0, len(msg), MAX_LEN):
-        await update.message.reply_text(msg[i:i + MAX_LEN])
+@safe_handler
+async def trade_list_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Prev/Next buttons under a /tlist page (callback data tl:TOKEN:prev|next)"""
+    query = update.callback_query
+    _, token, direction = query.data.split(":")
+    session = context.chat_data.get("tlist", {}).get(token)
+    if session is None:
+        await query.answer("⌛ This list has expired, run /tlist again.")
+        return
+    filt = session["filter"]
+    limit = TLIST_PAGE_SIZE
+    if direction == "next":
+        key, step = session["last"], 1
+        if filt["limit"] is not None:
+            # --limit caps the whole listing; every earlier page was full.
+            limit = min(limit, filt["limit"] - session["page"] * TLIST_PAGE_SIZE)
+    else:
+        key, step = session["first"], -1
+    rows, names = [], {}
+    if limit > 0:
+        rows, _, names = await db_read(_named_trade_page, filt, direction, key, limit, False)
+    if not rows:
+        await query.answer("No more trades.")
+        return
+    session["page"] = max(1, session["page"] + step)
+    session["first"] = trade_sort_key(filt["sort"], rows[0])
+    session["last"] = trade_sort_key(filt["sort"], rows[-1])
+    text, markup = render_trade_page(token, session, rows, names)
+    await query.answer()
+    await query.edit_message_text(text, reply_markup=markup)
 
 
 # ================ TRADE EXPORT =================
 @safe_handler
 async def trade_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Export trades as CSV file with filters (like /tlist): /texport [flags]"""
-    await maybe_delete_command(update)
+    """Export trades as CSV file with filters (like /tlist): /texport [flags] [--gzip]"""
+    maybe_delete_command(update)
     f = parse_flags(context.args)
-    user_filter = f["--user"]
-    symbol_filter = f["--symbol"]
-    from_filter = f["--from"]
-    to_filter = f["--to"]
-
-    params = []
-    where = []
-    if user_filter:
-        if user_filter.lower() == "me":
-            display_name, _ = stored_owner_key(update)
-            where.append("user = ?")
-            params.append(display_name)
-        elif user_filter.startswith("@"):
-            await update.message.reply_text("⚠️ Filtering by @username not fully supported yet; use --user me or omit.")
-        else:
-            where.append("user = ?")
-            params.append(user_filter)
-    if symbol_filter:
-        where.append("stock = ?")
-        params.append(symbol_filter.upper())
-    if from_filter:
-        where.append("date >= ?")
-        params.append(from_filter)
-    if to_filter:
-        where.append("date <= ?")
-        params.append(to_filter)
-
-    query = "SELECT id, user, stock, amount, date FROM logs"
-    if where:
-        query += " WHERE " + " AND ".join(where)
-    query += " ORDER BY date DESC, id DESC"
-    c.execute(query, tuple(params))
-    trades = c.fetchall()
-
-    if not trades:
-        await update.message.reply_text("📊 No trades found for given filters.")
+    try:
+        filt = await resolve_filter(update, f, TRADE_FILTERS, TRADE_SORTS)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
         return
-
-    # Write to a temporary CSV file
-    with tempfile.NamedTemporaryFile(mode="w+", newline="", suffix=".csv", delete=False) as tmpf:
-        writer = csv.writer(tmpf)
-        writer.writerow(["ID", "Date", "User", "Stock", "Amount"])
-        for tid, user, stock, amount, date in trades:
-            writer.writerow([tid, date, user, stock, amount])
-        tmpf.flush()
-        tmpf.seek(0)
-        # Send file as document
-        with open(tmpf.name, "rb") as f:
-            await update.message.reply_document(f, filename="trades_export.csv", caption="📊 Trades Export")
+    query = trade_query(filt["where"], filt["sort"])
+    params = (*filt["params"], filt["limit"] or -1)
+    count = await send_export(update, query, tuple(params), TRADE_CSV_HEADER,
+                              "trades_export.csv", "📊 Trades Export", "--gzip" in f["args"], 2)
+    if not count:
+        await update.message.reply_text("📊 No trades found for given filters.")
 
 
 
@@ -293,7 +1842,7 @@ async def trade_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
 @safe_handler
 async def trades_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Shortcut: list all trades (no filters)"""
-    await maybe_delete_command(update)
+    maybe_delete_command(update)
     # Call trade_list with no args
     context.args = []
     await trade_list(update, context)
@@ -302,7 +1851,7 @@ async def trades_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
 @safe_handler
 async def pos_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Add a position: /pos add SYMBOL QTY AVG_PRICE"""
-    await maybe_delete_command(update)
+    maybe_delete_command(update)
     if len(context.args) < 3:
         await update.message.reply_text("Usage: /pos add SYMBOL QTY AVG_PRICE")
         return
@@ -313,215 +1862,164 @@ async def pos_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         await update.message.reply_text("Quantity and Avg Price must be numbers")
         return
-    display_name, owner_key = stored_owner_key(update)
     date = today_str()
     now_str = datetime.now(JAKARTA_TZ).strftime("%Y-%m-%d %H:%M:%S")
-    c.execute(
-        "INSERT INTO positions (user, stock, quantity, avg_price, date, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (display_name, stock, quantity, avg_price, date, now_str, now_str)
-    )
-    conn.commit()
-    await update.message.reply_text(f"✅ Logged position {stock} Qty: {quantity} Avg Price: {avg_price} for {display_name}")
+    position_id = await db_write(_insert_position, update.effective_user.id, stock, quantity, avg_price, date, now_str)
+    position_book.add(position_id, update.effective_user.id, stock, quantity, avg_price)
+    await update.message.reply_text(
+        f"✅ Logged position {stock} Qty: {quantity} Avg Price: {avg_price} for {update.effective_user.first_name}")
 
 @safe_handler
 async def pos_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Edit a position: /pos edit ID QTY AVG_PRICE"""
-    await maybe_delete_command(update)
+    """Edit positions: /pos edit ID[,ID|FROM-TO ...] QTY AVG_PRICE (all or nothing)"""
+    maybe_delete_command(update)
     if len(context.args) < 3:
-        await update.message.reply_text("Usage: /pos edit ID QTY AVG_PRICE")
+        await update.message.reply_text("Usage: /pos edit ID [ID|FROM-TO ...] QTY AVG_PRICE")
+        return
+    try:
+        ids, explicit = parse_id_specs(context.args[:-2])
+    except ValueError as e:
+        await update.message.reply_text(f"Invalid IDs: {e}")
         return
-    pos_id = context.args[0]
     try:
-        new_qty = float(context.args[1].replace(",", ""))
-        new_avg = float(context.args[2].replace(",", ""))
+        new_qty = float(context.args[-2].replace(",", ""))
+        new_avg = float(context.args[-1].replace(",", ""))
     except ValueError:
         await update.message.reply_text("Quantity and Avg Price must be numbers")
         return
-    display_name, owner_key = stored_owner_key(update)
-    c.execute("SELECT user FROM positions WHERE id=?", (pos_id,))
-    row = c.fetchone()
-    if not row:
-        await update.message.reply_text("❌ Position not found")
-        return
-    owner_display = row[0]
-    if owner_display != display_name and not user_is_admin(update):
-        await update.message.reply_text("⛔ You can only edit your own positions")
-        return
     now_str = datetime.now(JAKARTA_TZ).strftime("%Y-%m-%d %H:%M:%S")
-    c.execute(
-        "UPDATE positions SET quantity=?, avg_price=?, updated_at=? WHERE id=?",
-        (new_qty, new_avg, now_str, pos_id)
-    )
-    conn.commit()
-    await update.message.reply_text(f"✏️ Updated position {pos_id} → Qty: {new_qty}, Avg Price: {new_avg}")
+    updated, missing, forbidden = await db_write(_update_positions, ids, explicit, new_qty, new_avg, now_str,
+                                                 update.effective_user.id, user_is_admin(update))
+    position_book.update(updated, new_qty, new_avg)
+    error = bulk_result_text("position", "edit", updated, missing, forbidden, ids)
+    if error:
+        await update.message.reply_text(error)
+        return
+    await update.message.reply_text(
+        f"✏️ Updated position{'s' if len(updated) > 1 else ''} {format_id_ranges(updated)} → Qty: {new_qty}, Avg Price: {new_avg}")
 
 @safe_handler
 async def pos_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Delete one or more positions: /pos delete ID [ID ...]"""
-    await maybe_delete_command(update)
+    """Delete positions: /pos delete ID[,ID|FROM-TO ...] (all or nothing)"""
+    maybe_delete_command(update)
     if len(context.args) < 1:
-        await update.message.reply_text("Usage: /pos delete ID [ID ...]")
-        return
-    deleted_ids = []
-    errors = []
-    display_name, owner_key = stored_owner_key(update)
-    for pos_id in context.args:
-        c.execute("SELECT user FROM positions WHERE id=?", (pos_id,))
-        row = c.fetchone()
-        if not row:
-            errors.append(f"❌ Position {pos_id} not found")
-            continue
-        owner_display = row[0]
-        if owner_display != display_name and not user_is_admin(update):
-            errors.append(f"⛔ No permission for position {pos_id}")
-            continue
-        c.execute("DELETE FROM positions WHERE id=?", (pos_id,))
-        conn.commit()
-        deleted_ids.append(pos_id)
-    msg_lines = []
-    if deleted_ids:
-        msg_lines.append(f"🗑️ Deleted position(s): {', '.join(deleted_ids)}")
-    if errors:
-        msg_lines.extend(errors)
-    await update.message.reply_text("\n".join(msg_lines) if msg_lines else "No positions deleted.")
+        await update.message.reply_text("Usage: /pos delete ID [ID|FROM-TO ...]")
+        return
+    try:
+        ids, explicit = parse_id_specs(context.args)
+    except ValueError as e:
+        await update.message.reply_text(f"Invalid IDs: {e}")
+        return
+    deleted, missing, forbidden = await db_write(_delete_positions, ids, explicit,
+                                                 update.effective_user.id, user_is_admin(update))
+    position_book.remove(deleted)
+    error = bulk_result_text("position", "delete", deleted, missing, forbidden, ids)
+    if error:
+        await update.message.reply_text(error)
+        return
+    await update.message.reply_text(f"🗑️ Deleted position{'s' if len(deleted) > 1 else ''} {format_id_ranges(deleted)}")
 
 @safe_handler
 async def pos_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """List positions:
-    /pos list [--user @username|me]
+    /pos list [--user me|NAME|@username] [--symbol SYMBOL] [--limit N]
     """
-    await maybe_delete_command(update)
-    f = parse_flags(context.args)
-    user_filter = f["--user"]
-    params = []
-    where = []
-    if user_filter:
-        if user_filter.lower() == "me":
-            display_name, _ = stored_owner_key(update)
-            where.append("user = ?")
-            params.append(display_name)
-        else:
-            where.append("user = ?")
-            params.append(user_filter)
-    query = "SELECT id, user, stock, quantity, avg_price FROM positions"
-    if where:
-        query += " WHERE " + " AND ".join(where)
-    query += " ORDER BY user"
-    c.execute(query, tuple(params))
-    rows = c.fetchall()
+    maybe_delete_command(update)
+    try:
+        filt = await resolve_filter(update, parse_flags(context.args), POSITION_FILTERS)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    await position_book.ensure_loaded()
+    rows = position_book.select(filt["user_ids"], filt["symbol"], filt["limit"])
     if not rows:
         await update.message.reply_text("📊 No positions found.")
         return
+    names = await db_read(_user_names, [row[1] for row in rows])
 
     summary = {}
-    for id_, user, stock, quantity, avg_price in rows:
-        summary.setdefault(user, []).append((id_, stock, quantity, avg_price))
+    for id_, user_id, stock, quantity, avg_price in rows:
+        summary.setdefault(user_id, []).append((id_, stock, quantity, avg_price))
 
-    msg = "📊 Positions\n\n"
-    for user, positions in summary.items():
-        msg += f"{user}:\n"
+    report = Report("📊 Positions")
+    for user_id, positions in sorted(summary.items(), key=lambda item: names.get(item[0], "?").lower()):
+        lines = report.section(f"{names.get(user_id, '?')}:")
         for id_, stock, quantity, avg_price in positions:
-            msg += f"  - [{id_}] {stock}: Qty={quantity}, Avg Price={avg_price}\n"
-        msg += "\n"
-    await update.message.reply_text(msg)
+            lines.append(f"  - [{id_}] {stock}: Qty={quantity}, Avg Price={avg_price}")
+    await reply_report(update, report, "positions.txt")
 
 
 # ================ POSITIONS EXPORT =================
 @safe_handler
 async def pos_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Export positions as CSV file: /pexport [flags]"""
-    await maybe_delete_command(update)
+    """Export positions as CSV file: /pexport [flags] [--gzip]"""
+    maybe_delete_command(update)
     f = parse_flags(context.args)
-    user_filter = f["--user"]
-    params = []
-    where = []
-    if user_filter:
-        if user_filter.lower() == "me":
-            display_name, _ = stored_owner_key(update)
-            where.append("user = ?")
-            params.append(display_name)
-        else:
-            where.append("user = ?")
-            params.append(user_filter)
-    query = "SELECT id, user, stock, quantity, avg_price FROM positions"
-    if where:
-        query += " WHERE " + " AND ".join(where)
-    query += " ORDER BY user"
-    c.execute(query, tuple(params))
-    rows = c.fetchall()
-    if not rows:
-        await update.message.reply_text("📊 No positions found.")
+    try:
+        filt = await resolve_filter(update, f, POSITION_FILTERS)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
         return
-    # Write to a temporary CSV file
-    with tempfile.NamedTemporaryFile(mode="w+", newline="", suffix=".csv", delete=False) as tmpf:
-        writer = csv.writer(tmpf)
-        writer.writerow(["ID", "User", "Stock", "Quantity", "Avg_Price"])
-        for id_, user, stock, quantity, avg_price in rows:
-            writer.writerow([id_, user, stock, quantity, avg_price])
-        tmpf.flush()
-        tmpf.seek(0)
-        with open(tmpf.name, "rb") as f:
-            await update.message.reply_document(f, filename="positions_export.csv", caption="📊 Positions Export")
+    query = position_query(filt["where"])
+    params = (*filt["params"], filt["limit"] or -1)
+    count = await send_export(update, query, tuple(params), POSITION_CSV_HEADER,
+                              "positions_export.csv", "📊 Positions Export", "--gzip" in f["args"], 1)
+    if not count:
+        await update.message.reply_text("📊 No positions found.")
 
-@safe_handler
-async def pos_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Group positions with totals and weighted average: /pos all"""
-    await maybe_delete_command(update)
-    c.execute("SELECT id, user, stock, quantity, avg_price FROM positions ORDER BY user")
-    rows = c.fetchall()
+async def render_pos_all() -> Report:
+    await position_book.ensure_loaded()
+    rows = position_book.select()
     if not rows:
-        await update.message.reply_text("📊 No positions found.")
-        return
+        return Report("📊 No positions found.")
+    names = await db_read(_user_names, list(position_book.by_user))
     summary = {}
-    stock_totals = {}
-    for id_, user, stock, quantity, avg_price in rows:
-        summary.setdefault(user, []).append((id_, stock, quantity, avg_price))
-        if stock not in stock_totals:
-            stock_totals[stock] = {"total_qty": 0.0, "total_amount": 0.0}
-        stock_totals[stock]["total_qty"] += quantity
-        stock_totals[stock]["total_amount"] += quantity * avg_price
-    msg = "📊 All Positions:\n\n"
-    for user, positions in summary.items():
-        msg += f"{user}:\n"
+    for id_, user_id, stock, quantity, avg_price in rows:
+        summary.setdefault(user_id, []).append((id_, stock, quantity, avg_price))
+    report = Report("📊 All Positions:")
+    for user_id, positions in sorted(summary.items(), key=lambda item: names.get(item[0], "?").lower()):
+        lines = report.section(f"{names.get(user_id, '?')}:")
         for id_, stock, quantity, avg_price in positions:
-            msg += f"  - [{id_}] {stock}: Qty={quantity}, Avg Price={avg_price}\n"
-        msg += "\n"
-    msg += "------\n🧮 Group Stock Totals:\n"
-    for stock, data in stock_totals.items():
-        total_qty = data["total_qty"]
-        total_amt = data["total_amount"]
+            lines.append(f"  - [{id_}] {stock}: Qty={quantity}, Avg Price={avg_price}")
+    lines = report.section("------", "🧮 Group Stock Totals:")
+    for stock, (total_qty, total_amt, _) in sorted(position_book.stock_totals.items()):
         avg_price = (total_amt / total_qty) if total_qty != 0 else 0
-        msg += f"{stock}: Total Qty={total_qty}, Group Avg Price={avg_price:.2f}\n"
-    await update.message.reply_text(msg)
+        lines.append(f"{stock}: Total Qty={total_qty}, Group Avg Price={avg_price:.2f}")
+    return report
 
-# ========== DAILY / WEEKLY / MONTHLY ==========
 @safe_handler
+async def pos_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Group positions with totals and weighted average: /pos all"""
+    maybe_delete_command(update)
+    await reply_report(update, await cached_report(("pall",), render_pos_all), "positions_all.txt")
+
+# ========== DAILY / WEEKLY / MONTHLY ==========
 async def daily_recap(context: ContextTypes.DEFAULT_TYPE):
-    """Auto recap at 16:00 WIB"""
+    """Auto recap at 18:00 WIB (job errors go to the application error handler)"""
     today = today_str()
-    c.execute("SELECT user, stock, amount FROM logs WHERE date=?", (today,))
-    trades = c.fetchall()
+    trades, names = await db_fetch_named(SQL_DAILY_RECAP, (today,))
 
+    report = Report(f"📊 Daily Recap — {today}")
     if not trades:
-        msg = f"📊 Daily Recap — {today}\n\nNo trades logged today."
+        report.section("No trades logged today.")
     else:
         summary = {}
         total = 0
-        for user, stock, amount in trades:
-            summary.setdefault(user, []).append((stock, amount))
+        for user_id, stock, amount, count in trades:
+            summary.setdefault(user_id, []).append((stock, amount, count))
             total += amount
 
-        msg = f"📊 Daily Recap — {today}\n\n"
-        for user, logs in summary.items():
-            msg += f"{user}:\n"
-            for stock, amount in logs:
-                msg += f"  - {stock}: {format_amount(amount)}\n"
-            msg += "\n"
-        msg += f"💰 Group Total: {total:+,.0f} {'✅' if total>=0 else '❌'}"
+        for user_id, logs in sorted(summary.items(), key=lambda item: names.get(item[0], "?").lower()):
+            lines = report.section(f"{names.get(user_id, '?')}:")
+            for stock, amount, count in logs:
+                trades_note = f" ({count} trades)" if count > 1 else ""
+                lines.append(f"  - {stock}: {format_amount(amount)}{trades_note}")
+        report.section(f"💰 Group Total: {total:+,.0f} {'✅' if total>=0 else '❌'}")
 
-    await context.bot.send_message(chat_id=GROUP_CHAT_ID, text=msg)
+    await send_report(report, f"daily_recap_{today}.txt",
+                      functools.partial(context.bot.send_message, GROUP_CHAT_ID),
+                      functools.partial(context.bot.send_document, GROUP_CHAT_ID), bulk=True)
 
-@safe_handler
 async def recap(update: Update, context: ContextTypes.DEFAULT_TYPE, period: str):
     """Generic recap: weekly or monthly"""
     today = datetime.now(JAKARTA_TZ)
@@ -536,31 +2034,28 @@ async def recap(update: Update, context: ContextTypes.DEFAULT_TYPE, period: str)
         title = "📅 Monthly Recap"
 
     start_str = start.strftime("%Y-%m-%d")
-    c.execute("SELECT user, stock, amount FROM logs WHERE date>=?", (start_str,))
-    trades = c.fetchall()
+    await reply_report(update, await cached_report(("rc", title, start_str), render_recap, title, start_str),
+                       f"recap_{period}.txt")
 
-    if not trades:
-        await update.message.reply_text(f"{title}\n\nNo trades found.")
-        return
+async def render_recap(title: str, start_str: str) -> Report:
+    rows, names = await db_fetch_named(SQL_RECAP, (start_str,))
+    report = Report(title)
+    if not rows:
+        report.section("No trades found.")
+        return report
 
-    summary = {}
     total = 0
-    for user, stock, amount in trades:
-        summary.setdefault(user, []).append((stock, amount))
-        total += amount
-
-    msg = f"{title}\n\n"
-    for user, logs in summary.items():
-        subtotal = sum(a for _, a in logs)
-        msg += f"{user}: {subtotal:+,.0f} {'📈' if subtotal>=0 else '📉'}\n"
-    msg += f"\n💰 Group Total: {total:+,.0f} {'✅' if total>=0 else '❌'}"
-
-    await update.message.reply_text(msg)
+    lines = report.section()
+    for user_id, subtotal in sorted(rows, key=lambda row: names.get(row[0], "?").lower()):
+        total += subtotal
+        lines.append(f"{names.get(user_id, '?')}: {subtotal:+,.0f} {'📈' if subtotal>=0 else '📉'}")
+    report.section(f"💰 Group Total: {total:+,.0f} {'✅' if total>=0 else '❌'}")
+    return report
 
 @safe_handler
 async def recap_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """/recap daily|weekly|monthly"""
-    await maybe_delete_command(update)
+    maybe_delete_command(update)
     period = (context.args[0].lower() if context.args else "monthly")
     if period not in ("daily", "weekly", "monthly"):
         await update.message.reply_text("Usage: /recap [daily|weekly|monthly]")
@@ -569,104 +2064,95 @@ async def recap_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 @safe_handler
 async def weekly(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await maybe_delete_command(update)
+    maybe_delete_command(update)
     await recap(update, context, "weekly")
 
 @safe_handler
 async def monthly(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await maybe_delete_command(update)
+    maybe_delete_command(update)
     await recap(update, context, "monthly")
 
 # ================ LEADERBOARD =================
 @safe_handler
 async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await maybe_delete_command(update)
+    maybe_delete_command(update)
     today = datetime.now(JAKARTA_TZ)
     start = today.replace(day=1)
     start_str = start.strftime("%Y-%m-%d")
+    await reply_report(update, await cached_report(("lb", start_str), render_leaderboard, start_str), "leaderboard.txt")
 
-    c.execute("SELECT user, SUM(amount) FROM logs WHERE date>=? GROUP BY user ORDER BY SUM(amount) DESC", (start_str,))
-    rows = c.fetchall()
-
+async def render_leaderboard(start_str: str) -> Report:
+    rows, names = await db_fetch_named(SQL_LEADERBOARD, (start_str,))
     if not rows:
-        await update.message.reply_text("🏆 Leaderboard\n\nNo trades yet.")
-        return
+        return Report("🏆 Leaderboard", "", "No trades yet.")
 
-    msg = "🏆 Leaderboard — This Month\n\n"
+    report = Report("🏆 Leaderboard — This Month")
+    lines = report.section()
     medals = ["🥇", "🥈", "🥉"]
-    for i, (user, total) in enumerate(rows, start=1):
+    for i, (user_id, total) in enumerate(rows, start=1):
         medal = medals[i-1] if i <= 3 else f"{i}."
-        msg += f"{medal} {user}: {total:+,.0f} {'📈' if total>=0 else '📉'}\n"
-
-    await update.message.reply_text(msg)
+        lines.append(f"{medal} {names.get(user_id, '?')}: {total:+,.0f} {'📈' if total>=0 else '📉'}")
+    return report
 
 # ================ STOCK FILTER =================
 @safe_handler
 async def stock(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await maybe_delete_command(update)
+    maybe_delete_command(update)
     if not context.args:
         await update.message.reply_text("Usage: /stock SYMBOL")
         return
 
     symbol = context.args[0].upper()
-    c.execute("SELECT user, amount FROM logs WHERE stock=?", (symbol,))
-    trades = c.fetchall()
+    await reply_report(update, await cached_report(("s", symbol), render_stock, symbol), f"trades_{symbol}.txt")
 
+async def render_stock(symbol: str) -> Report:
+    trades, names = await db_fetch_named(SQL_STOCK, (symbol,))
     if not trades:
-        await update.message.reply_text(f"📊 No trades for {symbol}")
-        return
+        return Report(f"📊 No trades for {symbol}")
 
     summary = {}
     total = 0
-    for user, amount in trades:
-        summary.setdefault(user, []).append(amount)
+    for user_id, amount in trades:
+        summary.setdefault(user_id, []).append(amount)
         total += amount
 
-    msg = f"📊 Trades for {symbol}\n\n"
-    for user, amounts in summary.items():
-        subtotal = sum(amounts)
-        for amt in amounts:
-            msg += f"  {user}: {format_amount(amt)}\n"
-        msg += f"  Subtotal: {subtotal:+,.0f} {'💰'}\n\n"
-
-    msg += f"Group Net: {total:+,.0f} {'✅' if total>=0 else '❌'}"
-    await update.message.reply_text(msg)
+    report = Report(f"📊 Trades for {symbol}")
+    for user_id, amounts in summary.items():
+        name = names.get(user_id, "?")
+        lines = report.section(*(f"  {name}: {format_amount(amt)}" for amt in amounts))
+        lines.append(f"  Subtotal: {sum(amounts):+,.0f} {'💰'}")
+    report.section(f"Group Net: {total:+,.0f} {'✅' if total>=0 else '❌'}")
+    return report
 
 # ================ MY STATS =================
 @safe_handler
 async def mystats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await maybe_delete_command(update)
-    user = update.effective_user.first_name
+    maybe_delete_command(update)
+    user = update.effective_user
     today = datetime.now(JAKARTA_TZ)
-    start = today.replace(day=1)
-    start_str = start.strftime("%Y-%m-%d")
+    start_str = today.replace(day=1).strftime("%Y-%m-%d")
+    key = ("me", user.id, user.first_name, start_str)
+    await reply_report(update, await cached_report(key, render_mystats, user.id, user.first_name, start_str), "my_stats.txt")
 
-    c.execute("SELECT stock, amount FROM logs WHERE user=? AND date>=?", (user, start_str))
-    trades = c.fetchall()
-
-    if not trades:
-        await update.message.reply_text(f"📊 No trades for {user} this month")
-        return
+async def render_mystats(user_id: int, name: str, start_str: str) -> Report:
+    rows = await db_fetchall(SQL_MYSTATS, (user_id, start_str))
+    if not rows:
+        return Report(f"📊 No trades for {name} this month")
 
-    summary = {}
     total = 0
-    for stock, amount in trades:
-        summary.setdefault(stock, 0)
-        summary[stock] += amount
-        total += amount
-
-    msg = f"📊 My Stats — {today.strftime('%b %Y')} ({user})\n\n"
-    for stock, amt in summary.items():
-        msg += f"{stock}: {format_amount(amt)}\n"
-    msg += f"\n💰 Total: {total:+,.0f} {'✅' if total>=0 else '❌'}"
-
-    await update.message.reply_text(msg)
+    report = Report(f"📊 My Stats — {datetime.strptime(start_str, '%Y-%m-%d').strftime('%b %Y')} ({name})")
+    lines = report.section()
+    for stock, amt in rows:
+        total += amt
+        lines.append(f"{stock}: {format_amount(amt)}")
+    report.section(f"💰 Total: {total:+,.0f} {'✅' if total>=0 else '❌'}")
+    return report
 
 # ============== ADMIN COMMANDS ==============
 @safe_handler
 async def admin_pos_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin: /admin pos add USER SYMBOL QTY AVG_PRICE"""
-    await maybe_delete_command(update)
+    maybe_delete_command(update)
     if not user_is_admin(update):
         await update.message.reply_text("⛔ Only admins can use /admin pos add")
         return
@@ -685,20 +2171,129 @@ async def admin_pos_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     date = today_str()
     now_str = datetime.now(JAKARTA_TZ).strftime("%Y-%m-%d %H:%M:%S")
-    c.execute(
-        "INSERT INTO positions (user, stock, quantity, avg_price, date, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (user, stock, quantity, avg_price, date, now_str, now_str)
-    )
-    conn.commit()
+    position_id, user_id = await db_write(_insert_position_for, user, stock, quantity, avg_price, date, now_str)
+    position_book.add(position_id, user_id, stock, quantity, avg_price)
 
     await update.message.reply_text(f"✅ Added position {stock} Qty: {quantity} Avg Price: {avg_price} for {user}")
 
 
+@safe_handler
+async def admin_cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: /cachestats — result cache hit/miss counters"""
+    maybe_delete_command(update)
+    if not user_is_admin(update):
+        await update.message.reply_text("⛔ Only admins can use /cachestats")
+        return
+    lookups = result_cache.hits + result_cache.misses
+    ratio = f"{result_cache.hits / lookups:.0%}" if lookups else "n/a"
+    await update.message.reply_text(
+        f"🗃️ Result cache\n\n"
+        f"Hits: {result_cache.hits:,}\n"
+        f"Misses: {result_cache.misses:,}\n"
+        f"Hit ratio: {ratio}\n"
+        f"Entries: {len(result_cache)}/{result_cache.size}\n"
+        f"Write generation: {result_cache.generation:,}\n\n"
+        f"🧹 Deleted commands: {command_cleaner.deleted:,} (failed: {command_cleaner.failed:,})"
+    )
+
+@safe_handler
+async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: /stats — handler latency, errors and sqlite/telegram time per call"""
+    maybe_delete_command(update)
+    if not user_is_admin(update):
+        await update.message.reply_text("⛔ Only admins can use /stats")
+        return
+    report = Report(f"⏱️ Handler stats (up {timedelta(seconds=round(time.monotonic() - metrics.started))})")
+    report.section(*(metrics.summary() or ["No commands handled yet."]))
+    await reply_report(update, report, "stats.txt")
+
+# ============== ADMIN BULK IMPORT ==============
+def parse_import_csv(data: bytes) -> tuple[str, list[tuple], list[str]]:
+    """Parse a /texport or /pexport style CSV (optionally gzipped).
+    Returns (kind, rows, rejects) where kind is "trades" or "positions". The ID column is
+    optional and ignored: imported rows always get fresh IDs.
+    """
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    reader = csv.reader(io.StringIO(data.decode("utf-8-sig")))
+    header = [h.strip().lower() for h in next(reader, [])]
+    col = {name: i for i, name in enumerate(header)}
+    if {"date", "user", "stock", "amount"} <= col.keys():
+        kind, numeric = "trades", ("amount",)
+        fields = ("user", "stock", "amount", "date")
+    elif {"user", "stock", "quantity", "avg_price"} <= col.keys():
+        kind, numeric = "positions", ("quantity", "avg_price")
+        fields = ("user", "stock", "quantity", "avg_price")
+    else:
+        raise ValueError("Header must match /texport (Date,User,Stock,Amount) or /pexport (User,Stock,Quantity,Avg_Price)")
+
+    rows = []
+    rejects = []
+    for lineno, record in enumerate(reader, start=2):
+        if not any(cell.strip() for cell in record):
+            continue
+        try:
+            values = {name: record[col[name]].strip() for name in fields}
+        except IndexError:
+            rejects.append(f"line {lineno}: expected {len(header)} columns, got {len(record)}")
+            continue
+        if not values["user"] or not values["stock"]:
+            rejects.append(f"line {lineno}: empty user or stock")
+            continue
+        values["stock"] = values["stock"].upper()
+        try:
+            for name in numeric:
+                values[name] = float(values[name].replace(",", ""))
+        except ValueError:
+            rejects.append(f"line {lineno}: {name} must be a number")
+            continue
+        if kind == "trades":
+            try:
+                datetime.strptime(values["date"], "%Y-%m-%d")
+            except ValueError:
+                rejects.append(f"line {lineno}: date must be YYYY-MM-DD")
+                continue
+        rows.append(tuple(values[name] for name in fields))
+    return kind, rows, rejects
+
+@safe_handler
+async def admin_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: send a CSV (or .csv.gz) with caption /import to bulk-load trades or positions"""
+    if not user_is_admin(update):
+        maybe_delete_command(update)
+        await update.message.reply_text("⛔ Only admins can use /import")
+        return
+    doc = update.message.document
+    tg_file = await context.bot.get_file(doc.file_id)
+    data = bytes(await tg_file.download_as_bytearray())
+    maybe_delete_command(update)
+    try:
+        kind, rows, rejects = await asyncio.to_thread(parse_import_csv, data)
+    except (ValueError, UnicodeDecodeError, OSError) as e:
+        await update.message.reply_text(f"❌ Cannot import {doc.file_name}: {e}")
+        return
+
+    if rows:
+        if kind == "trades":
+            await db_write(_import_trades, rows)
+        else:
+            now_str = datetime.now(JAKARTA_TZ).strftime("%Y-%m-%d %H:%M:%S")
+            await db_write(_import_positions, rows, today_str(), now_str)
+            position_book.invalidate()
+
+    lines = [f"📥 Imported {len(rows):,} {kind} from {doc.file_name} ({len(rejects):,} rejected)"]
+    for reason in rejects[:IMPORT_REJECTS_SHOWN]:
+        lines.append(f"  - {reason}")
+    if len(rejects) > IMPORT_REJECTS_SHOWN:
+        lines.append(f"  ... and {len(rejects) - IMPORT_REJECTS_SHOWN} more")
+    await update.message.reply_text("\n".join(lines))
+
+
 # ============== ADMIN TRADE ADD ==============
 @safe_handler
 async def admin_trade_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin: /admin trade add USER SYMBOL AMOUNT"""
-    await maybe_delete_command(update)
+    maybe_delete_command(update)
     if not user_is_admin(update):
         await update.message.reply_text("⛔ Only admins can use /admin trade add")
         return
@@ -713,32 +2308,30 @@ async def admin_trade_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Amount must be a number")
         return
     date = today_str()
-    c.execute("INSERT INTO logs (user, stock, amount, date) VALUES (?, ?, ?, ?)",
-              (user, stock, amount, date))
-    conn.commit()
+    await db_write(_insert_trade_for, user, stock, amount, date)
     await update.message.reply_text(f"✅ Added trade {stock} {format_amount(amount)} for {user}")
 
  # ================== MAIN ==================
 @safe_handler
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await maybe_delete_command(update)
+    maybe_delete_command(update)
     msg = """
 📘 Panduan Cepat Bot Trading
 
 Trades
 - Add: /tadd SYMBOL AMOUNT
-- Edit: /tedit ID NEW_AMOUNT
-- Delete: /tdel ID
-- List: /tlist [--user me|NAME] [--symbol SYM] [--from YYYY-MM-DD] [--to YYYY-MM-DD]
-- Export: /texport [--user me|NAME] [--symbol SYM] [--from YYYY-MM-DD] [--to YYYY-MM-DD] — Export trades as CSV
+- Edit: /tedit ID [ID|FROM-TO ...] NEW_AMOUNT
+- Delete: /tdel ID [ID|FROM-TO ...]
+- List: /tlist [--user me|NAME|@username] [--symbol SYM] [--from YYYY-MM-DD] [--to YYYY-MM-DD] [--min AMOUNT] [--max AMOUNT] [--limit N] [--sort new|old|best|worst]
+- Export: /texport [same flags as /tlist] [--gzip] — Export trades as CSV
 
 Positions
 - Add: /padd SYMBOL QTY AVG_PRICE
-- Edit: /pedit ID NEW_QTY NEW_AVG_PRICE
-- Delete: /pdel ID
-- List: /plist [--user me|NAME]
+- Edit: /pedit ID [ID|FROM-TO ...] NEW_QTY NEW_AVG_PRICE
+- Delete: /pdel ID [ID|FROM-TO ...]
+- List: /plist [--user me|NAME|@username] [--symbol SYM] [--limit N]
 - Summary: /pall
-- Export: /pexport [--user me|NAME] — Export positions as CSV
+- Export: /pexport [--user me|NAME|@username] [--symbol SYM] [--limit N] [--gzip] — Export positions as CSV
 
 Recaps
 - /rc daily|weekly|monthly
@@ -752,9 +2345,14 @@ Stats
 Admin
 - /admintadd USER SYMBOL AMOUNT
 - /adminpadd USER SYMBOL QTY AVG_PRICE
+- /cachestats — Report cache hit/miss counters
+- /stats — Command latency, errors and DB/Telegram time
+- Send a CSV with caption /import — bulk load trades (/texport columns) or positions (/pexport columns)
 
 Tips
 - Numbers can use +/− and commas, e.g. +1,250,000
+- Several IDs / ranges (e.g. /tdel 10-20 25) are applied all-or-nothing
+- USER / NAME is a first name or @username; you can only change your own entries
 - Trade AMOUNT is per-trade P/L
 """
     await update.message.reply_text(msg, parse_mode="Markdown")
@@ -775,15 +2373,78 @@ async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
     await update.message.reply_text("❓ Unknown command. Use /help to see the list of available commands.")
 
+async def shutdown_db(app: Application):
+    """Flush queued writes and close pooled readers before the process exits."""
+    await asyncio.to_thread(reader_pool.close)
+    await asyncio.to_thread(db_writer.close)
+
+async def run_webhook(app: Application):
+    """Serve updates pushed to WEBHOOK_URL; the webhook counterpart of app.run_polling()."""
+    server = WebhookServer(urlsplit(WEBHOOK_URL).path or "/", WEBHOOK_SECRET,
+                           lambda data: app.update_queue.put(Update.de_json(data, app.bot)))
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    try:
+        port = await server.start(WEBHOOK_LISTEN, WEBHOOK_PORT)
+        metrics_server.webhook = server
+        await app.bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES)
+        print(f"🌐 Webhook listening on {WEBHOOK_LISTEN}:{port}{server.path}")
+        await stop.wait()
+    finally:
+        metrics_server.webhook = None
+        await server.close()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+def update_recorder(path: str):
+    """Handler that appends every incoming update to `path` as JSON lines
+    ({"t": unix time received, "update": ...}), for tools/replay_load.py."""
+    capture = open(path, "a", encoding="utf-8", buffering=1)
+
+    async def record(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        capture.write(json.dumps({"t": time.time(), "update": update.to_dict()}, ensure_ascii=False) + "\n")
+    return record
+
+async def start_services(app: Application):
+    await asyncio.to_thread(db_writer.start)
+    await command_cleaner.start(app)
+    await position_book.ensure_loaded()
+    if METRICS_PORT:
+        port = await metrics_server.start(METRICS_LISTEN, METRICS_PORT)
+        print(f"📈 Metrics on http://{METRICS_LISTEN}:{port}{metrics_server.METRICS_PATH}")
+
+async def stop_services(app: Application):
+    await metrics_server.close()
+    await command_cleaner.stop(app)
+
 def main():
-    app = Application.builder().token(BOT_TOKEN).build()
+    scheduler = SendScheduler(SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_GROUP_RATE, SEND_CHAT_BURST, SEND_MAX_RETRIES)
+    app = (Application.builder().token(BOT_TOKEN)
+           .base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+           .request(TimedRequest(connection_pool_size=BOT_CONNECTION_POOL)).rate_limiter(scheduler)
+           .concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_UPDATES))
+           .post_init(start_services).post_stop(stop_services).post_shutdown(shutdown_db).build())
     job_queue = app.job_queue
 
+    if CAPTURE_PATH:
+        app.add_handler(TypeHandler(Update, update_recorder(CAPTURE_PATH)), group=-1)
+
     # TRADES (new commands only)
     app.add_handler(CommandHandler("tadd", trade_add))
     app.add_handler(CommandHandler("tedit", trade_edit))
     app.add_handler(CommandHandler("tdel", trade_delete))
     app.add_handler(CommandHandler("tlist", trade_list))
+    app.add_handler(CallbackQueryHandler(trade_list_page, pattern=r"^tl:"))
     app.add_handler(CommandHandler("admintadd", admin_trade_add))
 
     # TRADE EXPORT
@@ -809,10 +2470,15 @@ def main():
     app.add_handler(CommandHandler("lb", leaderboard))
     app.add_handler(CommandHandler("s", stock))
     app.add_handler(CommandHandler("me", mystats))
+    app.add_handler(CommandHandler("cachestats", admin_cache_stats))
+    app.add_handler(CommandHandler("stats", admin_stats))
 
     # HELP
     app.add_handler(CommandHandler("help", help_command))
 
+    # BULK IMPORT (CSV document with caption /import)
+    app.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r"^/import(@\w+)?(\s|$)"), admin_import))
+
     # Unknown command handler
     app.add_handler(MessageHandler(filters.COMMAND, unknown_command))
 
@@ -840,7 +2506,10 @@ def main():
             print("⚠️ No chat context available for error message.")
 
     app.add_error_handler(error_handler)
-    app.run_polling()
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(app))
+    else:
+        app.run_polling()
 
 if __name__ == "__main__":
     main()
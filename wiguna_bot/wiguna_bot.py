@@ -1,15 +1,33 @@
 import asyncio
+import base64
+import bisect
+import codecs
+import contextlib
+import contextvars
+import csv
+import gzip
+import html
+import io
 import json
+import math
 import os
-import urllib.error
-import urllib.request
-from datetime import datetime
+import random
+import secrets
+import signal
+import sys
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from urllib.parse import urlsplit
 
+import httpx
 import pytz
-from telegram import Update
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import TelegramError
 from telegram.ext import (
-    Application, CommandHandler, ContextTypes
+    Application, BaseUpdateProcessor, CallbackQueryHandler, CommandHandler, ContextTypes, TypeHandler
 )
+from telegram.request import HTTPXRequest
 
 # ================= CONFIG =================
 BOT_TOKEN = os.getenv("WIGUNA_BOT_TOKEN", "")
@@ -17,85 +35,830 @@ GROUP_CHAT_ID = os.getenv("WIGUNA_GROUP_ID")
 ADMIN_USERNAMES = ["eemmje"]
 
 JAKARTA_TZ = pytz.timezone("Asia/Jakarta")
+CONCURRENT_UPDATES = int(os.getenv("WIGUNA_CONCURRENT_UPDATES", "8"))  # updates handled at once (per chat/user still in order)
+COMMAND_DELETE_INTERVAL = 1.0  # seconds between batched deletions of users' command messages
+WEBHOOK_URL = os.getenv("WIGUNA_WEBHOOK_URL")  # set to receive updates by webhook instead of long polling
+WEBHOOK_LISTEN = os.getenv("WIGUNA_WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WIGUNA_WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WIGUNA_WEBHOOK_SECRET") or secrets.token_urlsafe(32)  # checked on every push
+TELEGRAM_API_URL = os.getenv("WIGUNA_TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")  # Bot API server (a local stand-in for load tests)
+CAPTURE_PATH = os.getenv("WIGUNA_CAPTURE_UPDATES")  # append incoming updates here as JSON lines
+METRICS_LISTEN = os.getenv("WIGUNA_METRICS_LISTEN", "127.0.0.1")  # Prometheus /metrics listener
+METRICS_PORT = int(os.getenv("WIGUNA_METRICS_PORT", "9465"))  # 0 disables it
+BOT_CONNECTION_POOL = 64  # concurrent Bot API requests (sends from concurrent handlers)
 
 # =============== Wiguna API Config ===============
 WIGUNA_API_URL = os.getenv("WIGUNA_API_URL", "https://api.wigunainvestment.com/recommendation/stockpick")
 WIGUNA_AUTH_URL = os.getenv("WIGUNA_AUTH_URL", "https://api.wigunainvestment.com/auth/token")
+WIGUNA_EXP2_URL = os.getenv("WIGUNA_EXP2_URL", "https://api.wigunainvestment.com/saham/exp2")
+WIGUNA_TOKEN_TTL = int(os.getenv("WIGUNA_TOKEN_TTL", "3600"))  # seconds to trust a token without a JWT `exp` claim
+WIGUNA_TOKEN_MARGIN = 120  # log in again this many seconds before the token expires
+WIGUNA_MAX_CONCURRENT = int(os.getenv("WIGUNA_MAX_CONCURRENT", "8"))  # API requests in flight (and pooled connections)
+WIGUNA_MAX_RESPONSE = int(os.getenv("WIGUNA_MAX_RESPONSE_BYTES", str(8 * 1024 * 1024)))  # larger bodies are refused
+WIGUNA_AUTH_TIMEOUT = 10  # seconds, per endpoint
+WIGUNA_SIGNAL_POST_TIMEOUT = 60
+WIGUNA_SIGNAL_GET_TIMEOUT = 15
+WIGUNA_EXP2_TIMEOUT = 60
+WIGUNA_CACHE_TTL = float(os.getenv("WIGUNA_CACHE_TTL", "60"))  # seconds a /gs or /exp2 answer is reused (0 disables)
+WIGUNA_CACHE_SIZE = 256  # cached responses (one per endpoint + query)
+WIGUNA_CACHE_MB = float(os.getenv("WIGUNA_CACHE_MB", "64"))  # memory the cached responses may hold, MiB
+EXP2_PAGE_ROWS = 15  # /exp2 table rows per message
+EXP2_COLUMNS = 6  # columns shown in chat; the CSV has all of them
+EXP2_CELL_WIDTH = 12  # longer cells are cut with …
+EXP2_SESSIONS_PER_CHAT = 20  # older /exp2 keyboards stop paging after this many newer tables
+EXP2_SESSIONS_TOTAL = 200  # ... or after this many newer tables in any chat
+EXP2_SESSIONS_MB = float(os.getenv("WIGUNA_EXP2_SESSIONS_MB", "64"))  # memory open /exp2 tables may hold, MiB
+EXP2_PAST_TTL = 24 * 3600  # seconds a past date's /exp2 answer is reused; its data no longer changes
+EXP2_CONCURRENCY = int(os.getenv("WIGUNA_EXP2_CONCURRENCY", "5"))  # dates of one /exp2 --from/--to fetched at once
+EXP2_MAX_DAYS = 31  # weekdays per /exp2 --from/--to request
 
 
-def resolve_wiguna_token() -> str:
+async def resolve_wiguna_token() -> str:
 
     email = os.getenv("WIGUNA_EMAIL")
     password = os.getenv("WIGUNA_PASSWORD")
     if not email or not password:
         raise RuntimeError("WIGUNA_EMAIL dan/atau WIGUNA_PASSWORD belum diset di environment.")
 
-    payload = json.dumps({"email": email, "password": password}).encode("utf-8")
-    req = urllib.request.Request(
-        WIGUNA_AUTH_URL,
-        data=payload,
-        headers={"Content-Type": "application/json"},
-        method="POST",
-    )
+    status, body = await wiguna_api.request("POST", WIGUNA_AUTH_URL, json_body={"email": email, "password": password},
+                                            timeout=WIGUNA_AUTH_TIMEOUT)
+    if status is None:
+        raise RuntimeError(f"Auth gagal: {body}")
+    if status >= 400:
+        raise RuntimeError(f"Auth gagal (HTTP {status}): {body[:400]}")
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        data = body  # plain string token
 
+    # Expected simple response: {"token": "xxx"}
+    token = data.get("token") if isinstance(data, dict) else data.strip() if isinstance(data, str) else None
+    if not token:
+        raise RuntimeError(f"Tidak bisa mendapatkan token dari response auth: {body[:400]}")
+    return token
+
+def token_expiry(token: str, ttl: float) -> float:
+    """Unix time the token expires: its JWT `exp` claim, else `ttl` seconds from now."""
     try:
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            body = resp.read().decode("utf-8", errors="ignore")
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return time.time() + ttl
+
+# ================ METRICS ================
+# Handler whose backend calls are being timed; set by safe_handler for the running task.
+current_command = contextvars.ContextVar("current_command", default="background")
+
+class Metrics:
+    """Per-handler latency histograms, error counts and time spent in each backend.
+
+    Backend time is booked against the handler running in the current task, so a slow /gs
+    or /exp2 can be split into Wiguna API time, Telegram API time and the rest. render()
+    produces the Prometheus text served on /metrics; summary() feeds the admin /stats command.
+    """
+
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.started = time.monotonic()
+        self._latency = {}  # command -> [per-bucket counts (last one is +Inf), sum of seconds]
+        self._errors = {}   # command -> count
+        self._backend = {}  # (command, backend) -> [seconds, calls]
+
+    def observe(self, command: str, seconds: float, error: bool = False):
+        hist = self._latency.get(command)
+        if hist is None:
+            hist = self._latency[command] = [[0] * (len(self.BUCKETS) + 1), 0.0]
+        hist[0][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        hist[1] += seconds
+        if error:
+            self._errors[command] = self._errors.get(command, 0) + 1
+
+    def add_backend(self, backend: str, seconds: float):
+        entry = self._backend.setdefault((current_command.get(), backend), [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+    @contextlib.contextmanager
+    def timed(self, backend: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_backend(backend, time.perf_counter() - start)
+
+    def quantile(self, command: str, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (inf past the last bucket)."""
+        counts = self._latency[command][0]
+        rank = q * sum(counts)
+        seen = 0
+        for bound, count in zip(self.BUCKETS, counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def _bound(self, bound: float) -> str:
+        return f"≤{bound:g}s" if bound != math.inf else f">{self.BUCKETS[-1]:g}s"
+
+    def render(self) -> str:
+        p = self.prefix
+        lines = [f"# HELP {p}_command_duration_seconds Handler latency.",
+                 f"# TYPE {p}_command_duration_seconds histogram"]
+        for command, (counts, total) in sorted(self._latency.items()):
+            seen = 0
+            for bound, count in zip((*self.BUCKETS, "+Inf"), counts):
+                seen += count
+                lines.append(f'{p}_command_duration_seconds_bucket{{command="{command}",le="{bound}"}} {seen}')
+            lines.append(f'{p}_command_duration_seconds_sum{{command="{command}"}} {total:.6f}')
+            lines.append(f'{p}_command_duration_seconds_count{{command="{command}"}} {seen}')
+        lines += [f"# HELP {p}_command_errors_total Handler calls that raised.",
+                  f"# TYPE {p}_command_errors_total counter"]
+        lines += [f'{p}_command_errors_total{{command="{command}"}} {count}'
+                  for command, count in sorted(self._errors.items())]
+        lines += [f"# HELP {p}_backend_seconds_total Time spent waiting on a backend, by handler.",
+                  f"# TYPE {p}_backend_seconds_total counter"]
+        lines += [f'{p}_backend_seconds_total{{command="{command}",backend="{backend}"}} {seconds:.6f}'
+                  for (command, backend), (seconds, _) in sorted(self._backend.items())]
+        lines += [f"# HELP {p}_backend_calls_total Backend calls, by handler.",
+                  f"# TYPE {p}_backend_calls_total counter"]
+        lines += [f'{p}_backend_calls_total{{command="{command}",backend="{backend}"}} {calls}'
+                  for (command, backend), (_, calls) in sorted(self._backend.items())]
+        lines.append(f"# TYPE {p}_uptime_seconds gauge")
+        lines.append(f"{p}_uptime_seconds {time.monotonic() - self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> list[str]:
+        """One line per handler: calls, p50/p95 bucket, errors and average backend time per call."""
+        lines = []
+        for command, (counts, total) in sorted(self._latency.items(), key=lambda item: -item[1][1]):
+            calls = sum(counts)
+            p50, p95 = (self._bound(self.quantile(command, q)) for q in (0.5, 0.95))
+            backends = " ".join(f"{backend} {seconds / calls * 1000:.0f}ms"
+                                for (cmd, backend), (seconds, _) in sorted(self._backend.items()) if cmd == command)
+            lines.append(f"{command}: {calls}× avg {total / calls * 1000:.0f}ms, p50 {p50}, p95 {p95}, "
+                         f"errors {self._errors.get(command, 0)}" + (f" | {backends}" if backends else ""))
+        return lines
+
+
+metrics = Metrics("wiguna_bot")
+
+class TimedRequest(HTTPXRequest):
+    """HTTPXRequest that books every Bot API round-trip as `telegram` backend time."""
+
+    async def do_request(self, *args, **kwargs):
+        with metrics.timed("telegram"):
+            return await super().do_request(*args, **kwargs)
+
+# ================ WEBHOOK ================
+class RequestError(Exception):
+    """A request HttpListener answers with `status` before closing the connection."""
+
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
+
+
+class HttpListener:
+    """Small HTTP/1.1 server; subclasses answer requests in _route(). Connections are kept
+    alive, as Telegram reuses them between webhook pushes.
+
+    Clients cannot hold a connection open by sending slowly: an idle connection is closed after
+    IDLE_TIMEOUT, a started request must arrive within READ_TIMEOUT (else 408), and over-long
+    lines, too many headers or an oversized body are refused with 400/431/413.
+    """
+
+    MAX_BODY = 1024 * 1024
+    MAX_LINE = 8 * 1024  # request line or one header line
+    MAX_HEADERS = 64
+    IDLE_TIMEOUT = 60  # seconds a kept-alive connection may wait for its next request
+    READ_TIMEOUT = 10  # seconds for the headers and body once the request line is in
+    REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+               405: "Method Not Allowed", 408: "Request Timeout", 413: "Payload Too Large",
+               431: "Request Header Fields Too Large"}
+
+    def __init__(self):
+        self._server = None
+        self._connections = {}  # writer -> handler task; closed and awaited on shutdown
+
+    async def start(self, host: str, port: int) -> int:
+        """Start listening; returns the bound port (useful with port 0)."""
+        self._server = await asyncio.start_server(self._serve, host, port, limit=self.MAX_LINE)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in self._connections:
+                writer.close()
+            # Python < 3.12 wait_closed() does not wait for the handlers; let them see EOF and exit
+            await asyncio.gather(*self._connections.values(), return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                request_line = b""
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), self.IDLE_TIMEOUT)
+                    if not request_line:
+                        break
+                    method, path, version, headers, body = await asyncio.wait_for(
+                        self._read_request(reader, request_line), self.READ_TIMEOUT)
+                except RequestError as e:
+                    await self._respond(writer, e.status, keep_alive=False)
+                    break
+                except ValueError:  # request line longer than MAX_LINE
+                    await self._respond(writer, 400, keep_alive=False)
+                    break
+                except asyncio.TimeoutError:
+                    if request_line:  # else just an idle keep-alive connection
+                        await self._respond(writer, 408, keep_alive=False)
+                    break
+                status, payload = await self._route(method, path, headers, body)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader, request_line: bytes) -> tuple[str, str, str, dict, bytes]:
+        """(method, path, version, headers, body) of the request that starts with `request_line`."""
+        try:
+            method, target, version = request_line.decode("latin-1").split()
+        except ValueError:
+            raise RequestError(400) from None
+        headers = {}
+        for _ in range(self.MAX_HEADERS + 1):
             try:
-                data = json.loads(body) if body else {}
-            except Exception:
-                data = {}
-
-            # Expected simple response: {"token": "xxx"}
-            token = data.get("token")
-            if not token:
-                # As a fallback, if body is a plain string token
-                if isinstance(data, str) and data.strip():
-                    token = data.strip()
-                else:
-                    raise RuntimeError(f"Tidak bisa mendapatkan token dari response auth: {body[:400]}")
-            return token
+                line = await reader.readline()
+            except ValueError:  # longer than MAX_LINE
+                raise RequestError(431) from None
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise RequestError(431)
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise RequestError(400) from None
+        if length < 0:
+            raise RequestError(400)
+        if length > self.MAX_BODY:
+            raise RequestError(413)
+        body = await reader.readexactly(length) if length else b""
+        return method, target.split("?", 1)[0], version, headers, body
+
+    async def _route(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, dict | str | None]:
+        """(status, JSON payload or plain text) for one request."""
+        raise NotImplementedError
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, payload: dict | str | None = None,
+                       keep_alive: bool = True):
+        if isinstance(payload, str):
+            body, content_type = payload.encode(), "text/plain; version=0.0.4"  # Prometheus exposition
+        else:
+            body, content_type = json.dumps(payload).encode() if payload is not None else b"", "application/json"
+        head = (f"HTTP/1.1 {status} {self.REASONS[status]}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+class WebhookServer(HttpListener):
+    """Receives Telegram webhook pushes: POST `path` with the right
+    X-Telegram-Bot-Api-Secret-Token header hands the decoded JSON to `handle(data)`.
+    Every other path is 404, so nothing else is exposed on the public port.
+    """
+
+    def __init__(self, path: str, secret: str, handle):
+        super().__init__()
+        self.path = path
+        self.secret = secret.encode("latin-1")
+        self.handle = handle
+        self.received = 0
+        self.rejected = 0
+
+    async def _route(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, dict | str | None]:
+        if path != self.path:
+            return 404, None
+        if method != "POST":
+            return 405, None
+        token = headers.get("x-telegram-bot-api-secret-token", "").encode("latin-1")
+        if not secrets.compare_digest(token, self.secret):
+            self.rejected += 1
+            return 403, None
+        try:
+            await self.handle(json.loads(body))
+        except Exception as e:
+            print(f"⚠️ Rejected webhook update: {e}")
+            self.rejected += 1
+            return 400, None
+        self.received += 1
+        return 200, None
+
+
+class MetricsServer(HttpListener):
+    """GET /metrics serves `metrics` for Prometheus; GET /healthz reports liveness, plus the
+    webhook's update counters while `webhook` is set. Meant for a local or internal address.
+    """
+
+    HEALTH_PATH = "/healthz"
+    METRICS_PATH = "/metrics"
+
+    def __init__(self):
+        super().__init__()
+        self.started = time.monotonic()
+        self.webhook = None  # WebhookServer, set by run_webhook
 
-    except urllib.error.HTTPError as e:
-        err_body = e.read().decode("utf-8", errors="ignore") if hasattr(e, "read") else str(e)
-        raise RuntimeError(f"Auth gagal (HTTP {e.code}): {err_body[:400]}")
-    except urllib.error.URLError as e:
-        raise RuntimeError(f"Auth gagal (URLError): {e}")
+    async def _route(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, dict | str | None]:
+        if path not in (self.METRICS_PATH, self.HEALTH_PATH):
+            return 404, None
+        if method != "GET":
+            return 405, None
+        if path == self.METRICS_PATH:
+            return 200, metrics.render()
+        health = {"status": "ok", "uptime": round(time.monotonic() - self.started)}
+        if self.webhook is not None:
+            health.update(updates=self.webhook.received, rejected=self.webhook.rejected)
+        return 200, health
+
+metrics_server = MetricsServer()
 
 # ============== HELPER FUNCS ==============
+class WigunaClient:
+    """Shared keep-alive HTTP client for the Wiguna API.
+
+    Every call goes through one pooled httpx.AsyncClient, so a burst of /gs reuses open
+    TLS connections instead of handshaking per command, and no worker thread is tied up
+    while the API answers. At most `max_concurrent` requests are in flight; the rest queue.
+    GETs that cannot connect, hit a dropped keep-alive connection or get 429/502/503/504 are
+    retried with jittered exponential backoff; POSTs are sent once. Bodies larger than
+    `max_body` bytes are refused while streaming instead of being read into memory.
+    """
+
+    RETRIES = 2  # extra attempts for GETs
+    BACKOFF = 0.5  # seconds; retry n waits a random time up to BACKOFF * 2**n
+    RETRY_STATUS = {429, 502, 503, 504}
+    RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+    def __init__(self, max_concurrent: int, max_body: int):
+        self.max_body = max_body
+        self.retried = 0
+        self._limits = httpx.Limits(max_connections=max_concurrent, max_keepalive_connections=max_concurrent)
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._client = None
+
+    async def start(self):
+        self._client = httpx.AsyncClient(limits=self._limits, follow_redirects=True,
+                                         headers={"Content-Type": "application/json"})
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(self, method: str, url: str, *, timeout: float, token: str | None = None,
+                      params: dict | None = None, json_body=None) -> tuple[int | None, str]:
+        """(status, body) of an API call; status is None when no usable response arrived and
+        body then holds the error. With `token` the call is authorised, and a 401 (token
+        revoked or expired early) gets one retry with a fresh login."""
+        status, body, _ = await self.exchange(method, url, timeout=timeout, token=token, params=params,
+                                              json_body=json_body)
+        return status, body
+
+    async def exchange(self, method: str, url: str, *, timeout: float, token: str | None = None,
+                       params: dict | None = None, json_body=None, headers: dict | None = None,
+                       parse=None) -> tuple[int | None, object, dict]:
+        """request() with extra request `headers`, also returning the response headers.
+        With `parse`, a 2xx body is not buffered: `await parse(chunks)` consumes the byte
+        chunks as they arrive and its result is returned instead of the text."""
+        reply = await self._send(method, url, timeout, token, params, json_body, headers, parse)
+        if reply[0] == 401 and token is not None:
+            try:
+                token = await wiguna_token.get(stale=token)
+            except Exception as e:
+                return None, f"Login ulang gagal: {e}", {}
+            reply = await self._send(method, url, timeout, token, params, json_body, headers, parse)
+        return reply
+
+    async def _send(self, method, url, timeout, token, params, json_body, extra_headers, parse) -> tuple[int | None, object, dict]:
+        headers = dict(extra_headers or {})
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        attempts = 1 + (self.RETRIES if method == "GET" else 0)
+        for attempt in range(attempts):
+            if attempt:
+                self.retried += 1
+                await asyncio.sleep(random.uniform(0, self.BACKOFF * 2 ** attempt))
+            try:
+                reply = await self._attempt(method, url, timeout, headers, params, json_body, parse)
+            except self.RETRY_ERRORS as e:
+                reply = None, f"{type(e).__name__}: {e}", {}
+                continue
+            except httpx.HTTPError as e:
+                return None, f"{type(e).__name__}: {e}", {}
+            if reply[0] not in self.RETRY_STATUS:
+                break
+        return reply
+
+    async def _attempt(self, method, url, timeout, headers, params, json_body, parse) -> tuple[int | None, object, dict]:
+        async with self._slots:
+            with metrics.timed("wiguna"):
+                async with self._client.stream(method, url, params=params, json=json_body, headers=headers,
+                                               timeout=httpx.Timeout(timeout, connect=min(timeout, 10))) as resp:
+                    try:
+                        if int(resp.headers.get("content-length") or 0) > self.max_body:
+                            raise OverflowError(f"Respons lebih dari {self.max_body:,} byte, dibatalkan")
+                        if parse is not None and 200 <= resp.status_code < 300:
+                            try:
+                                return resp.status_code, await parse(self._chunks(resp)), resp.headers
+                            except ValueError as e:  # includes json.JSONDecodeError
+                                return None, f"Format respons tidak valid: {e}", {}
+                        body = bytearray()
+                        async for chunk in self._chunks(resp):
+                            body += chunk
+                    except OverflowError as e:
+                        return None, str(e), {}
+                    return resp.status_code, body.decode("utf-8", errors="ignore"), resp.headers
+
+    async def _chunks(self, resp: httpx.Response):
+        size = 0
+        async for chunk in resp.aiter_bytes():
+            size += len(chunk)
+            if size > self.max_body:
+                raise OverflowError(f"Respons lebih dari {self.max_body:,} byte, dibatalkan")
+            yield chunk
+
+
+wiguna_api = WigunaClient(WIGUNA_MAX_CONCURRENT, WIGUNA_MAX_RESPONSE)
+
+class ResponseCache:
+    """LRU of successful Wiguna GET responses keyed by (url, sorted query).
+
+    An entry is served without a request for `ttl` seconds. Identical requests that miss
+    while one is already on its way wait for that one instead of calling the API again.
+    An expired entry that carried an ETag or Last-Modified is revalidated with
+    If-None-Match / If-Modified-Since; a 304 keeps the stored body for another `ttl`.
+    Least recently used entries are dropped beyond `size` entries or `max_bytes` of
+    bodies (see cached_bytes); a body larger than `max_bytes` on its own is not kept.
+    invalidate(url) forgets a URL after a write to it, including answers still on their way.
+    """
+
+    def __init__(self, ttl: float, size: int, max_bytes: int):
+        self.ttl = ttl
+        self.size = size
+        self.max_bytes = max_bytes
+        self.bytes = 0  # cached_bytes() of every entry
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.revalidated = 0
+        self._entries = OrderedDict()  # key -> [status, body, validators, expires (monotonic), bytes]
+        self._inflight = {}  # key -> task of the upstream call, shared by every waiter
+
+    async def get(self, key: tuple, fetch, ttl: float | None = None) -> tuple[int | None, str]:
+        """(status, body) for `key`; on a miss `await fetch(validators)` -> (status, body, headers)
+        is called once, with conditional request headers when revalidating. `ttl` overrides
+        the default for this entry."""
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() < entry[3]:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = self._inflight[key] = asyncio.create_task(self._fill(key, entry, fetch, self.ttl if ttl is None else ttl))
+        else:
+            self.coalesced += 1
+        # shield: a cancelled command must not cancel the call other commands wait on
+        return await asyncio.shield(task)
+
+    async def _fill(self, key: tuple, entry: list | None, fetch, ttl: float) -> tuple[int | None, str]:
+        task = asyncio.current_task()
+        try:
+            status, body, headers = await fetch(entry[2] if entry is not None else {})
+            if self._inflight.get(key) is not task:
+                return status, body  # invalidated while fetching: answer the waiters, keep nothing
+            if status == 304 and entry is not None:
+                self.revalidated += 1
+                entry[3] = time.monotonic() + ttl
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                return entry[0], entry[1]
+            if status and 200 <= status < 300 and ttl > 0 and self.size > 0:
+                size = cached_bytes(body)
+                if key in self._entries:  # the expired entry, unless evicted or flushed meanwhile
+                    self._drop(key)
+                if size <= self.max_bytes:
+                    validators = {}
+                    if headers.get("etag"):
+                        validators["If-None-Match"] = headers["etag"]
+                    if headers.get("last-modified"):
+                        validators["If-Modified-Since"] = headers["last-modified"]
+                    self._entries[key] = [status, body, validators, time.monotonic() + ttl, size]
+                    self.bytes += size
+                    while len(self._entries) > self.size or self.bytes > self.max_bytes:
+                        self._drop(next(iter(self._entries)))
+            return status, body
+        finally:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+
+    def _drop(self, key: tuple):
+        self.bytes -= self._entries.pop(key)[4]
+
+    def invalidate(self, url: str) -> int:
+        """Forget every cached answer for `url`, whatever its query; calls already in flight
+        are not stored and later lookups start a new one. Returns the entries dropped."""
+        keys = [key for key in self._entries if key[0] == url]
+        for key in keys:
+            self._drop(key)
+        for key in [key for key in self._inflight if key[0] == url]:
+            del self._inflight[key]
+        return len(keys)
+
+    def entries(self) -> list[tuple[tuple, object, float, bool]]:
+        """(key, cached body or parsed value, seconds until expiry, revalidatable) per entry,
+        most recent first."""
+        now = time.monotonic()
+        return [(key, entry[1], entry[3] - now, bool(entry[2])) for key, entry in reversed(self._entries.items())]
+
+    def clear(self) -> int:
+        count = len(self._entries)
+        self._entries.clear()
+        self.bytes = 0
+        return count
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def cached_bytes(value) -> int:
+    """Approximate memory held by a cached body: a response text or a parsed Exp2Table."""
+    if isinstance(value, Exp2Table):
+        return value.nbytes()
+    return sys.getsizeof(value)
+
+response_cache = ResponseCache(WIGUNA_CACHE_TTL, WIGUNA_CACHE_SIZE, int(WIGUNA_CACHE_MB * 1024 * 1024))
+
+async def wiguna_get(url: str, params: dict | None, token: str, timeout: float, parse=None,
+                     ttl: float | None = None) -> tuple[int | None, object]:
+    """GET a Wiguna endpoint through response_cache (see WigunaClient.exchange for `parse`,
+    ResponseCache.get for `ttl`)."""
+    params = params or {}
+
+    async def fetch(validators):
+        return await wiguna_api.exchange("GET", url, timeout=timeout, token=token, params=params, headers=validators,
+                                         parse=parse)
+    return await response_cache.get((url, tuple(sorted(params.items()))), fetch, ttl)
+
+class WigunaToken:
+    """Caches the Wiguna bearer token so commands don't log in before every API call.
+
+    The token is reused until `margin` seconds before it expires (JWT `exp` claim, or
+    `ttl` seconds for opaque tokens); a background task logs in again at that point, so
+    commands normally find a fresh token. Callers that arrive while no valid token is
+    cached share one login instead of each posting to WIGUNA_AUTH_URL.
+
+    A token that is already expired when it arrives (clock skew, or a server handing out
+    past `exp` claims) is still used, but the next login waits RETRY seconds, doubling up
+    to MAX_BACKOFF while it keeps happening, and the background task never logs in more
+    often than every MIN_REFRESH seconds.
+    """
+
+    RETRY = 30         # seconds before the background task retries a failed login
+    MIN_REFRESH = 30   # least seconds between background logins
+    MAX_BACKOFF = 600  # longest wait after logins that return expired tokens
+
+    def __init__(self, login, ttl: float, margin: float):
+        self.login = login  # coroutine function returning a new token
+        self.ttl = ttl
+        self.margin = margin
+        self.logins = 0
+        self.failures = 0
+        self._token = None
+        self._expires = 0.0
+        self._refresh_at = 0.0
+        self._backoff = 0.0  # current wait after an expired-on-arrival token
+        self._inflight = None  # task of the login in progress, shared by every waiter
+        self._task = None
+
+    async def get(self, stale: str | None = None) -> str:
+        """A valid token. Pass the token the API just rejected as `stale` to force a new
+        login; if another caller already replaced it, the replacement is returned."""
+        if self._token is not None and self._token != stale and time.time() < self._refresh_at:
+            return self._token
+        if self._inflight is None:
+            self._inflight = asyncio.create_task(self._refresh())
+        # shield: a cancelled command must not cancel the login other commands wait on
+        return await asyncio.shield(self._inflight)
+
+    def expires_in(self) -> float | None:
+        return self._expires - time.time() if self._token is not None else None
+
+    async def _refresh(self) -> str:
+        try:
+            token = await self.login()
+            now = time.time()
+            self._token, self._expires = token, token_expiry(token, self.ttl)
+            self.logins += 1
+            if self._expires <= now:
+                self._backoff = min(max(self._backoff * 2, self.RETRY), self.MAX_BACKOFF)
+                self._refresh_at = now + self._backoff
+                print(f"⚠️ Wiguna token expired {now - self._expires:.0f}s ago on arrival; "
+                      f"next login in {self._backoff:.0f}s")
+            else:
+                self._backoff = 0.0
+                # short-lived tokens: refresh halfway through instead of immediately
+                self._refresh_at = self._expires - min(self.margin, (self._expires - now) / 2)
+            return token
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self._inflight = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        delay = 0.0  # log in right away so the first command finds a token
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self.get()
+                delay = max(self._refresh_at - time.time(), self.MIN_REFRESH)
+            except Exception as e:
+                print(f"⚠️ Wiguna token refresh failed: {e}")
+                delay = self.RETRY
+
+
+wiguna_token = WigunaToken(resolve_wiguna_token, WIGUNA_TOKEN_TTL, WIGUNA_TOKEN_MARGIN)
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Runs up to `max_concurrent_updates` updates at once, but updates sharing a chat or a
+    user run one after another in arrival order.
+
+    A slow /exp2 range no longer holds up other chats, while one chat's Prev/Next presses
+    are applied in order and a /gs never runs ahead of the /ss the same user sent just
+    before it. An update only takes a concurrency slot once it is allowed to run.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max(1, max_concurrent_updates))
+        self._tails = {}  # ("chat" | "user", id) -> future of the last update queued for it
+
+    @staticmethod
+    def ordering_keys(update) -> tuple:
+        if not isinstance(update, Update):
+            return ()
+        keys = []
+        if update.effective_chat is not None:
+            keys.append(("chat", update.effective_chat.id))
+        if update.effective_user is not None:
+            keys.append(("user", update.effective_user.id))
+        return tuple(keys)
+
+    async def process_update(self, update, coroutine):
+        keys = self.ordering_keys(update)
+        previous = {self._tails[key] for key in keys if key in self._tails}
+        done = asyncio.get_running_loop().create_future()
+        for key in keys:
+            self._tails[key] = done
+        try:
+            if previous:
+                await asyncio.wait(previous)
+            await super().process_update(update, coroutine)
+        finally:
+            done.set_result(None)
+            for key in keys:
+                if self._tails.get(key) is done:
+                    del self._tails[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
 def safe_handler(func):
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        token = current_command.set(func.__name__)
+        start = time.perf_counter()
+        error = False
         try:
             await func(update, context)
         except Exception as e:
+            error = True
             print(f"⚠️ Error in {func.__name__}: {e}")
             if update.message:
                 await send_text(update, context, f"⚠️ Terjadi error: {e}")
+        finally:
+            metrics.observe(func.__name__, time.perf_counter() - start, error)
+            current_command.reset(token)
     return wrapper
 
-async def maybe_delete_command(update: Update):
-    """Try to delete the user's command message to reduce chat clutter.
-    Requires the bot to have 'Delete messages' admin permission in groups.
-    Silently ignores failures (e.g., lack of permission or 48h limit).
+class CommandCleaner:
+    """Deletes users' command messages in the background so the group keeps only the answers.
+
+    Handlers only queue the message; every COMMAND_DELETE_INTERVAL seconds a background task
+    removes what each chat queued with one deleteMessages call (up to 100 ids). Needs the
+    'Delete messages' admin right in groups. Deleted and failed ids are counted for /stats;
+    Telegram refusals (no right, 48h limit) are only counted, anything else is also logged,
+    and the task carries on with the next batch.
     """
-    try:
-        if update and getattr(update, "message", None):
-            await update.message.delete()
-    except Exception as e:
-        # Don't break command flow if deletion fails
-        print(f"⚠️ Could not delete command message: {e}")
+
+    BATCH = 100  # Bot API limit for deleteMessages
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.deleted = 0
+        self.failed = 0
+        self._pending = {}  # chat_id -> [message_id, ...]
+        self._task = None
+
+    def add(self, chat_id: int, message_id: int):
+        self._pending.setdefault(chat_id, []).append(message_id)
+
+    async def start(self, app: Application):
+        self._task = asyncio.create_task(self._run(app.bot))
+
+    async def stop(self, app: Application):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush(app.bot)
+
+    async def flush(self, bot):
+        pending, self._pending = self._pending, {}
+        for chat_id, message_ids in pending.items():
+            for start in range(0, len(message_ids), self.BATCH):
+                batch = message_ids[start:start + self.BATCH]
+                try:
+                    await bot.delete_messages(chat_id, batch)
+                    self.deleted += len(batch)
+                except TelegramError:
+                    self.failed += len(batch)
+                except Exception as e:
+                    self.failed += len(batch)
+                    print(f"⚠️ Deleting commands in chat {chat_id} failed: {e!r}")
+
+    async def _run(self, bot):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush(bot)
+
+
+command_cleaner = CommandCleaner(COMMAND_DELETE_INTERVAL)
+
+def maybe_delete_command(update: Update):
+    """Queue the user's command message for deletion (see CommandCleaner)."""
+    message = getattr(update, "message", None) if update else None
+    if message:
+        command_cleaner.add(message.chat_id, message.message_id)
 
 def format_amount(amount: float) -> str:
     emoji = "📈" if amount > 0 else "📉" if amount < 0 else "➖"
     return f"{amount:+,.0f} {emoji}"
 
-async def send_text(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, parse_mode: str | None = None):
+async def send_text(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, parse_mode: str | None = None,
+                    reply_markup: InlineKeyboardMarkup | None = None):
     """Send a plain message to the chat without replying to a (possibly deleted) message."""
     try:
         chat = getattr(update, "effective_chat", None)
         if chat is None:
             return
-        await context.bot.send_message(chat_id=chat.id, text=text, parse_mode=parse_mode)
+        await context.bot.send_message(chat_id=chat.id, text=text, parse_mode=parse_mode, reply_markup=reply_markup)
     except Exception as e:
         # Avoid breaking command flow if sending fails
         print(f"⚠️ Failed to send message: {e}")
@@ -137,10 +900,10 @@ async def set_signal(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Kirim sinyal ke API Wiguna: /ss KODE ENTRY [KETERANGAN]
     Contoh: /ss PSDN 4500 Bullish trend
     """
-    await maybe_delete_command(update)
+    maybe_delete_command(update)
 
     try:
-        token = await asyncio.to_thread(resolve_wiguna_token)
+        token = await wiguna_token.get()
     except Exception as e:
         await send_text(update, context, f"❌ Gagal mendapatkan token Wiguna: {e}")
         return
@@ -167,30 +930,11 @@ async def set_signal(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "keterangan": keterangan,
     }
 
-    def _post():
-        data = json.dumps(payload).encode("utf-8")
-        req = urllib.request.Request(
-            WIGUNA_API_URL,
-            data=data,
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json",
-            },
-            method="POST",
-        )
-        try:
-            with urllib.request.urlopen(req, timeout=60) as resp:
-                resp_body = resp.read().decode("utf-8", errors="ignore")
-                return resp.status, resp_body
-        except urllib.error.HTTPError as e:
-            body = e.read().decode("utf-8", errors="ignore") if hasattr(e, "read") else str(e)
-            return e.code, body
-        except urllib.error.URLError as e:
-            return None, str(e)
-
-    status, body = await asyncio.to_thread(_post)
+    status, body = await wiguna_api.request("POST", WIGUNA_API_URL, token=token, json_body=payload,
+                                            timeout=WIGUNA_SIGNAL_POST_TIMEOUT)
 
     if status and 200 <= status < 300:
+        response_cache.invalidate(WIGUNA_API_URL)  # the next /gs must include this signal
         await send_text(update, context, f"✅ Sinyal terkirim: {kode} entry {entry}\nResponse: {body[:400]}")
     else:
         await send_text(
@@ -208,39 +952,17 @@ async def get_signal_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
     - /gs
     - /gs PSDN
     """
-    await maybe_delete_command(update)
+    maybe_delete_command(update)
 
     try:
-        token = await asyncio.to_thread(resolve_wiguna_token)
+        token = await wiguna_token.get()
     except Exception as e:
         await send_text(update, context, f"❌ Gagal mendapatkan token Wiguna: {e}")
         return
 
     code_filter = context.args[0].upper() if context.args else None
-    url = WIGUNA_API_URL
-    if code_filter:
-        url += f"?code={code_filter}"
-
-    def _get():
-        req = urllib.request.Request(
-            url,
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json",
-            },
-            method="GET",
-        )
-        try:
-            with urllib.request.urlopen(req, timeout=15) as resp:
-                body = resp.read().decode("utf-8", errors="ignore")
-                return resp.status, body
-        except urllib.error.HTTPError as e:
-            body = e.read().decode("utf-8", errors="ignore") if hasattr(e, "read") else str(e)
-            return e.code, body
-        except urllib.error.URLError as e:
-            return None, str(e)
-
-    status, body = await asyncio.to_thread(_get)
+    params = {"code": code_filter} if code_filter else None
+    status, body = await wiguna_get(WIGUNA_API_URL, params, token, WIGUNA_SIGNAL_GET_TIMEOUT)
 
     if not status or status >= 300:
         await send_text(update, context, f"❌ Gagal ambil data sinyal (status: {status}).\n{body[:400]}")
@@ -270,56 +992,389 @@ async def get_signal_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await send_text(update, context, "ℹ️ Tidak ada data sinyal ditemukan.")
 
+# ================ EXP2 TABLE ================
+async def iter_json_records(chunks):
+    """Yield the elements of the first JSON array in an async stream of byte chunks: a
+    top-level array, or the first array member of a top-level object such as {"data": [...]}.
+    Elements are decoded as soon as they are complete, so only one is buffered at a time."""
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    buf, pos = "", 0
+    depth, in_string, escape, started = 0, False, False, False
+    async for chunk in chunks:
+        buf += text.decode(chunk)
+        while not started and pos < len(buf):
+            ch = buf[pos]
+            pos += 1
+            if in_string:
+                if escape:
+                    escape = False
+                elif ch == "\\":
+                    escape = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == "[" and depth <= 1:
+                started = True
+            elif ch in "{[":
+                depth += 1
+            elif ch in "}]":
+                depth -= 1
+        if not started:
+            buf, pos = "", 0
+            continue
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buf):
+                break
+            if buf[pos] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break  # element not complete yet
+            if not isinstance(record, (dict, list)) and (end == len(buf) or buf[end] not in ",] \t\r\n"):
+                break  # a number may continue in the next chunk (1 | .25, 1.5 | e3)
+            yield record
+            pos = end
+        buf, pos = buf[pos:], 0
+    if not started:
+        raise ValueError("tidak ada daftar data di respons")
+    raise ValueError(f"daftar data tidak lengkap: {buf[:200]}")
+
+def exp2_cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return format(value, ".6g")
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    return str(value).replace(Exp2Table.SEP, " ")
+
+class Exp2Table:
+    """exp2 records flattened to display strings; columns in first-seen key order.
+
+    Each row is kept as one SEP-joined string rather than a tuple of cells, which takes
+    about a third of the memory on large daily exports; row(i) splits it back.
+    """
+
+    SEP = "\x1f"  # ASCII unit separator
+
+    def __init__(self, unique: bool = False):
+        self.columns = []
+        self.rows = []
+        self._index = {}  # column name -> position
+        self._seen = set() if unique else None  # rows already added, to drop duplicates
+
+    def add(self, record):
+        if not isinstance(record, dict):
+            record = {"value": record}
+        for key in record:
+            if key not in self._index:
+                self._index[key] = len(self.columns)
+                self.columns.append(key)
+        row = [""] * len(self.columns)
+        for key, value in record.items():
+            row[self._index[key]] = exp2_cell(value)
+        line = self.SEP.join(row).rstrip(self.SEP)  # same record, same line, whatever columns came later
+        if self._seen is not None:
+            if line in self._seen:
+                return
+            self._seen.add(line)
+        self.rows.append(line)
+
+    def seal(self):
+        """Stop dropping duplicate rows and free the set that tracked them."""
+        self._seen = None
+
+    def row(self, i: int) -> list[str]:
+        """Cells of row i, padded to the current column count."""
+        cells = self.rows[i].split(self.SEP)
+        return cells + [""] * (len(self.columns) - len(cells))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the rows and column names."""
+        return (sys.getsizeof(self.rows) + sum(map(sys.getsizeof, self.rows))
+                + sum(map(sys.getsizeof, self.columns)))
+
+    def to_csv(self, compress: bool) -> io.BytesIO:
+        """All rows and columns as CSV (optionally gzipped), rewound."""
+        buf = io.BytesIO()
+        raw = gzip.GzipFile(fileobj=buf, mode="wb", mtime=0) if compress else buf
+        text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        writer = csv.writer(text)
+        writer.writerow(self.columns)
+        writer.writerows(self.row(i) for i in range(len(self.rows)))
+        text.flush()
+        text.detach()
+        if compress:
+            raw.close()  # writes the gzip trailer; leaves buf open
+        buf.seek(0)
+        return buf
+
+async def parse_exp2(chunks) -> Exp2Table:
+    table = Exp2Table()
+    async for record in iter_json_records(chunks):
+        table.add(record)
+    return table
+
+def merge_exp2(tables: list[tuple[str, Exp2Table]]) -> Exp2Table:
+    """All days' records in one table led by a `tanggal` column (the requested date, unless
+    the records carry their own); records that are identical are kept once."""
+    merged = Exp2Table(unique=True)
+    for day, table in tables:
+        for i in range(len(table.rows)):
+            merged.add({"tanggal": day, **{k: v for k, v in zip(table.columns, table.row(i)) if v}})
+    merged.seal()
+    return merged
+
+def exp2_dates(flags: dict, today: date) -> list[str]:
+    """Weekdays from --from to --to (inclusive, --to defaults to today) as YYYY-MM-DD;
+    just today without either flag."""
+    if not flags["--from"] and not flags["--to"]:
+        return [today.isoformat()]
+    try:
+        end = datetime.strptime(flags["--to"], "%Y-%m-%d").date() if flags["--to"] else today
+        start = datetime.strptime(flags["--from"], "%Y-%m-%d").date() if flags["--from"] else end
+    except ValueError:
+        raise ValueError("Format tanggal harus YYYY-MM-DD")
+    if start > end:
+        raise ValueError("--from harus sama dengan atau sebelum --to")
+    if end > today:
+        raise ValueError("--to tidak boleh melewati hari ini")
+    if (end - start).days > EXP2_MAX_DAYS * 7 // 5 + 7:
+        raise ValueError(f"Maksimal {EXP2_MAX_DAYS} hari kerja per permintaan")
+    days = [day.isoformat() for day in (start + timedelta(n) for n in range((end - start).days + 1)) if day.weekday() < 5]
+    if not days:
+        raise ValueError("Tidak ada hari kerja (Senin–Jumat) di rentang itu")
+    if len(days) > EXP2_MAX_DAYS:
+        raise ValueError(f"Maksimal {EXP2_MAX_DAYS} hari kerja per permintaan")
+    return days
+
+async def fetch_exp2_days(days: list[str], token: str, today: str) -> list[tuple[str, int | None, object]]:
+    """(day, status, table or error body) per day, fetched EXP2_CONCURRENCY at a time. Past
+    days are cached for EXP2_PAST_TTL: their data no longer changes."""
+    slots = asyncio.Semaphore(EXP2_CONCURRENCY)
+
+    async def fetch(day):
+        async with slots:
+            status, value = await wiguna_get(WIGUNA_EXP2_URL, {"tanggal": day}, token, WIGUNA_EXP2_TIMEOUT,
+                                             parse=parse_exp2, ttl=EXP2_PAST_TTL if day < today else None)
+        return day, status, value
+    return await asyncio.gather(*(fetch(day) for day in days))
+
+def render_exp2_page(token: str, session: dict) -> tuple[str, InlineKeyboardMarkup]:
+    """One page of the table as aligned monospace text (HTML) with Prev/Next/CSV buttons."""
+    table, page = session["table"], session["page"]
+    pages = max(1, math.ceil(len(table.rows) / EXP2_PAGE_ROWS))
+    shown = len(table.columns[:EXP2_COLUMNS])
+    clip = lambda cell: cell if len(cell) <= EXP2_CELL_WIDTH else cell[:EXP2_CELL_WIDTH - 1] + "…"
+    cells = [[clip(name) for name in table.columns[:shown]]]
+    for i in range((page - 1) * EXP2_PAGE_ROWS, min(page * EXP2_PAGE_ROWS, len(table.rows))):
+        cells.append([clip(cell) for cell in table.row(i)[:shown]])
+    widths = [max(len(line[i]) for line in cells) for i in range(shown)]
+    lines = [" ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip() for line in cells]
+    text = (f"✅ Data exp2 untuk {html.escape(session['label'], quote=False)} — hal {page}/{pages} ({len(table.rows):,} baris)\n"
+            f"<pre>{html.escape(chr(10).join(lines), quote=False)}</pre>")
+    if len(table.columns) > shown:
+        text += f"\n+{len(table.columns) - shown} kolom lain ada di CSV"
+    buttons = []
+    if page > 1:
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"x2:{token}:prev"))
+    if page < pages:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"x2:{token}:next"))
+    buttons.append(InlineKeyboardButton("📄 CSV", callback_data=f"x2:{token}:csv"))
+    return text, InlineKeyboardMarkup([buttons])
+
+async def send_exp2_csv(update: Update, context: ContextTypes.DEFAULT_TYPE, table: Exp2Table, label: str,
+                        compress: bool):
+    filename = f"exp2_{label}.csv" + (".gz" if compress else "")
+    with table.to_csv(compress) as buf:
+        await context.bot.send_document(update.effective_chat.id, buf, filename=filename,
+                                        caption=f"📄 Data exp2 {label} ({len(table.rows):,} baris)")
+
 @safe_handler
 async def get_exp2_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Ambil data dari endpoint exp2 Wiguna berdasarkan tanggal hari ini (weekday date)."""
-    await maybe_delete_command(update)
+    """Ambil data dari endpoint exp2 Wiguna berdasarkan tanggal hari ini (weekday date).
+    /exp2 [--from YYYY-MM-DD] [--to YYYY-MM-DD] [--csv | --gzip] — tabel berhalaman di chat,
+    atau seluruh data sebagai CSV (.gz); dengan --from/--to semua hari kerja di rentang itu
+    """
+    maybe_delete_command(update)
+    flags = parse_flags(context.args)
+    compress = "--gzip" in flags["args"]
+    as_csv = compress or "--csv" in flags["args"]
 
+    # Default: tanggal hari ini di zona Asia/Jakarta
+    today_jakarta = datetime.now(JAKARTA_TZ).date()
     try:
-        token = await asyncio.to_thread(resolve_wiguna_token)
+        days = exp2_dates(flags, today_jakarta)
+    except ValueError as e:
+        await send_text(update, context, f"❌ {e}")
+        return
+
+    try:
+        token = await wiguna_token.get()
     except Exception as e:
         await send_text(update, context, f"❌ Gagal mendapatkan token Wiguna: {e}")
         return
 
-    # Default: tanggal hari ini di zona Asia/Jakarta
-    today_jakarta = datetime.now(JAKARTA_TZ).strftime("%Y-%m-%d")
-    url = f"https://api.wigunainvestment.com/saham/exp2?tanggal={today_jakarta}"
-
-    def _get():
-        req = urllib.request.Request(
-            url,
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json",
-            },
-            method="GET",
-        )
-        try:
-            with urllib.request.urlopen(req, timeout=60) as resp:
-                body = resp.read().decode("utf-8", errors="ignore")
-                return resp.status, body
-        except urllib.error.HTTPError as e:
-            body = e.read().decode("utf-8", errors="ignore") if hasattr(e, "read") else str(e)
-            return e.code, body
-        except urllib.error.URLError as e:
-            return None, str(e)
-
-    status, body = await asyncio.to_thread(_get)
-
-    if status and 200 <= status < 300:
-        preview = body[:1000]  # Limit panjang respons
-        await send_text(update, context, f"✅ Data exp2 untuk {today_jakarta}:\n\n{preview}")
-    else:
+    results = await fetch_exp2_days(days, token, today_jakarta.isoformat())
+    tables = [(day, value) for day, status, value in results if status and 200 <= status < 300]
+    failed = [(day, status, value) for day, status, value in results if not status or status >= 300]
+    if not tables:
+        _, status, body = failed[0]
         await send_text(
             update,
             context,
-            f"❌ Gagal ambil data exp2 (status: {status}).\nBody/Err: {body[:400]}"
+            f"❌ Gagal ambil data exp2 (status: {status}).\nBody/Err: {str(body)[:400]}"
         )
+        return
+    if failed:
+        await send_text(update, context, "⚠️ Sebagian tanggal gagal diambil: "
+                        + ", ".join(f"{day} (status: {status})" for day, status, _ in failed))
+    table = tables[0][1] if len(days) == 1 else merge_exp2(tables)
+    label = days[0] if len(days) == 1 else f"{days[0]}..{days[-1]}"
+    if not table.rows:
+        await send_text(update, context, f"ℹ️ Tidak ada data exp2 untuk {label}.")
+        return
+    size = 0 if as_csv else table.nbytes()
+    if size > exp2_sessions.max_bytes:
+        await send_text(update, context, f"ℹ️ Data exp2 {label} terlalu besar untuk tabel berhalaman, dikirim sebagai CSV.")
+        as_csv = True
+    if as_csv:
+        await send_exp2_csv(update, context, table, label, compress)
+        return
+
+    token, session = open_exp2_session(context, update.effective_chat.id, table, label, size)
+    text, markup = render_exp2_page(token, session)
+    await send_text(update, context, text, parse_mode="HTML", reply_markup=markup)
+
+class Exp2Sessions:
+    """Index of the /exp2 tables kept for paging in every chat's chat_data, oldest first.
+
+    Bounds them across all chats to `size` tables and `max_bytes` of rows
+    (Exp2Table.nbytes); a multi-day table is a fresh merge, so it is not covered by the
+    response cache budget.
+    """
+
+    def __init__(self, size: int, max_bytes: int):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._open = OrderedDict()  # (chat_id, token) -> table bytes
+
+    def add(self, chat_id: int, token: str, size: int):
+        self._open[(chat_id, token)] = size
+        self.bytes += size
+
+    def discard(self, chat_id: int, token: str):
+        self.bytes -= self._open.pop((chat_id, token), 0)
+
+    def overflow(self) -> list[tuple[int, str]]:
+        """Forget the oldest tables until within bounds (never the newest); returns them."""
+        dropped = []
+        while len(self._open) > 1 and (len(self._open) > self.size or self.bytes > self.max_bytes):
+            key, size = self._open.popitem(last=False)
+            self.bytes -= size
+            dropped.append(key)
+        return dropped
+
+    def __len__(self):
+        return len(self._open)
+
+
+exp2_sessions = Exp2Sessions(EXP2_SESSIONS_TOTAL, int(EXP2_SESSIONS_MB * 1024 * 1024))
+
+def open_exp2_session(context: ContextTypes.DEFAULT_TYPE, chat_id: int, table: Exp2Table,
+                      label: str, size: int) -> tuple[str, dict]:
+    """Keep a table (of `size` bytes) for its Prev/Next/CSV buttons. Paging state lives
+    server-side in chat_data; callback_data only carries the short token returned here."""
+    sessions = context.chat_data.setdefault("exp2", {})
+    token = secrets.token_hex(4)
+    session = sessions[token] = {"table": table, "label": label, "page": 1}
+    exp2_sessions.add(chat_id, token, size)
+    while len(sessions) > EXP2_SESSIONS_PER_CHAT:
+        old_token = next(iter(sessions))
+        del sessions[old_token]
+        exp2_sessions.discard(chat_id, old_token)
+    for old_chat, old_token in exp2_sessions.overflow():
+        context.application.chat_data.get(old_chat, {}).get("exp2", {}).pop(old_token, None)
+    return token, session
+
+@safe_handler
+async def exp2_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Prev/Next/CSV buttons under an /exp2 table (callback data x2:TOKEN:prev|next|csv)"""
+    query = update.callback_query
+    _, token, action = query.data.split(":")
+    session = context.chat_data.get("exp2", {}).get(token)
+    if session is None:
+        await query.answer("⌛ Tabel ini sudah kedaluwarsa, jalankan /exp2 lagi.")
+        return
+    if action == "csv":
+        await query.answer()
+        await send_exp2_csv(update, context, session["table"], session["label"], compress=False)
+        return
+    pages = max(1, math.ceil(len(session["table"].rows) / EXP2_PAGE_ROWS))
+    page = min(pages, max(1, session["page"] + (1 if action == "next" else -1)))
+    if page == session["page"]:
+        await query.answer("Tidak ada halaman lagi.")
+        return
+    session["page"] = page
+    text, markup = render_exp2_page(token, session)
+    await query.answer()
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=markup)
 
  # ================== MAIN ==================
 @safe_handler
+async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: /stats — latensi handler, error, dan waktu Wiguna/Telegram per panggilan"""
+    maybe_delete_command(update)
+    if not user_is_admin(update):
+        await send_text(update, context, "⛔ Hanya admin yang bisa memakai /stats")
+        return
+    uptime = round(time.monotonic() - metrics.started)
+    lines = metrics.summary() or ["Belum ada command yang diproses."]
+    expires_in = wiguna_token.expires_in()
+    lines.append(f"🔑 Token Wiguna: {wiguna_token.logins} login, {wiguna_token.failures} gagal, "
+                 + (f"berlaku {expires_in / 60:.0f} menit lagi" if expires_in is not None else "belum ada"))
+    lines.append(f"🧹 Command dihapus: {command_cleaner.deleted:,} (gagal: {command_cleaner.failed:,})")
+    await send_text(update, context, f"⏱️ Handler stats (up {uptime // 3600}h{uptime % 3600 // 60:02d}m)\n\n" + "\n".join(lines))
+
+@safe_handler
+async def admin_cache(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: /cache [flush] — isi cache respons Wiguna (/gs, /exp2), atau kosongkan"""
+    maybe_delete_command(update)
+    if not user_is_admin(update):
+        await send_text(update, context, "⛔ Hanya admin yang bisa memakai /cache")
+        return
+    if context.args and context.args[0].lower() == "flush":
+        await send_text(update, context, f"🧹 Cache dikosongkan ({response_cache.clear()} entri)")
+        return
+    lookups = response_cache.hits + response_cache.misses + response_cache.coalesced
+    ratio = f"{(response_cache.hits + response_cache.coalesced) / lookups:.0%}" if lookups else "n/a"
+    lines = [f"🗃️ Cache respons Wiguna (TTL {response_cache.ttl:g}s)",
+             "",
+             f"Hit: {response_cache.hits:,} | Gabung: {response_cache.coalesced:,} | Miss: {response_cache.misses:,} ({ratio} tanpa panggilan API)",
+             f"Revalidasi 304: {response_cache.revalidated:,}",
+             f"Entri: {len(response_cache)}/{response_cache.size}, "
+             f"{response_cache.bytes / 2**20:.1f}/{response_cache.max_bytes / 2**20:.0f} MiB",
+             f"Tabel /exp2 terbuka: {len(exp2_sessions)}/{exp2_sessions.size}, "
+             f"{exp2_sessions.bytes / 2**20:.1f}/{exp2_sessions.max_bytes / 2**20:.0f} MiB"]
+    for (url, query), value, expires_in, conditional in response_cache.entries()[:20]:
+        path = urlsplit(url).path + ("?" + "&".join(f"{k}={v}" for k, v in query) if query else "")
+        size = f"{len(value):,} byte" if isinstance(value, str) else f"{len(value):,} baris"
+        state = f"{expires_in:.0f}s lagi" if expires_in > 0 else "kedaluwarsa"
+        lines.append(f"- {path}: {size}, {state}" + (" (ETag/Last-Modified)" if conditional else ""))
+    await send_text(update, context, "\n".join(lines))
+
+@safe_handler
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await maybe_delete_command(update)
+    maybe_delete_command(update)
     msg = """
 📘 Panduan Cepat Wiguna
 
@@ -331,15 +1386,78 @@ Contoh: /ss PSDN 4500 Bullish trend
 Ambil data sinyal terakhir dari API Wiguna (opsional filter kode).
 
 Data Exp2
-- /exp2
-Ambil data ekspor saham (exp2) berdasarkan tanggal hari ini (weekday date).
+- /exp2 [--from YYYY-MM-DD] [--to YYYY-MM-DD] [--csv | --gzip]
+Ambil data ekspor saham (exp2) berdasarkan tanggal hari ini (weekday date), sebagai tabel berhalaman atau file CSV.
+Dengan --from/--to: semua hari kerja di rentang itu (maks. 31), digabung jadi satu tabel.
+
+Admin
+- /stats — Latensi command, error, dan waktu API
+- /cache [flush] — Cache respons /gs dan /exp2, atau kosongkan
 """
     await send_text(update, context, msg, parse_mode="Markdown")
 
+async def run_webhook(app: Application):
+    """Serve updates pushed to WEBHOOK_URL; the webhook counterpart of app.run_polling()."""
+    server = WebhookServer(urlsplit(WEBHOOK_URL).path or "/", WEBHOOK_SECRET,
+                           lambda data: app.update_queue.put(Update.de_json(data, app.bot)))
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    try:
+        port = await server.start(WEBHOOK_LISTEN, WEBHOOK_PORT)
+        metrics_server.webhook = server
+        await app.bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES)
+        print(f"🌐 Webhook listening on {WEBHOOK_LISTEN}:{port}{server.path}")
+        await stop.wait()
+    finally:
+        metrics_server.webhook = None
+        await server.close()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+def update_recorder(path: str):
+    """Handler that appends every incoming update to `path` as JSON lines
+    ({"t": unix time received, "update": ...}), for tools/replay_load.py."""
+    capture = open(path, "a", encoding="utf-8", buffering=1)
+
+    async def record(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        capture.write(json.dumps({"t": time.time(), "update": update.to_dict()}, ensure_ascii=False) + "\n")
+    return record
+
+async def start_services(app: Application):
+    await command_cleaner.start(app)
+    await wiguna_api.start()
+    await wiguna_token.start()
+    if METRICS_PORT:
+        port = await metrics_server.start(METRICS_LISTEN, METRICS_PORT)
+        print(f"📈 Metrics on http://{METRICS_LISTEN}:{port}{metrics_server.METRICS_PATH}")
+
+async def stop_services(app: Application):
+    await metrics_server.close()
+    await wiguna_token.stop()
+    await wiguna_api.close()
+    await command_cleaner.stop(app)
+
 def main():
-    app = Application.builder().token(BOT_TOKEN).build()
+    app = (Application.builder().token(BOT_TOKEN)
+           .base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+           .request(TimedRequest(connection_pool_size=BOT_CONNECTION_POOL))
+           .concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_UPDATES))
+           .post_init(start_services).post_stop(stop_services).build())
     job_queue = app.job_queue
 
+    if CAPTURE_PATH:
+        app.add_handler(TypeHandler(Update, update_recorder(CAPTURE_PATH)), group=-1)
+
     # HELP
     app.add_handler(CommandHandler("help", help_command))
 
@@ -351,6 +1469,11 @@ def main():
 
     # EXP2 DATA
     app.add_handler(CommandHandler("exp2", get_exp2_data))
+    app.add_handler(CallbackQueryHandler(exp2_page, pattern=r"^x2:"))
+
+    # ADMIN STATS
+    app.add_handler(CommandHandler("stats", admin_stats))
+    app.add_handler(CommandHandler("cache", admin_cache))
 
     print("🚀 Bot running...")
 
@@ -360,7 +1483,10 @@ def main():
             await send_text(update, context, f"⚠️ Terjadi error: {context.error}")
 
     app.add_error_handler(error_handler)
-    app.run_polling()
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(app))
+    else:
+        app.run_polling()
 
 if __name__ == "__main__":
     main()